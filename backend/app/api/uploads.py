@@ -1,24 +1,61 @@
 import asyncio
 import logging
+import shutil
+import threading
 import uuid
+from dataclasses import asdict, fields
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, Form, Header, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 
 from ..config import settings
+from ..services.batches import EventBatch, build_batch
 from ..services.capi_client import CapiClient
-from ..services.progress import JobProgress, progress_store
-from ..services.transform import TransformConfig, iter_event_batches
+from ..services.dedup import sent_event_index
+from ..services.dispatcher import BatchDispatcher
+from ..services.events import stream_progress
+from ..services.failed_spool import FailedBatchSpool
+from ..services.input_formats import STREAMABLE_FORMATS, InputFormatError, check_zip, detect_input_format
+from ..services.pipeline import JobPipeline, ProgressSink
+from ..services.progress import META_REJECTION_PREFIX, Checkpoint, JobProgress, progress_store
+from ..services.row_plans import get_schema
+from ..services.scheduler import QueuedJob, job_scheduler
+from ..services.transform import TransformConfig, iter_event_batches, rejected_event_row
+from ..services.upload_stream import UploadTee
+from ..utils.jsonenc import loads
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _resolve_token(company: str, access_token: Optional[str]) -> Optional[str]:
+    """Determinar el token según la empresa."""
+    if company == "sanasana":
+        # SanaSana usa su propio token
+        return access_token or "EAAC7kR5pkCABPqw4pZAZACWMqGpSQGtTKxZC4dGtmG5rHA2JE8oWjS2i1mJ9ZBn0ywpZCX1exp2hNAOipfhEyXj1DMbRpYjdpHscLuXYrxDjgbUXe9RM6VZCc0mmP1q8n7NsxKZApaC2C1pL6akXUZBjcdvjt4GE08QtZB4YZAFHQ0TQKRXekJaG0ZAoZBptsqxN2wZDZD"
+    # Fybeca usa el token del .env
+    return settings.meta_access_token
+
+
+def _saved_config(cfg: TransformConfig, token: str) -> dict:
+    """What is kept to resume the job: its config, and whether its token is one of its own.
+
+    The token itself is never saved, so a job sent with a token other than the
+    company's cannot be resumed without being given it again.
+    """
+    return {**asdict(cfg), "custom_token": token != _resolve_token(cfg.company, None)}
+
+
+def _transform_config(job_config: dict) -> TransformConfig:
+    names = {f.name for f in fields(TransformConfig)}
+    return TransformConfig(**{key: value for key, value in job_config.items() if key in names})
+
+
 @router.post("/uploads")
 async def create_upload(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     dataset_id: str = Form(...),
     event_name: str = Form("Purchase"),
@@ -26,82 +63,300 @@ async def create_upload(
     timezone: str = Form(None),
     company: str = Form("fybeca"),  # Nueva opción: "fybeca" o "sanasana"
     access_token: Optional[str] = Form(None),  # Token opcional si se proporciona
+    skip_duplicates: bool = Form(True),  # False para reenviar eventos que otra carga ya envió
+    aggregate_invoices: bool = Form(False),  # True para enviar una compra por factura en vez de una por producto
 ):
-    # Determinar el token según la empresa
-    if company == "sanasana":
-        # SanaSana usa su propio token
-        token = access_token or "EAAC7kR5pkCABPqw4pZAZACWMqGpSQGtTKxZC4dGtmG5rHA2JE8oWjS2i1mJ9ZBn0ywpZCX1exp2hNAOipfhEyXj1DMbRpYjdpHscLuXYrxDjgbUXe9RM6VZCc0mmP1q8n7NsxKZApaC2C1pL6akXUZBjcdvjt4GE08QtZB4YZAFHQ0TQKRXekJaG0ZAoZBptsqxN2wZDZD"
-    else:
-        # Fybeca usa el token del .env
-        token = settings.meta_access_token
-    
+    token = _resolve_token(company, access_token)
     if not token:
         raise HTTPException(status_code=500, detail="Token de acceso no configurado para esta empresa")
 
-    if not file.filename or not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Solo se aceptan archivos .csv")
+    try:
+        input_format = detect_input_format(file.filename or "")
+    except InputFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     job_id = str(uuid.uuid4())
     job_dir = progress_store.job_dir(job_id)
-    input_path = progress_store.input_path(job_id)
+    # Compressed files are stored as uploaded and decompressed while the job reads them
+    input_path = progress_store.input_path(job_id, input_format)
 
-    # Persist file to disk in chunks to support large files
+    # Persist file to disk in chunks to support large files, counting lines on the way
+    # so the job can show a row estimate without parsing the CSV twice
+    uploaded_bytes = 0
+    newlines = 0
+    last_byte = b"\n"
     with input_path.open("wb") as out:
         while True:
             chunk = await file.read(1024 * 1024)
             if not chunk:
                 break
             out.write(chunk)
+            uploaded_bytes += len(chunk)
+            if input_format == "csv":
+                newlines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+    if input_format == "csv":
+        lines = newlines + (0 if last_byte == b"\n" else 1)
+        estimated_rows = max(lines - 1, 0)  # minus header
+        total_bytes = uploaded_bytes
+    else:
+        # Rows and uncompressed size are estimated by the job as it decompresses
+        estimated_rows = total_bytes = 0
+    if input_format == "zip":
+        try:
+            check_zip(input_path)
+        except InputFormatError as exc:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise HTTPException(status_code=400, detail=str(exc))
 
-    progress = JobProgress(job_id=job_id, status="running")
+    progress = JobProgress(
+        job_id=job_id,
+        status="pending",
+        total_rows=estimated_rows,
+        estimated_total_rows=estimated_rows,
+        total_bytes=total_bytes,
+        uploaded_bytes=uploaded_bytes,
+    )
     progress_store.set(progress)
 
     tz = timezone or settings.timezone_default
-    cfg = TransformConfig(dataset_id=dataset_id, event_name=event_name, upload_tag=upload_tag, timezone=tz)
+    cfg = TransformConfig(
+        dataset_id=dataset_id,
+        company=company,
+        event_name=event_name,
+        upload_tag=upload_tag,
+        timezone=tz,
+        skip_duplicates=skip_duplicates,
+        aggregate_invoices=aggregate_invoices,
+    )
+    # Everything but the token is kept so the job can be resumed after a restart
+    progress_store.save_job_config(job_id, _saved_config(cfg, token))
 
-    background_tasks.add_task(_process_job, job_id, cfg, token)
+    # Starts right away if there is a free slot, otherwise waits in the scheduler queue
+    job_scheduler.enqueue(QueuedJob(job_id, company, cfg, token))
 
-    return {"job_id": job_id}
+    return {"job_id": job_id, "queue_position": job_scheduler.position(job_id)}
 
 
-async def _process_job(job_id: str, cfg: TransformConfig, access_token: str) -> None:
+@router.post("/uploads/stream")
+async def create_streaming_upload(
+    request: Request,
+    dataset_id: str = Query(...),
+    event_name: str = Query("Purchase"),
+    upload_tag: Optional[str] = Query(None),
+    timezone: Optional[str] = Query(None),
+    company: str = Query("fybeca"),
+    filename: Optional[str] = Query(None),
+    job_id: Optional[str] = Query(None),  # Generado por el cliente para consultar el progreso durante la carga
+    skip_duplicates: bool = Query(True),
+    aggregate_invoices: bool = Query(False),
+    access_token: Optional[str] = Header(None, alias="X-Access-Token"),
+):
+    """Upload the CSV as the raw request body and process it while it is being received.
+
+    Rows are transformed and batches sent as soon as they arrive, so a large file
+    starts reaching Meta long before the upload finishes. The response is sent
+    once the whole body was received; pass `job_id` to follow the job meanwhile.
+    """
+    token = _resolve_token(company, access_token)
+    if not token:
+        raise HTTPException(status_code=500, detail="Token de acceso no configurado para esta empresa")
+
+    try:
+        input_format = detect_input_format(filename or "input.csv")
+    except InputFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if input_format not in STREAMABLE_FORMATS:
+        raise HTTPException(status_code=400, detail="Los .zip no se pueden procesar durante la carga; usa .csv, .csv.gz o .csv.zst")
+
+    if job_id:
+        try:
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="job_id inválido")
+        if progress_store.db.exists(job_id):
+            raise HTTPException(status_code=409, detail="Ya existe un job con ese job_id")
+    else:
+        job_id = str(uuid.uuid4())
+
+    expected_bytes = int(request.headers.get("content-length") or 0)
+    progress = JobProgress(job_id=job_id, status="pending", total_bytes=expected_bytes, upload_complete=False)
+    progress_store.set(progress)
+
+    tz = timezone or settings.timezone_default
+    cfg = TransformConfig(
+        dataset_id=dataset_id,
+        company=company,
+        event_name=event_name,
+        upload_tag=upload_tag,
+        timezone=tz,
+        skip_duplicates=skip_duplicates,
+        aggregate_invoices=aggregate_invoices,
+    )
+    progress_store.save_job_config(job_id, _saved_config(cfg, token))
+
+    upload = UploadTee(progress_store.input_path(job_id, input_format), expected_bytes)
+    # If the job has to wait in the queue the upload keeps going to disk meanwhile
+    job_scheduler.enqueue(QueuedJob(job_id, company, cfg, token, upload=upload))
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                upload.write(chunk)
+    except ClientDisconnect:
+        upload.fail("La carga del archivo se interrumpió antes de terminar")
+        logger.warning(f"Client disconnected while uploading job {job_id}")
+        raise HTTPException(status_code=400, detail="La carga del archivo se interrumpió")
+    upload.close()
+    if not job_scheduler.is_running(job_id):
+        # The job is queued or stopped before the upload ended (cancelled, bad headers): record it here
+        _record_upload_complete(job_id, upload)
+
+    return {"job_id": job_id, "uploaded_bytes": upload.received_bytes}
+
+
+def _record_upload_complete(job_id: str, upload: UploadTee) -> None:
+    progress = progress_store.get(job_id)
+    if progress and not progress.upload_complete:
+        progress.uploaded_bytes = upload.received_bytes
+        progress.upload_complete = True
+        progress_store.set(progress)
+
+
+async def _process_job(
+    job_id: str,
+    cfg: TransformConfig,
+    access_token: str,
+    resume: bool = False,
+    upload: Optional[UploadTee] = None,
+    retry_failed: bool = False,
+) -> None:
+    try:
+        if retry_failed:
+            await _retry_failed_batches(job_id, cfg, access_token)
+        else:
+            await _run_job(job_id, cfg, access_token, resume, upload)
+    finally:
+        progress_store.untrack(job_id)
+        if upload is not None and upload.complete:
+            _record_upload_complete(job_id, upload)
+
+
+job_scheduler.set_runner(_process_job)
+
+
+async def _run_job(job_id: str, cfg: TransformConfig, access_token: str, resume: bool, upload: Optional[UploadTee]) -> None:
     logger.info(f"Starting job {job_id} for dataset {cfg.dataset_id}")
     progress = progress_store.get(job_id)
     if not progress:
         progress = JobProgress(job_id=job_id, status="running")
 
+    checkpoint = progress_store.get_checkpoint(job_id) if resume else None
+    spool = FailedBatchSpool(progress_store.failed_spool_path(job_id))
+    if resume:
+        # Failed batches after the checkpoint are sent again with the rest
+        await asyncio.to_thread(spool.truncate_after, checkpoint.batches_done if checkpoint else 0)
+    if checkpoint:
+        # Rows after the checkpoint are read and sent again, so their counters and
+        # error rows from the interrupted run are discarded
+        logger.info(f"Resuming job {job_id} after batch {checkpoint.batches_done} (byte {checkpoint.byte_offset})")
+        checkpoint.apply_to(progress)
+        await asyncio.to_thread(progress_store.truncate_errors, job_id, checkpoint.failed, checkpoint.rejected_events)
+    elif resume:
+        logger.info(f"Restarting job {job_id} from the beginning (no checkpoint)")
+        Checkpoint().apply_to(progress)
+        await asyncio.to_thread(progress_store.truncate_errors, job_id, 0)
+    if resume:
+        progress.should_cancel = False
+    progress.status = "running"
+    progress.message = ""
+    progress.queue_position = 0
+    progress.failed_batches = progress.failed_batch_events = 0
+    progress_store.set(progress)
+    # From here on status requests read this object instead of progress.json
+    progress_store.track(progress)
+
     try:
         # Stream-transform and send in batches without keeping all events in memory
-        failed_batches = 0
-        total_batches = 0
         client = CapiClient(access_token=access_token)
+        # Set by the pipeline when it stops, so a transform waiting on a stalled upload gives up
+        stop = threading.Event()
+        sink = ProgressSink(
+            job_id,
+            progress,
+            progress_store,
+            settings.progress_flush_interval,
+            _record_sent(job_id, cfg),
+            spool.append,
+            _record_rejected(job_id, cfg, progress),
+        )
+        dispatcher = BatchDispatcher(
+            client,
+            cfg.dataset_id,
+            cfg.upload_tag,
+            settings.max_in_flight_batches,
+            on_checkpoint=sink.checkpoint,
+            start=checkpoint,
+            shared_slots=job_scheduler.batch_slots(),
+            on_sent=sink.sent,
+            on_failed=sink.failed,
+            on_rejected=sink.rejected,
+            bisect_max_requests=settings.bisect_max_requests,
+        )
+        batches = iter_event_batches(
+            upload.path if upload is not None else progress_store.find_input(job_id),
+            cfg,
+            progress,
+            progress_store,
+            settings.batch_size,
+            start_offset=checkpoint.byte_offset if checkpoint else 0,
+            upload=upload,
+            aggregate_checkpoint=checkpoint,
+            stop=stop,
+        )
+        # CSV parsing, normalization and hashing run in a worker thread so the
+        # event loop stays free to serve other requests meanwhile
+        pipeline = JobPipeline(
+            job_id,
+            batches,
+            dispatcher,
+            sink,
+            settings.pipeline_queue_batches,
+            cancelled=job_scheduler.cancel_token(job_id),
+            abort_grace=settings.cancel_grace_seconds,
+            stop=stop,
+        )
         try:
-            for batch in iter_event_batches(progress_store.input_path(job_id), cfg, progress, progress_store, settings.batch_size):
-                # Check if cancellation was requested
-                current_progress = progress_store.get(job_id)
-                if current_progress and current_progress.should_cancel:
-                    logger.info(f"Job {job_id} cancelled by user at batch {total_batches}")
-                    progress.status = "cancelled"
-                    progress.message = f"Cancelado por usuario después de {total_batches} lotes"
-                    progress_store.set(progress)
-                    return
-                
-                total_batches += 1
-                logger.info(f"Processing batch {total_batches} ({len(batch)} events)")
-                ok, info = await client.send_batch(cfg.dataset_id, batch, upload_tag=cfg.upload_tag)
-                if not ok:
-                    failed_batches += 1
-                    logger.error(f"Batch {total_batches} failed: {info}")
+            finished = await pipeline.run()
         finally:
             await client.close()
-        
+            progress_store.close_error_writer(job_id)
+
+        if not finished:
+            logger.info(f"Job {job_id} cancelled by user at batch {dispatcher.submitted_batches}")
+            progress.status = "cancelled"
+            progress.message = f"Cancelado por usuario después de {dispatcher.submitted_batches} lotes"
+            progress_store.set(progress)
+            return
+        if progress.status == "failed":
+            # The transform rejected the file (e.g. missing columns) and set the message
+            progress_store.set(progress)
+            return
+
+        total_batches, failed_batches = dispatcher.submitted_batches, dispatcher.failed_batches
         logger.info(f"Job {job_id} finished: {total_batches} batches, {failed_batches} failed")
         if failed_batches > 0:
             progress.status = "failed"
             progress.message = f"Fallaron {failed_batches} lotes al enviar a Meta"
+            progress.failed_batches, progress.failed_batch_events = spool.batches, spool.events
         else:
             progress.status = "completed"
             progress.message = "Completado"
+            if progress.aggregated_events:
+                progress.message += f" ({progress.aggregated_events:,} compras agrupadas por factura)"
+            if progress.skipped_duplicates:
+                progress.message += f" ({progress.skipped_duplicates:,} eventos omitidos: ya se habían enviado en otra carga)"
+            if progress.rejected_events:
+                progress.message += f" ({progress.rejected_events:,} eventos rechazados por Meta, ver reporte de errores)"
         progress_store.set(progress)
     except Exception as exc:
         logger.error(f"Job {job_id} crashed: {exc}", exc_info=True)
@@ -110,58 +365,350 @@ async def _process_job(job_id: str, cfg: TransformConfig, access_token: str) ->
         progress_store.set(progress)
 
 
+def _record_sent(job_id: str, cfg: TransformConfig):
+    """Events Meta accepted are recorded even when the job does not skip duplicates itself."""
+    if not settings.dedup_enabled:
+        return None
+    return lambda keys: sent_event_index.add(cfg.dataset_id, job_id, keys)
+
+
+def _record_rejected(job_id: str, cfg: TransformConfig, progress: JobProgress):
+    """Events Meta rejected go to the error report, with Meta's message as the reason."""
+    schema = get_schema(cfg.company)
+
+    def record(rejected) -> None:
+        for raw, message in rejected:
+            row = rejected_event_row(loads(raw), schema, cfg)
+            progress_store.append_error(job_id, row, META_REJECTION_PREFIX + message)
+        progress.rejected_events += len(rejected)
+
+    return record
+
+
+async def _retry_failed_batches(job_id: str, cfg: TransformConfig, access_token: str) -> None:
+    """Send again the batches of the job's failed-batch spool, as they were first posted.
+
+    Batches Meta rejects once more go to a new spool that replaces the old one
+    when the retry ends. A cancelled or crashed retry leaves the old spool in
+    place; batches it already sent may be sent twice, which Meta deduplicates
+    by event_id.
+    """
+    progress = progress_store.get(job_id)
+    spool = FailedBatchSpool(progress_store.failed_spool_path(job_id))
+    still_failing = FailedBatchSpool(spool.path.with_name("failed_batches.retry.spool"))
+    still_failing.clear()
+    logger.info(f"Retrying {spool.batches} failed batches ({spool.events} events) of job {job_id}")
+    progress.should_cancel = False
+    progress.status = "running"
+    progress.message = f"Reintentando {spool.batches} lotes fallidos"
+    progress.queue_position = 0
+    progress.failed_batches, progress.failed_batch_events = spool.batches, spool.events
+    progress_store.set(progress)
+    progress_store.track(progress)
+
+    # Spool batch number of each batch handed to the dispatcher, which numbers them 1..n
+    numbers: List[int] = []
+
+    def batches():
+        for number, events, keys in spool.read():
+            numbers.append(number)
+            yield build_batch(events, cfg.upload_tag, settings.request_gzip, event_keys=keys)
+
+    def update_failed() -> None:
+        # Batches not settled yet plus those that failed again; bisected batches
+        # are reported to both hooks, so the hooks cannot simply count down
+        progress.failed_batches = spool.batches - dispatcher.sent_batches
+        progress.failed_batch_events = spool.events - dispatcher.sent_events - dispatcher.rejected_events
+
+    def sent(batch: EventBatch) -> None:
+        sink.sent(batch)
+        update_failed()
+
+    def failed(number: int, batch: EventBatch) -> None:
+        sink.failed(number, batch)
+        update_failed()
+
+    try:
+        client = CapiClient(access_token=access_token)
+        # Events Meta rejects are added to the job's error report
+        progress_store.open_error_writer(job_id, get_schema(cfg.company).columns)
+        sink = ProgressSink(
+            job_id,
+            progress,
+            progress_store,
+            settings.progress_flush_interval,
+            _record_sent(job_id, cfg),
+            lambda number, batch: still_failing.append(numbers[number - 1], batch),
+            _record_rejected(job_id, cfg, progress),
+        )
+        dispatcher = BatchDispatcher(
+            client,
+            cfg.dataset_id,
+            cfg.upload_tag,
+            settings.max_in_flight_batches,
+            shared_slots=job_scheduler.batch_slots(),
+            on_sent=sent,
+            on_failed=failed,
+            on_rejected=sink.rejected,
+            bisect_max_requests=settings.bisect_max_requests,
+        )
+        pipeline = JobPipeline(
+            job_id,
+            batches(),
+            dispatcher,
+            sink,
+            settings.pipeline_queue_batches,
+            cancelled=job_scheduler.cancel_token(job_id),
+            abort_grace=settings.cancel_grace_seconds,
+        )
+        try:
+            finished = await pipeline.run()
+        finally:
+            await client.close()
+            progress_store.close_error_writer(job_id)
+        checkpoint = progress_store.get_checkpoint(job_id)
+        if checkpoint:
+            # Keeps the rejected events reported so far if the job is resumed later
+            checkpoint.rejected_events = progress.rejected_events
+            progress_store.save_checkpoint(job_id, checkpoint)
+
+        if not finished:
+            still_failing.clear()
+            progress.failed_batches, progress.failed_batch_events = spool.batches, spool.events
+            progress.status = "failed"
+            progress.message = f"Reintento cancelado; quedan {spool.batches} lotes fallidos"
+            progress_store.set(progress)
+            return
+
+        resent = dispatcher.sent_batches
+        still_failing.replace(spool)
+        if checkpoint:
+            checkpoint.failed_batches = spool.batches
+            progress_store.save_checkpoint(job_id, checkpoint)
+        logger.info(f"Job {job_id} retry finished: {resent} batches sent, {spool.batches} still failing")
+        progress.failed_batches, progress.failed_batch_events = spool.batches, spool.events
+        if spool.batches:
+            progress.status = "failed"
+            progress.message = f"Fallaron {spool.batches} lotes al enviar a Meta ({resent} reenviados en el reintento)"
+        else:
+            progress.status = "completed"
+            progress.message = f"Completado ({resent} lotes fallidos reenviados)"
+        if dispatcher.rejected_events:
+            progress.message += f" ({dispatcher.rejected_events:,} eventos rechazados por Meta, ver reporte de errores)"
+        progress_store.set(progress)
+    except Exception as exc:
+        logger.error(f"Retry of job {job_id} crashed: {exc}", exc_info=True)
+        still_failing.clear()
+        progress.failed_batches, progress.failed_batch_events = spool.batches, spool.events
+        progress.status = "failed"
+        progress.message = f"Error: {exc}"
+        progress_store.set(progress)
+
+
+async def resume_interrupted_jobs() -> None:
+    """Queue again the jobs left running or pending by a previous process (crash, deploy).
+
+    Jobs that were running go first, then the queue saved by that process in order.
+    """
+    imported = await asyncio.to_thread(progress_store.import_legacy_jobs)
+    if imported:
+        logger.info(f"Imported {imported} jobs from progress.json files into the job database")
+    queue_order = {job_id: i for i, job_id in enumerate(job_scheduler.persisted_order())}
+    active, _ = progress_store.list_jobs(statuses=("running", "pending"), limit=-1)
+    candidates = []
+    for job in active:
+        job_id = job["job_id"]
+        rank = -1 if job["status"] == "running" else queue_order.get(job_id, len(queue_order))
+        candidates.append((rank, job["created_at"], job_id))
+    for _, _, job_id in sorted(candidates):
+        progress = progress_store.get(job_id)
+        job_config = progress_store.get_job_config(job_id)
+        if not progress or progress.status not in ("running", "pending") or not job_config:
+            continue
+        if not progress.upload_complete:
+            progress.status = "failed"
+            progress.message = "La carga del archivo no terminó; vuelve a subirlo"
+            progress_store.set(progress)
+            continue
+        if progress.should_cancel:
+            progress.status = "cancelled"
+            progress.message = "Cancelado por usuario"
+            progress_store.set(progress)
+            continue
+        if job_config.get("custom_token"):
+            # Its token was not saved: the company's one would send the events elsewhere
+            logger.warning(f"Cannot resume job {job_id}: it was sent with its own access token")
+            progress.status = "failed"
+            progress.message = "Interrumpido por un reinicio; reanúdalo con su token de acceso"
+            progress.queue_position = 0
+            progress_store.set(progress)
+            continue
+        company = job_config.get("company", "fybeca")
+        token = _resolve_token(company, None)
+        if not token:
+            logger.warning(f"Cannot resume job {job_id}: no access token for {company}")
+            continue
+        cfg = _transform_config(job_config)
+        job_scheduler.enqueue(QueuedJob(job_id, company, cfg, token, resume=True))
+        logger.info(f"Job {job_id} scheduled for resume")
+
+
 @router.post("/jobs/cancel-all")
 async def cancel_all_jobs():
     """Cancel all running and pending jobs"""
     cancelled_jobs = []
-    jobs_dir = settings.uploads_dir
-    
-    if not jobs_dir.exists():
-        return {"message": "No hay jobs", "cancelled": []}
-    
-    for job_dir in jobs_dir.iterdir():
-        if job_dir.is_dir():
-            job_id = job_dir.name
-            progress = progress_store.get(job_id)
-            if progress and progress.status in ("running", "pending"):
-                progress.should_cancel = True
-                progress_store.set(progress)
-                cancelled_jobs.append(job_id)
-                logger.info(f"Cancellation requested for job {job_id} (via cancel-all)")
-    
+    # Every pending or running job is in the scheduler, so finished jobs are not even looked at
+    for job_id in job_scheduler.active_jobs():
+        progress = progress_store.current(job_id)
+        if progress and progress.status in ("running", "pending"):
+            _request_cancel(progress)
+            cancelled_jobs.append(job_id)
+            logger.info(f"Cancellation requested for job {job_id} (via cancel-all)")
+
     return {
         "message": f"Se solicitó cancelación de {len(cancelled_jobs)} jobs",
         "cancelled": cancelled_jobs
     }
 
 
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[List[str]] = Query(None),  # Se puede repetir: ?status=running&status=pending
+    dataset_id: Optional[str] = Query(None),
+    company: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+):
+    """Jobs newest first, with their progress, dataset, company and timings"""
+    jobs, total = progress_store.list_jobs(
+        statuses=status or (), dataset_id=dataset_id, company=company, limit=limit, offset=offset
+    )
+    return {"jobs": jobs, "total": total, "limit": limit, "offset": offset}
+
+
 @router.get("/jobs/{job_id}")
 async def get_job(job_id: str):
-    progress = progress_store.get(job_id)
+    progress = progress_store.snapshot(job_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Job no encontrado")
-    return progress.to_dict()
+    return progress
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Progress of a job as Server-Sent Events (replaces polling GET /jobs/{job_id})"""
+    if progress_store.snapshot(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return StreamingResponse(
+        stream_progress(job_id, settings.progress_events_interval, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        # No caching or proxy buffering: each message must reach the browser right away
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post("/jobs/{job_id}/cancel")
 async def cancel_job(job_id: str):
-    progress = progress_store.get(job_id)
+    progress = progress_store.current(job_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Job no encontrado")
     
     if progress.status in ("completed", "failed", "cancelled"):
         raise HTTPException(status_code=400, detail=f"No se puede cancelar un job con estado: {progress.status}")
     
-    # Set cancellation flag
-    progress.should_cancel = True
-    progress_store.set(progress)
+    _request_cancel(progress)
     logger.info(f"Cancellation requested for job {job_id}")
     
     return {"message": "Cancelación solicitada", "job_id": job_id}
 
 
+def _request_cancel(progress: JobProgress) -> None:
+    queued = job_scheduler.queued_job(progress.job_id)
+    state = job_scheduler.cancel(progress.job_id)
+    if state == "running":
+        # The job stops right away; the flag on disk makes a restart before it does cancel it too
+        progress.should_cancel = True
+    elif queued is not None and queued.retry_failed:
+        # A retry that never started: the job keeps its failed batches and can be retried again
+        progress.status = "failed"
+        progress.message = f"Reintento cancelado; quedan {progress.failed_batches} lotes fallidos"
+        progress.queue_position = 0
+    else:
+        # Still queued (or left over without a scheduler entry): it never started
+        progress.status = "cancelled"
+        progress.message = "Cancelado antes de iniciar"
+        progress.queue_position = 0
+    progress_store.set(progress)
+
+
+@router.post("/jobs/{job_id}/resume")
+async def resume_job(
+    job_id: str,
+    access_token: Optional[str] = Form(None),  # Necesario si el job se creó con un token propio
+):
+    progress = progress_store.get(job_id)
+    job_config = progress_store.get_job_config(job_id)
+    if not progress or not job_config or not progress_store.find_input(job_id):
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    if job_scheduler.is_running(job_id) or job_scheduler.is_queued(job_id):
+        raise HTTPException(status_code=409, detail="El job ya se está procesando o está en cola")
+    if progress.status == "completed":
+        raise HTTPException(status_code=400, detail="El job ya está completado")
+    if not progress.upload_complete:
+        raise HTTPException(status_code=400, detail="La carga del archivo no terminó; vuelve a subirlo")
+
+    if job_config.get("custom_token") and not access_token:
+        raise HTTPException(status_code=400, detail="Este job se creó con un token propio; envíalo para continuar")
+    company = job_config.get("company", "fybeca")
+    token = _resolve_token(company, access_token)
+    if not token:
+        raise HTTPException(status_code=500, detail="Token de acceso no configurado para esta empresa")
+
+    progress.should_cancel = False
+    progress_store.set(progress)
+
+    job_scheduler.enqueue(QueuedJob(job_id, company, _transform_config(job_config), token, resume=True))
+    return {"message": "Reanudación solicitada", "job_id": job_id, "queue_position": job_scheduler.position(job_id)}
+
+
+@router.post("/jobs/{job_id}/retry-failed")
+async def retry_failed_batches(
+    job_id: str,
+    access_token: Optional[str] = Form(None),  # Necesario si el job se creó con un token propio
+):
+    """Send again only the batches Meta rejected, from the job's failed-batch spool"""
+    progress = progress_store.get(job_id)
+    job_config = progress_store.get_job_config(job_id)
+    if not progress or not job_config:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    if job_scheduler.is_running(job_id) or job_scheduler.is_queued(job_id):
+        raise HTTPException(status_code=409, detail="El job ya se está procesando o está en cola")
+    spool = FailedBatchSpool(progress_store.failed_spool_path(job_id))
+    # Only a job that read its whole file and then had batches rejected; otherwise it needs a resume
+    if progress.status != "failed" or not progress.failed_batches or not spool.batches:
+        raise HTTPException(status_code=400, detail="No hay lotes fallidos para reintentar")
+
+    if job_config.get("custom_token") and not access_token:
+        raise HTTPException(status_code=400, detail="Este job se creó con un token propio; envíalo para continuar")
+    company = job_config.get("company", "fybeca")
+    token = _resolve_token(company, access_token)
+    if not token:
+        raise HTTPException(status_code=500, detail="Token de acceso no configurado para esta empresa")
+
+    job_scheduler.enqueue(QueuedJob(job_id, company, _transform_config(job_config), token, retry_failed=True))
+    return {
+        "message": f"Reintento de {spool.batches} lotes fallidos solicitado",
+        "job_id": job_id,
+        "queue_position": job_scheduler.position(job_id),
+    }
+
+
 @router.get("/jobs/{job_id}/errors")
 async def download_errors(job_id: str):
+    gz_path = progress_store.errors_gzip_path(job_id)
+    if gz_path.exists():
+        # Served as a gzip-encoded errors.csv: the browser decompresses it transparently
+        return FileResponse(gz_path, media_type="text/csv", filename="errors.csv", headers={"Content-Encoding": "gzip"})
     path = progress_store.errors_csv_path(job_id)
     if not path.exists():
         raise HTTPException(status_code=404, detail="No hay archivo de errores")
@@ -12,12 +12,60 @@ load_dotenv()
 class Settings:
     meta_access_token: str = os.getenv("META_ACCESS_TOKEN", "")
     graph_api_version: str = os.getenv("GRAPH_API_VERSION", "v20.0")
+    graph_api_base_url: str = os.getenv("GRAPH_API_BASE_URL", "https://graph.facebook.com")
     cors_allowed_origins: str = os.getenv("CORS_ALLOWED_ORIGINS", "")
     timezone_default: str = os.getenv("TIMEZONE_DEFAULT", "America/Guayaquil")
     uploads_dir: Path = Path(os.getenv("UPLOADS_DIR", "uploads"))
     batch_size: int = int(os.getenv("BATCH_SIZE", "999"))  # Meta permite máximo 1000 eventos por batch
     max_retries: int = int(os.getenv("MAX_RETRIES", "3"))
     retry_backoff_base: float = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+    request_gzip: bool = os.getenv("REQUEST_GZIP", "false").lower() in ("1", "true", "yes")  # Content-Encoding: gzip al enviar
+    max_in_flight_batches: int = int(os.getenv("MAX_IN_FLIGHT_BATCHES", "4"))  # lotes enviándose a la vez por job
+    # Lote rechazado por Meta (400 por un evento inválido): se divide en mitades para aislar los eventos malos,
+    # con como máximo este número de requests extra por lote (0 = desactivado, el lote completo cuenta como fallido)
+    bisect_max_requests: int = int(os.getenv("BISECT_MAX_REQUESTS", "64"))
+    # Planificador: jobs procesándose a la vez (el resto espera en cola) y lotes en vuelo sumando todos los jobs
+    max_concurrent_jobs: int = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+    max_total_in_flight_batches: int = int(os.getenv("MAX_TOTAL_IN_FLIGHT_BATCHES", "8"))
+    # Pool HTTP compartido por todos los jobs (HTTP2_ENABLED requiere el paquete h2: pip install "httpx[http2]")
+    http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+    http_max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    http_keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    http2_enabled: bool = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+    # Límites compartidos por todos los jobs con el mismo token y dataset (se reducen solos ante 429 de Meta)
+    rate_max_concurrency: int = int(os.getenv("RATE_MAX_CONCURRENCY", "8"))
+    rate_max_requests_per_second: float = float(os.getenv("RATE_MAX_REQUESTS_PER_SECOND", "10"))
+    # El progreso se guarda en la base de jobs como máximo cada PROGRESS_FLUSH_INTERVAL segundos o cada PROGRESS_FLUSH_ROWS filas
+    progress_flush_interval: float = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "0.25"))
+    progress_flush_rows: int = int(os.getenv("PROGRESS_FLUSH_ROWS", "5000"))
+    # Intervalo mínimo entre mensajes de progreso enviados por /jobs/{id}/events (el estado final se envía al instante)
+    progress_events_interval: float = float(os.getenv("PROGRESS_EVENTS_INTERVAL", "0.5"))
+    # Reporte de errores: filas en buffer antes de escribir, segundos máximos sin escribir y compresión gzip
+    errors_flush_rows: int = int(os.getenv("ERRORS_FLUSH_ROWS", "1000"))
+    errors_flush_interval: float = float(os.getenv("ERRORS_FLUSH_INTERVAL", "1.0"))
+    errors_gzip: bool = os.getenv("ERRORS_GZIP", "false").lower() in ("1", "true", "yes")
+    # Caché de hashes email/teléfono: entradas en memoria y, opcional, archivo SQLite compartido entre jobs
+    hash_cache_size: int = int(os.getenv("HASH_CACHE_SIZE", "200000"))
+    hash_cache_db: str = os.getenv("HASH_CACHE_DB", "")
+    # Procesos para transformar el CSV en paralelo (1 = en el mismo proceso) y tamaño de cada trozo
+    transform_workers: int = int(os.getenv("TRANSFORM_WORKERS", "1"))
+    transform_chunk_bytes: int = int(os.getenv("TRANSFORM_CHUNK_BYTES", str(4 * 1024 * 1024)))
+    # Lotes ya transformados esperando envío; con la cola llena la transformación se detiene
+    pipeline_queue_batches: int = int(os.getenv("PIPELINE_QUEUE_BATCHES", "8"))
+    # Segundos que un job cancelado espera a los lotes en vuelo antes de abortarlos
+    cancel_grace_seconds: float = float(os.getenv("CANCEL_GRACE_SECONDS", "10"))
+    # Omitir eventos (event_name + event_id) que otra carga ya envió al mismo dataset; capacidad inicial del filtro Bloom por dataset
+    dedup_enabled: bool = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+    dedup_bloom_capacity: int = int(os.getenv("DEDUP_BLOOM_CAPACITY", "1000000"))
+    # Modo agrupado por factura: facturas parciales en memoria antes de pasarlas a archivos temporales
+    aggregate_max_invoices: int = int(os.getenv("AGGREGATE_MAX_INVOICES", "200000"))
+    # Retención de jobs terminados: días hasta borrar el archivo subido y hasta borrar el job completo,
+    # junto con los eventos enviados que recuerda la deduplicación (0 = nunca)
+    retention_input_days: float = float(os.getenv("RETENTION_INPUT_DAYS", "7"))
+    retention_job_days: float = float(os.getenv("RETENTION_JOB_DAYS", "90"))
+    # Espacio máximo de UPLOADS_DIR en MB (0 = sin límite); al superarlo se borran los jobs terminados más antiguos
+    uploads_disk_budget_mb: int = int(os.getenv("UPLOADS_DISK_BUDGET_MB", "0"))
+    retention_sweep_interval: float = float(os.getenv("RETENTION_SWEEP_INTERVAL", "3600"))
 
     def ensure_dirs(self) -> None:
         self.uploads_dir.mkdir(parents=True, exist_ok=True)
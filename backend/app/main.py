@@ -1,9 +1,17 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
-from .api.uploads import router as uploads_router
+from .api.uploads import resume_interrupted_jobs, router as uploads_router
+from .services.capi_client import shared_http
+from .services.rate_limit import rate_controllers
+from .services.retention import retention_sweeper
+from .services.scheduler import job_scheduler
+from .services.transform_pool import shutdown_pool
 
 # Configure logging
 logging.basicConfig(
@@ -11,8 +19,21 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    shared_http.start()
+    await resume_interrupted_jobs()
+    sweeper = asyncio.create_task(retention_sweeper.run(settings.retention_sweep_interval))
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        await shared_http.close()
+        shutdown_pool()
+
+
 def create_app() -> FastAPI:
-    app = FastAPI(title="CAPI Offline CSV Uploader", version="0.1.0")
+    app = FastAPI(title="CAPI Offline CSV Uploader", version="0.1.0", lifespan=lifespan)
 
     # CORS configuration
     allowed_origins = [origin.strip() for origin in settings.cors_allowed_origins.split(",") if origin.strip()] if settings.cors_allowed_origins else ["*"]
@@ -28,6 +49,15 @@ def create_app() -> FastAPI:
     def health() -> dict:
         return {"status": "ok"}
 
+    @app.get("/api/stats")
+    def stats() -> dict:
+        """Connection pool, rate limiter and scheduler state, to size HTTP_MAX_CONNECTIONS and friends."""
+        return {
+            "http_pool": shared_http.stats(),
+            "rate_limits": rate_controllers.snapshot(),
+            "scheduler": job_scheduler.snapshot(),
+        }
+
     # Routers
     app.include_router(uploads_router, prefix="/api")
 
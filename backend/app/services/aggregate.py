@@ -0,0 +1,168 @@
+import shutil
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..utils.jsonenc import dumps, loads
+from .dedup import event_key
+
+# Fixed so the emit order of a file never changes (a resumed job relies on it)
+PARTITIONS = 64
+
+# Where an invoice comes out: (partition, row number of its first row in the file)
+Position = Tuple[int, int]
+
+
+def _partition(key: str) -> int:
+    return zlib.crc32(key.encode()) % PARTITIONS
+
+
+def _new_partial(key: str, seq: int, event: Dict) -> Dict:
+    custom = event["custom_data"]
+    return {
+        "key": key,
+        "seq": seq,
+        "event": {k: v for k, v in event.items() if k != "custom_data"},
+        "order_id": custom.get("order_id"),
+        "cents": 0,  # integer, so the total does not depend on the order partials are merged in
+        "items": {},
+        "categories": [],
+    }
+
+
+def _add_row(partial: Dict, event: Dict) -> None:
+    custom = event["custom_data"]
+    partial["cents"] += round((custom.get("value") or 0.0) * 100)
+    items = partial["items"]
+    for content_id in custom.get("content_ids") or ():
+        items[content_id] = items.get(content_id, 0) + 1
+    category = custom.get("content_category")
+    if category and category not in partial["categories"]:
+        partial["categories"].append(category)
+    base = partial["event"]
+    base["event_time"] = min(base["event_time"], event["event_time"])
+    for field, value in event["user_data"].items():
+        base["user_data"].setdefault(field, value)
+
+
+def _merge(into: Dict, other: Dict) -> None:
+    into["seq"] = min(into["seq"], other["seq"])
+    into["cents"] += other["cents"]
+    for content_id, quantity in other["items"].items():
+        into["items"][content_id] = into["items"].get(content_id, 0) + quantity
+    for category in other["categories"]:
+        if category not in into["categories"]:
+            into["categories"].append(category)
+    base, other_base = into["event"], other["event"]
+    base["event_time"] = min(base["event_time"], other_base["event_time"])
+    for field, value in other_base["user_data"].items():
+        base["user_data"].setdefault(field, value)
+
+
+def _finish(partial: Dict) -> Dict:
+    event = partial["event"]
+    items = partial["items"]
+    categories = partial["categories"]
+    event["custom_data"] = {
+        "value": partial["cents"] / 100,
+        "currency": "USD",
+        "order_id": partial["order_id"],
+        "content_ids": list(items),
+        "contents": [{"id": content_id, "quantity": quantity} for content_id, quantity in items.items()],
+        "num_items": sum(items.values()),
+        "content_type": "product",
+        "content_category": categories[0] if len(categories) == 1 else None,
+    }
+    return event
+
+
+class InvoiceAggregator:
+    """Collapses the line-item events of each invoice (same event_id) into one Purchase.
+
+    Values are summed and items collected into `content_ids`/`contents` with a
+    quantity per product. Rows of an invoice may be anywhere in the file, so no
+    invoice is complete before the input ends. Partial invoices are kept in
+    memory up to `max_invoices`. Past that, they are appended to PARTITIONS
+    spill files by hash of the invoice, and each file is merged on its own at
+    the end, so memory stays bounded whatever the file size.
+
+    Invoices come out ordered by their `Position`, (partition, first row in the
+    file), the same with or without spilling. Rows are numbered by the caller
+    over the whole file, skipped rows included, so the position of an invoice
+    does not change when other invoices are left out (duplicates). An event
+    without an event_id is an invoice of its own.
+    """
+
+    def __init__(self, work_dir: Path, max_invoices: int) -> None:
+        self._work_dir = work_dir
+        self._max_invoices = max(1, max_invoices)
+        self._partials: Dict[str, Dict] = {}
+        self._spill_files: Optional[List] = None
+
+    def add(self, row: int, event: Dict) -> None:
+        """Add the event of the file's `row`-th row (rows must come in file order)."""
+        key = event_key(event["event_name"], event.get("event_id")) or f"row:{row}"
+        partial = self._partials.get(key)
+        if partial is None:
+            if len(self._partials) >= self._max_invoices:
+                self._spill()
+            partial = self._partials[key] = _new_partial(key, row, event)
+        _add_row(partial, event)
+
+    def _spill(self) -> None:
+        if self._spill_files is None:
+            self._work_dir.mkdir(parents=True, exist_ok=True)
+            self._spill_files = [(self._work_dir / f"part-{i:02d}.jsonl").open("wb") for i in range(PARTITIONS)]
+        for key, partial in self._partials.items():
+            self._spill_files[_partition(key)].write(dumps(partial) + b"\n")
+        self._partials = {}
+
+    def aggregated(self, after: Optional[Sequence[int]] = None) -> Iterator[Tuple[Position, Dict]]:
+        """`(position, event)` of each invoice; call once, after the last `add`.
+
+        With `after` only the invoices past that position come out, and the
+        spill files of earlier partitions are not read.
+        """
+        start: Position = tuple(after) if after is not None else (-1, -1)
+        if self._spill_files is None:
+            by_partition = sorted((_partition(p["key"]), p["seq"], p["key"]) for p in self._partials.values())
+            partials, self._partials = self._partials, {}
+            for partition, seq, key in by_partition:
+                if (partition, seq) > start:
+                    yield (partition, seq), _finish(partials.pop(key))
+            return
+        self._spill()
+        for f in self._spill_files:
+            f.close()
+        for i in range(max(start[0], 0), PARTITIONS):
+            merged: Dict[str, Dict] = {}
+            with (self._work_dir / f"part-{i:02d}.jsonl").open("rb") as f:
+                for line in f:
+                    partial = loads(line)
+                    existing = merged.get(partial["key"])
+                    if existing is None:
+                        merged[partial["key"]] = partial
+                    else:
+                        _merge(existing, partial)
+            for partial in sorted(merged.values(), key=lambda p: p["seq"]):
+                if (i, partial["seq"]) > start:
+                    yield (i, partial["seq"]), _finish(partial)
+
+    def close(self) -> None:
+        if self._spill_files is not None:
+            for f in self._spill_files:
+                f.close()
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+
+
+def aggregate_invoices(
+    events: Iterable[Tuple[int, Dict]], work_dir: Path, max_invoices: int, after: Optional[Sequence[int]] = None
+) -> Iterator[Tuple[Position, Dict]]:
+    """Read all `(row, event)`, then yield `(position, event)` per invoice past `after` (see `InvoiceAggregator`)."""
+    aggregator = InvoiceAggregator(work_dir, max_invoices)
+    try:
+        for row, event in events:
+            aggregator.add(row, event)
+        yield from aggregator.aggregated(after)
+    finally:
+        aggregator.close()
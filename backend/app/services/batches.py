@@ -0,0 +1,58 @@
+import gzip
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from ..utils.jsonenc import dumps
+from .progress import Checkpoint
+
+
+@dataclass
+class EventBatch:
+    """A batch ready to be posted: each event is already serialized to JSON bytes.
+
+    `body` is the complete request payload (`{"data": [...], "upload_tag": ...}`),
+    gzip-compressed when `content_encoding` is "gzip". The individual `events`
+    are kept so a batch can be split or persisted without re-serializing.
+    `checkpoint` is where a resumed job continues once this batch is acknowledged.
+    `event_keys` identify its events for the cross-upload duplicate index.
+    """
+
+    events: List[bytes]
+    body: bytes
+    content_encoding: Optional[str] = None
+    checkpoint: Optional[Checkpoint] = None
+    event_keys: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+
+def encode_event(event: Dict) -> bytes:
+    return dumps(event)
+
+
+def build_batch(
+    events: List[bytes],
+    upload_tag: Optional[str] = None,
+    compress: bool = False,
+    checkpoint: Optional[Checkpoint] = None,
+    event_keys: Optional[List[str]] = None,
+) -> EventBatch:
+    body = b'{"data":[' + b",".join(events) + b"]"
+    if upload_tag:
+        body += b',"upload_tag":' + dumps(upload_tag)
+    body += b"}"
+    if compress:
+        # Level 1 already shrinks the repetitive hashes/keys a lot at a fraction of the CPU
+        return EventBatch(
+            events=events,
+            body=gzip.compress(body, compresslevel=1),
+            content_encoding="gzip",
+            checkpoint=checkpoint,
+            event_keys=event_keys,
+        )
+    return EventBatch(events=events, body=body, checkpoint=checkpoint, event_keys=event_keys)
+
+
+def build_batch_from_dicts(events: Iterable[Dict], upload_tag: Optional[str] = None, compress: bool = False) -> EventBatch:
+    return build_batch([encode_event(e) for e in events], upload_tag=upload_tag, compress=compress)
@@ -1,48 +1,173 @@
 import asyncio
 import logging
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 
 from ..config import settings
+from .batches import EventBatch, build_batch_from_dicts
+from .rate_limit import is_throttling_response, rate_controllers, retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
 
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Wraps the pool transport to count requests and how many had to wait for a connection."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, max_connections: int) -> None:
+        self.inner = inner
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.requests = 0
+        self.pool_waits = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        if self.in_flight > self.max_connections:
+            self.pool_waits += 1
+        try:
+            return await self.inner.handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class SharedHttpClient:
+    """Application-scoped httpx client; started and closed by the FastAPI lifespan.
+
+    Every CapiClient borrows it, so TLS sessions and keep-alive connections to
+    graph.facebook.com are reused across batches and jobs.
+    """
+
+    def __init__(self) -> None:
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[_CountingTransport] = None
+        self.http2 = False
+
+    @property
+    def started(self) -> bool:
+        return self._client is not None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Shared HTTP client not started")
+        return self._client
+
+    def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        if self._client is not None:
+            return
+        limits = httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        )
+        self.http2 = settings.http2_enabled
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP2_ENABLED is set but the h2 package is not installed; using HTTP/1.1")
+                self.http2 = False
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(limits=limits, http2=self.http2)
+        self._transport = _CountingTransport(transport, settings.http_max_connections)
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(60.0), transport=self._transport)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._transport = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self._transport is None:
+            return {"started": False}
+        stats: Dict[str, Any] = {
+            "started": True,
+            "http2": self.http2,
+            "max_connections": settings.http_max_connections,
+            "requests": self._transport.requests,
+            "in_flight": self._transport.in_flight,
+            "pool_waits": self._transport.pool_waits,
+        }
+        # Live connection details come from httpcore's pool, which httpx does not expose publicly
+        pool = getattr(self._transport.inner, "_pool", None)
+        if pool is not None:
+            try:
+                connections = pool.connections
+                stats["connections"] = len(connections)
+                stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+                stats["active_connections"] = stats["connections"] - stats["idle_connections"]
+                stats["queued_requests"] = sum(1 for r in pool._requests if r.is_queued())
+            except Exception:
+                pass
+        return stats
+
+
+shared_http = SharedHttpClient()
+
+
 class CapiClient:
-    def __init__(self, access_token: str, graph_api_version: str = None) -> None:
+    def __init__(
+        self,
+        access_token: str,
+        graph_api_version: str = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
         self.access_token = access_token or settings.meta_access_token
         self.graph_api_version = graph_api_version or settings.graph_api_version
-        self._client = httpx.AsyncClient(timeout=httpx.Timeout(60.0))
+        if http_client is None and transport is None and shared_http.started:
+            http_client = shared_http.client
+        # Borrowed clients belong to whoever created them and are not closed here
+        self._owns_client = http_client is None
+        self._client = http_client or httpx.AsyncClient(timeout=httpx.Timeout(60.0), transport=transport)
 
     async def close(self) -> None:
-        await self._client.aclose()
+        if self._owns_client:
+            await self._client.aclose()
 
-    async def send_batch(self, dataset_id: str, events: List[Dict[str, Any]], upload_tag: str | None = None) -> Tuple[bool, Dict[str, Any]]:
+    async def send_batch(
+        self,
+        dataset_id: str,
+        events: EventBatch | List[Dict[str, Any]],
+        upload_tag: str | None = None,
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """Post one batch. `events` is normally an EventBatch whose body the transform
+        stage already serialized; plain event dicts are encoded here."""
+        if isinstance(events, EventBatch):
+            batch = events
+        else:
+            batch = build_batch_from_dicts(events, upload_tag=upload_tag, compress=settings.request_gzip)
         version = self.graph_api_version
-        url = f"https://graph.facebook.com/{version}/{dataset_id}/events"
+        url = f"{settings.graph_api_base_url}/{version}/{dataset_id}/events"
         params = {"access_token": self.access_token}
-        payload: Dict[str, Any] = {"data": events}
-        if upload_tag:
-            payload["upload_tag"] = upload_tag
+        headers = {"Content-Type": "application/json"}
+        if batch.content_encoding:
+            headers["Content-Encoding"] = batch.content_encoding
 
-        logger.info(f"Sending batch of {len(events)} events to Meta (dataset: {dataset_id}, tag: {upload_tag})")
+        logger.info(f"Sending batch of {len(batch)} events to Meta (dataset: {dataset_id}, tag: {upload_tag}, {len(batch.body)} bytes)")
 
+        limiter = rate_controllers.get(self.access_token, dataset_id)
         retries = settings.max_retries
-        backoff = settings.retry_backoff_base
         for attempt in range(retries + 1):
             try:
-                resp = await self._client.post(url, params=params, json=payload)
+                async with limiter.slot():
+                    resp = await self._client.post(url, params=params, content=batch.body, headers=headers)
+                limiter.observe(resp)
                 # Success codes are 200-range
                 if 200 <= resp.status_code < 300:
-                    logger.info(f"✓ Batch sent successfully: {len(events)} events (status: {resp.status_code})")
+                    logger.info(f"✓ Batch sent successfully: {len(batch)} events (status: {resp.status_code})")
                     return True, resp.json()
-                # Retry on 429 and 5xx
-                if resp.status_code in (429,) or 500 <= resp.status_code < 600:
+                # Retry on 429, Meta throttling error codes and 5xx
+                if is_throttling_response(resp) or 500 <= resp.status_code < 600:
                     logger.warning(f"Retryable error {resp.status_code}, attempt {attempt+1}/{retries+1}")
                     if attempt < retries:
-                        await asyncio.sleep(backoff)
-                        backoff *= 2
+                        await asyncio.sleep(limiter.backoff_delay(attempt, retry_after_seconds(resp.headers)))
                         continue
                 # Non-retryable error
                 logger.error(f"✗ Failed to send batch: status {resp.status_code}, body: {resp.text[:200]}")
@@ -50,8 +175,7 @@ class CapiClient:
             except httpx.RequestError as exc:
                 logger.error(f"Network error on attempt {attempt+1}: {exc}")
                 if attempt < retries:
-                    await asyncio.sleep(backoff)
-                    backoff *= 2
+                    await asyncio.sleep(limiter.backoff_delay(attempt))
                     continue
                 return False, {"exception": str(exc)}
 
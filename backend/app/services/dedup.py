@@ -0,0 +1,188 @@
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import settings
+from ..utils.jsonenc import loads
+
+
+def event_key(event_name: str, event_id: Optional[str]) -> Optional[str]:
+    """Identity of an event for Meta's deduplication (event_name + event_id); None without an id."""
+    return f"{event_name}:{event_id}" if event_id else None
+
+
+def event_keys(events: Iterable[bytes]) -> List[str]:
+    """Keys of already serialized events (those without an event_id have none)."""
+    keys = []
+    for raw in events:
+        event = loads(raw)
+        key = event_key(event.get("event_name", ""), event.get("event_id"))
+        if key:
+            keys.append(key)
+    return keys
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on a 128-bit BLAKE2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.capacity = max(1, capacity)
+        self._size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / self.capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self.count = 0
+
+    def _hash(self, key: str) -> Tuple[int, int]:
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=16).digest(), "little")
+        return digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+
+    def add(self, key: str) -> None:
+        h1, h2 = self._hash(key)
+        bits, size = self._bits, self._size
+        for i in range(self._hashes):
+            pos = (h1 + i * h2) % size
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = self._hash(key)
+        bits, size = self._bits, self._size
+        for i in range(self._hashes):
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class SentEventIndex:
+    """Per-dataset record of the events Meta already accepted, across uploads.
+
+    The exact record is a SQLite table (dataset, event key) -> job that sent
+    it. Each dataset also has an in-memory Bloom filter, loaded from the table
+    on first use, so the common case of a new event is answered without a
+    query; only Bloom hits (real duplicates and ~1% false positives) go to the
+    table. The filter is rebuilt twice as large when it fills up.
+
+    Rows carry the time Meta accepted the event; `prune` drops the old ones,
+    so the table does not grow with every upload forever.
+    """
+
+    def __init__(self, db_path: Path, capacity: int = 1_000_000) -> None:
+        self._db_path = db_path
+        self._capacity = capacity
+        self._local = threading.local()
+        self._filters: Dict[str, BloomFilter] = {}
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sent_events ("
+                " dataset_id TEXT, event_key TEXT, job_id TEXT, sent_at REAL,"
+                " PRIMARY KEY (dataset_id, event_key)) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _filter(self, dataset_id: str) -> BloomFilter:
+        bloom = self._filters.get(dataset_id)
+        if bloom is None:
+            with self._lock:
+                bloom = self._filters.get(dataset_id)
+                if bloom is None:
+                    bloom = self._load(dataset_id)
+        return bloom
+
+    def _load(self, dataset_id: str) -> BloomFilter:
+        # Called with the lock held
+        conn = self._conn()
+        count = conn.execute("SELECT COUNT(*) FROM sent_events WHERE dataset_id = ?", (dataset_id,)).fetchone()[0]
+        bloom = BloomFilter(max(self._capacity, count * 2))
+        for (key,) in conn.execute("SELECT event_key FROM sent_events WHERE dataset_id = ?", (dataset_id,)):
+            bloom.add(key)
+        self._filters[dataset_id] = bloom
+        return bloom
+
+    def sent_by(self, dataset_id: str, key: str) -> Optional[str]:
+        """The job that sent this event to the dataset, or None if it was never sent."""
+        if key not in self._filter(dataset_id):
+            return None
+        row = self._conn().execute(
+            "SELECT job_id FROM sent_events WHERE dataset_id = ? AND event_key = ?", (dataset_id, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, dataset_id: str, job_id: str, keys: Iterable[str]) -> None:
+        """Record events accepted by Meta (the first job to send an event keeps it)."""
+        now = time.time()
+        rows = [(dataset_id, key, job_id, now) for key in keys]
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO sent_events VALUES (?, ?, ?, ?)", rows)
+        with self._lock:
+            bloom = self._filters.get(dataset_id)
+            if bloom is None:
+                return  # loaded from the table, with these rows, on first lookup
+            if bloom.count + len(rows) > bloom.capacity:
+                self._load(dataset_id)
+            else:
+                for _, key, _, _ in rows:
+                    bloom.add(key)
+
+    def prune(self, older_than: float) -> int:
+        """Forget events accepted before `older_than` (a timestamp); returns how many rows went."""
+        conn = self._conn()
+        with conn:
+            datasets = [
+                row[0]
+                for row in conn.execute("SELECT DISTINCT dataset_id FROM sent_events WHERE sent_at < ?", (older_than,))
+            ]
+            deleted = conn.execute("DELETE FROM sent_events WHERE sent_at < ?", (older_than,)).rowcount
+        with self._lock:
+            # Still answered right by the table, but reloaded without them on next use
+            for dataset_id in datasets:
+                self._filters.pop(dataset_id, None)
+        return deleted
+
+class DuplicateFilter:
+    """Tells a job which of its events an earlier job already sent to the same dataset.
+
+    Events sent by the job itself do not count: the rows of one invoice share
+    its event_id, and a resumed job must send again what it sent after its
+    checkpoint. Consecutive rows of an invoice reuse the previous answer.
+    """
+
+    def __init__(self, index: SentEventIndex, dataset_id: str, job_id: str) -> None:
+        self._index = index
+        self._dataset_id = dataset_id
+        self._job_id = job_id
+        self._last_key: Optional[str] = None
+        self._last_answer = False
+
+    def is_duplicate(self, key: Optional[str]) -> bool:
+        if key is None:
+            return False
+        if key != self._last_key:
+            sender = self._index.sent_by(self._dataset_id, key)
+            self._last_key, self._last_answer = key, sender is not None and sender != self._job_id
+        return self._last_answer
+
+
+sent_event_index = SentEventIndex(settings.uploads_dir / "sent_events.db", capacity=settings.dedup_bloom_capacity)
+
+
+def duplicate_filter(config, job_id: str) -> Optional[DuplicateFilter]:
+    """The job's duplicate filter, or None when deduplication is off for it."""
+    if not settings.dedup_enabled or not config.skip_duplicates:
+        return None
+    return DuplicateFilter(sent_event_index, config.dataset_id, job_id)
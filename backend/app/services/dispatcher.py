@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .batches import EventBatch, build_batch
+from .capi_client import CapiClient
+from .dedup import event_keys
+from .event_isolation import is_event_rejection, isolate_rejected
+from .progress import Checkpoint
+
+logger = logging.getLogger(__name__)
+
+
+class BatchDispatcher:
+    """Send batches to Meta concurrently, keeping at most `max_in_flight` requests open.
+
+    `submit` waits until a slot is free, so a producer feeding it is naturally
+    throttled to the speed of the API. Results are accounted per batch.
+
+    `shared_slots`, when given, is a second limit shared with other jobs (the
+    scheduler's process-wide cap); a batch needs a slot in both to be sent.
+
+    Batches finish out of order; `on_checkpoint` is called with the checkpoint of
+    the last batch of the contiguous run of finished batches, which is the point
+    a resumed job can safely restart from. A batch is not started while the one
+    `max_in_flight` places before it is still unfinished, so the batches past
+    that point, which a resumed job sends again, never exceed one in-flight
+    window. `on_sent` is called with each batch
+    Meta accepted, and `on_failed` with the number and batch of each one it did
+    not accept after all retries.
+
+    With `bisect_max_requests`, a batch Meta rejects because of some of its
+    events is split to find them (see `isolate_rejected`) while it keeps its
+    slot. The rest of the batch goes to `on_sent`; the bad events, with Meta's
+    message, go to `on_rejected` in batch order once the batch is covered by
+    a checkpoint, so a resumed job never reports them twice. Only the events
+    left unresolved make the batch count as failed.
+    """
+
+    def __init__(
+        self,
+        client: CapiClient,
+        dataset_id: str,
+        upload_tag: str | None,
+        max_in_flight: int,
+        on_checkpoint: Optional[Callable[[Checkpoint], None]] = None,
+        start: Optional[Checkpoint] = None,
+        shared_slots: Optional[asyncio.Semaphore] = None,
+        on_sent: Optional[Callable[[EventBatch], None]] = None,
+        on_failed: Optional[Callable[[int, EventBatch], None]] = None,
+        on_rejected: Optional[Callable[[List[Tuple[bytes, str]]], None]] = None,
+        bisect_max_requests: int = 0,
+    ) -> None:
+        self._client = client
+        self._dataset_id = dataset_id
+        self._upload_tag = upload_tag
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._window = max(1, max_in_flight)
+        self._advanced = asyncio.Event()
+        self._shared_slots = shared_slots
+        self._tasks: Set[asyncio.Task] = set()
+        self._on_checkpoint = on_checkpoint
+        self._on_sent = on_sent
+        self._on_failed = on_failed
+        self._on_rejected = on_rejected
+        self._bisect_max_requests = bisect_max_requests
+        self.submitted_batches = start.batches_done if start else 0
+        self.sent_batches = 0
+        self.failed_batches = start.failed_batches if start else 0
+        self.sent_events = 0
+        self.failed_events = 0
+        self.rejected_events = start.rejected_events if start else 0
+        # Batch number -> its checkpoint (if any), for submitted batches not yet covered by a checkpoint
+        self._pending: Dict[int, Optional[Checkpoint]] = {}
+        # Batch number -> whether Meta accepted it, for finished batches not yet covered by a checkpoint
+        self._finished: Dict[int, bool] = {}
+        self._rejected: Dict[int, List[Tuple[bytes, str]]] = {}
+        self._committed = self.submitted_batches
+        self._committed_failed = self.failed_batches
+        self._committed_rejected = self.rejected_events
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, batch: EventBatch) -> None:
+        while self.submitted_batches >= self._committed + self._window:
+            # A batch `max_in_flight` places back is still unfinished
+            self._advanced.clear()
+            await self._advanced.wait()
+        await self._slots.acquire()
+        if self._shared_slots is not None:
+            try:
+                await self._shared_slots.acquire()
+            except BaseException:
+                self._slots.release()
+                raise
+        self.submitted_batches += 1
+        self._pending[self.submitted_batches] = batch.checkpoint
+        task = asyncio.create_task(self._send(self.submitted_batches, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """Wait for every submitted batch to finish."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def finish(self, timeout: float) -> None:
+        """Give the batches in flight up to `timeout` seconds to finish, then `abort` the rest.
+
+        Batches Meta answers meanwhile are covered by checkpoints, so a resumed
+        job does not send them again.
+        """
+        if self._tasks and timeout > 0:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        await self.abort()
+
+    async def abort(self) -> None:
+        """Cancel batches still in flight and wait for them to unwind."""
+        for task in list(self._tasks):
+            task.cancel()
+        await self.drain()
+
+    async def _send(self, number: int, batch: EventBatch) -> None:
+        sent: Optional[EventBatch] = None
+        failed: Optional[EventBatch] = batch
+        rejected: List[Tuple[bytes, str]] = []
+        try:
+            logger.info(f"Processing batch {number} ({len(batch)} events)")
+            ok, info = await self._client.send_batch(self._dataset_id, batch, upload_tag=self._upload_tag)
+            if ok:
+                sent, failed = batch, None
+            elif self._bisect_max_requests and is_event_rejection(info):
+                sent, failed, rejected = await self._isolate(number, batch, info)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            info = {"exception": str(exc)}
+        finally:
+            self._slots.release()
+            if self._shared_slots is not None:
+                self._shared_slots.release()
+
+        # Counters first: the hooks may read them
+        if sent is not None:
+            self.sent_events += len(sent)
+        if failed is None:
+            self.sent_batches += 1
+        else:
+            self.failed_batches += 1
+            self.failed_events += len(failed)
+        if rejected:
+            self.rejected_events += len(rejected)
+            self._rejected[number] = rejected
+
+        if sent is not None and self._on_sent is not None:
+            self._on_sent(sent)
+        if failed is not None:
+            logger.error(f"Batch {number} failed: {info}")
+            if self._on_failed is not None:
+                self._on_failed(number, failed)
+        self._finished[number] = failed is None
+        self._advance()
+
+    async def _isolate(
+        self, number: int, batch: EventBatch, info: dict
+    ) -> Tuple[Optional[EventBatch], Optional[EventBatch], List[Tuple[bytes, str]]]:
+        """`(accepted, unresolved, rejected events)` of a batch Meta rejected because of some events."""
+        compress = batch.content_encoding == "gzip"
+
+        async def send(events):
+            part = build_batch(events, self._upload_tag, compress)
+            return await self._client.send_batch(self._dataset_id, part, upload_tag=self._upload_tag)
+
+        isolation = await isolate_rejected(batch.events, info, send, self._bisect_max_requests)
+        logger.warning(
+            f"Batch {number}: {len(isolation.rejected)} events rejected by Meta, {len(isolation.accepted)} sent "
+            f"and {len(isolation.unresolved)} unresolved after {isolation.requests} more requests"
+        )
+        sent = EventBatch(events=isolation.accepted, body=b"", event_keys=event_keys(isolation.accepted))
+        failed = EventBatch(events=isolation.unresolved, body=b"") if isolation.unresolved else None
+        return sent, failed, isolation.rejected
+
+    def _advance(self) -> None:
+        checkpoint = None
+        while self._committed + 1 in self._finished:
+            self._advanced.set()
+            self._committed += 1
+            if not self._finished.pop(self._committed):
+                self._committed_failed += 1
+            rejected = self._rejected.pop(self._committed, None)
+            if rejected:
+                self._committed_rejected += len(rejected)
+                if self._on_rejected is not None:
+                    self._on_rejected(rejected)
+            checkpoint = self._pending.pop(self._committed, None) or checkpoint
+        if checkpoint is not None and self._on_checkpoint is not None:
+            checkpoint.batches_done = self._committed
+            checkpoint.failed_batches = self._committed_failed
+            checkpoint.rejected_events = self._committed_rejected
+            try:
+                self._on_checkpoint(checkpoint)
+            except Exception as exc:
+                logger.error(f"Could not save checkpoint: {exc}")
@@ -0,0 +1,115 @@
+"""Finding the events that make Meta reject a whole batch.
+
+Meta answers a batch with a single 400 when any one of its events is
+invalid, without saying which. `isolate_rejected` sends the batch again in
+halves and keeps splitting the halves that are still rejected: the k bad
+events among n are found in at most 2k·log2(n) requests (about 1.5·log2(n)
+for a single one), and every other event is accepted along the way.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from ..utils.jsonenc import loads
+from .rate_limit import THROTTLING_ERROR_CODES
+
+# Meta error codes that reject the request itself (outage, token, permissions,
+# rate limits...) rather than one of its events: splitting the batch cannot help
+_REQUEST_ERROR_CODES = THROTTLING_ERROR_CODES | {1, 2, 10, 102, 190, 200, 368}
+_UNKNOWN_OBJECT_SUBCODE = 33  # code 100: the dataset id does not exist
+
+SendEvents = Callable[[List[bytes]], Awaitable[Tuple[bool, Dict]]]
+
+
+def meta_error(info: Dict) -> Dict:
+    """The `error` object of a failed `send_batch` result ({} if Meta did not send one)."""
+    try:
+        error = loads(info.get("body") or "{}").get("error")
+    except (ValueError, AttributeError):
+        return {}
+    return error if isinstance(error, dict) else {}
+
+
+def is_event_rejection(info: Dict) -> bool:
+    """Whether a failed `send_batch` result may be caused by some of the batch's events."""
+    if info.get("status_code") != 400:
+        return False
+    error = meta_error(info)
+    code = error.get("code")
+    return code not in _REQUEST_ERROR_CODES and not (code == 100 and error.get("error_subcode") == _UNKNOWN_OBJECT_SUBCODE)
+
+
+def rejection_message(info: Dict) -> str:
+    error = meta_error(info)
+    return error.get("error_user_msg") or error.get("message") or f"HTTP {info.get('status_code')}"
+
+
+@dataclass
+class Isolation:
+    """Outcome of splitting a rejected batch; each list keeps the batch's order."""
+
+    accepted: List[bytes] = field(default_factory=list)
+    rejected: List[Tuple[bytes, str]] = field(default_factory=list)  # bad event and Meta's message
+    unresolved: List[bytes] = field(default_factory=list)  # not settled within the request budget, or failed otherwise
+    requests: int = 0
+
+
+async def isolate_rejected(events: List[bytes], info: Dict, send: SendEvents, max_requests: int) -> Isolation:
+    """Split `events`, whose batch Meta rejected with `info`, until each bad event is alone.
+
+    `send` posts some of the events and returns `send_batch`'s `(ok, info)`.
+    Of a rejected part only the first half is sent: when Meta accepts it, the
+    second half holds the bad events and is split without being sent. No more
+    than `max_requests` requests are made; parts still unsettled when they run
+    out are left unresolved, as are parts that fail for a reason other than
+    their events.
+    """
+    accepted: List[Tuple[int, bytes]] = []
+    rejected: List[Tuple[int, bytes, str]] = []
+    unresolved: List[Tuple[int, bytes]] = []
+    requests = 0
+
+    async def check(part: List[Tuple[int, bytes]]) -> None:
+        """Send a part whose events are not known to be good or bad."""
+        nonlocal requests
+        if requests >= max_requests:
+            unresolved.extend(part)
+            return
+        requests += 1
+        ok, part_info = await send([event for _, event in part])
+        if ok:
+            accepted.extend(part)
+        elif is_event_rejection(part_info):
+            await settle(part, part_info)
+        else:
+            unresolved.extend(part)
+
+    async def settle(part: List[Tuple[int, bytes]], part_info: Dict) -> None:
+        """Narrow down a part Meta rejected (with `part_info`)."""
+        nonlocal requests
+        if len(part) == 1:
+            rejected.append((*part[0], rejection_message(part_info)))
+            return
+        if requests >= max_requests:
+            unresolved.extend(part)
+            return
+        requests += 1
+        middle = len(part) // 2
+        first, second = part[:middle], part[middle:]
+        ok, first_info = await send([event for _, event in first])
+        if ok:
+            accepted.extend(first)
+            await settle(second, part_info)
+        elif is_event_rejection(first_info):
+            await asyncio.gather(settle(first, first_info), check(second))
+        else:
+            unresolved.extend(first)
+            await check(second)
+
+    await settle(list(enumerate(events)), info)
+    return Isolation(
+        accepted=[event for _, event in sorted(accepted)],
+        rejected=[(event, message) for _, event, message in sorted(rejected)],
+        unresolved=[event for _, event in sorted(unresolved)],
+        requests=requests,
+    )
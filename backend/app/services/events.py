@@ -0,0 +1,106 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from .progress import progress_store
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class ProgressHub:
+    """Wakes up the progress streams of a job whenever its progress is written.
+
+    `ProgressStore` writes happen on the event loop and on worker threads
+    (transform, sink), so `notify` hands the wake-up over to the loop of each
+    subscriber with `call_soon_threadsafe`.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self._subscribers.setdefault(job_id, []).append((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, job_id: str, event: asyncio.Event) -> None:
+        subscribers = [entry for entry in self._subscribers.get(job_id, []) if entry[1] is not event]
+        if subscribers:
+            self._subscribers[job_id] = subscribers
+        else:
+            self._subscribers.pop(job_id, None)
+
+    def notify(self, job_id: str) -> None:
+        for loop, event in list(self._subscribers.get(job_id, ())):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # loop already closed
+                pass
+
+
+progress_hub = ProgressHub()
+progress_store.add_listener(progress_hub.notify)
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_progress(job_id: str, interval: float, keepalive: float = 15.0, is_disconnected=None):
+    """Server-Sent Events with a job's progress.
+
+    The first message carries the whole progress; later ones only the fields
+    that changed. While the job runs the in-memory progress is sampled at most
+    once per `interval`, except that a terminal status is pushed as soon as it
+    is written, followed by an `end` event. A comment is sent every `keepalive`
+    seconds without changes so proxies keep the connection open.
+    """
+    wake = progress_hub.subscribe(job_id)
+    loop = asyncio.get_running_loop()
+    try:
+        last: dict = {}
+        last_push = last_sent = 0.0
+        while True:
+            wake.clear()
+            current = progress_store.snapshot(job_id)
+            if current is None:
+                yield _sse({"detail": "Job no encontrado"}, event="end")
+                return
+            delta = {key: value for key, value in current.items() if key not in last or last[key] != value}
+            if delta:
+                yield _sse(delta)
+                last, last_push = current, loop.time()
+                last_sent = last_push
+            elif loop.time() - last_sent >= keepalive:
+                yield ": keepalive\n\n"
+                last_sent = loop.time()
+            if current["status"] in TERMINAL_STATUSES:
+                yield _sse({"status": current["status"]}, event="end")
+                return
+
+            await _wait_for_change(job_id, wake, last_push + interval, interval, keepalive)
+            if is_disconnected is not None and await is_disconnected():
+                return
+    finally:
+        progress_hub.unsubscribe(job_id, wake)
+
+
+async def _wait_for_change(job_id: str, wake: asyncio.Event, not_before: float, interval: float, keepalive: float) -> None:
+    # A running job's counters change in memory without a write, so it is sampled every
+    # `interval`; otherwise only writes (or the keepalive) wake the stream up. A write
+    # arriving before `not_before` is held back until then unless it carries a final status.
+    loop = asyncio.get_running_loop()
+    timeout = interval if progress_store.is_live(job_id) else keepalive
+    while True:
+        try:
+            await asyncio.wait_for(wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+        wake.clear()
+        timeout = not_before - loop.time()
+        if timeout <= 0:
+            return
+        current = progress_store.snapshot(job_id)
+        if current is None or current["status"] in TERMINAL_STATUSES:
+            return
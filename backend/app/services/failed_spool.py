@@ -0,0 +1,98 @@
+import gzip
+import os
+import struct
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from .batches import EventBatch
+from .dedup import event_keys
+
+# Batch number, number of events and length of the compressed events of a record
+_HEADER = struct.Struct(">III")
+
+
+class FailedBatchSpool:
+    """Batches Meta did not accept, kept on disk to be sent again later.
+
+    Each record holds the batch number and the batch's events exactly as they
+    were posted (serialized JSON, one per line), gzip-compressed: replaying
+    the spool does not read, parse or hash the input file again.
+
+    Records are appended in the order batches fail, which is not necessarily
+    their number order. A record cut short by a crash is dropped when the
+    spool is opened.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.batches = 0
+        self.events = 0
+        self._scan()
+
+    def append(self, number: int, batch: EventBatch) -> None:
+        payload = gzip.compress(b"\n".join(batch.events), compresslevel=1)
+        with self.path.open("ab") as f:
+            f.write(_HEADER.pack(number, len(batch.events), len(payload)) + payload)
+        self.batches += 1
+        self.events += len(batch.events)
+
+    def read(self) -> Iterator[Tuple[int, List[bytes], List[str]]]:
+        """`(batch number, events, event keys)` of every record, in spool order."""
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                number, count, length = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                events = gzip.decompress(payload).split(b"\n") if count else []
+                yield number, events, event_keys(events)
+
+    def truncate_after(self, batches_done: int) -> None:
+        """Drop the records of batches after `batches_done` (a resumed job sends them again)."""
+        if not self.batches:
+            return
+        kept = FailedBatchSpool(self.path.with_name(self.path.name + ".tmp"))
+        kept.clear()
+        for number, events, _ in self.read():
+            if number <= batches_done:
+                kept.append(number, EventBatch(events=events, body=b""))
+        kept.replace(self)
+
+    def replace(self, other: "FailedBatchSpool") -> None:
+        """Move this spool over `other`'s file; `other` then holds these records."""
+        if self.path.exists():
+            os.replace(self.path, other.path)
+        else:
+            other.path.unlink(missing_ok=True)
+        other.batches, other.events = self.batches, self.events
+        self.batches = self.events = 0
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.batches = self.events = 0
+
+    def _scan(self) -> None:
+        """Count the records, cutting off a partial one left by a crash."""
+        if not self.path.exists():
+            return
+        valid = 0
+        size = self.path.stat().st_size
+        with self.path.open("rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                _, count, length = _HEADER.unpack(header)
+                if valid + _HEADER.size + length > size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                valid += _HEADER.size + length
+                self.batches += 1
+                self.events += count
+        if valid < size:
+            os.truncate(self.path, valid)
@@ -0,0 +1,162 @@
+import gzip
+import io
+import struct
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional: without it .csv.zst uploads are rejected
+    zstandard = None
+
+
+# Accepted upload suffixes -> input format. Compressed files are stored as uploaded
+# and decompressed as a stream while the job reads them.
+INPUT_SUFFIXES = {
+    ".csv": "csv",
+    ".csv.gz": "gzip",
+    ".csv.zst": "zstd",
+    ".zip": "zip",
+}
+
+# Name of the stored input file for each format
+INPUT_FILENAMES = {
+    "csv": "input.csv",
+    "gzip": "input.csv.gz",
+    "zstd": "input.csv.zst",
+    "zip": "input.zip",
+}
+
+# Formats that can be decompressed while the upload is still being received
+# (a zip's directory is at the end of the file)
+STREAMABLE_FORMATS = ("csv", "gzip", "zstd")
+
+_READ_SIZE = 1024 * 1024
+
+
+class InputFormatError(ValueError):
+    """The uploaded file is not in a supported format."""
+
+
+def detect_input_format(filename: str) -> str:
+    """Return the input format for a file name, raising `InputFormatError` if unsupported."""
+    name = filename.lower()
+    for suffix, fmt in INPUT_SUFFIXES.items():
+        if name.endswith(suffix):
+            if fmt == "zstd" and zstandard is None:
+                raise InputFormatError("El servidor no tiene soporte para archivos .zst")
+            return fmt
+    raise InputFormatError("Solo se aceptan archivos .csv, .csv.gz, .csv.zst o .zip")
+
+
+def check_zip(path: Path) -> None:
+    """A zip upload must hold exactly one file (the CSV)."""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            _single_entry(zf)
+    except zipfile.BadZipFile:
+        raise InputFormatError("El archivo .zip está dañado")
+
+
+def _single_entry(zf: zipfile.ZipFile) -> zipfile.ZipInfo:
+    entries = [info for info in zf.infolist() if not info.is_dir()]
+    if len(entries) != 1:
+        raise InputFormatError("El archivo .zip debe contener un solo archivo CSV")
+    return entries[0]
+
+
+def _gzip_size(path: Path, compressed_size: int) -> Optional[int]:
+    # The gzip trailer holds the uncompressed size modulo 2**32; it is only trusted
+    # when it is plausible (not smaller than the compressed data)
+    if compressed_size < 18:
+        return None
+    with path.open("rb") as f:
+        f.seek(-4, 2)
+        (size,) = struct.unpack("<I", f.read(4))
+    return size if size >= compressed_size else None
+
+
+class InputStream:
+    """The CSV bytes of an input file, decompressed on the fly.
+
+    `stream` is a binary file object that can be iterated line by line.
+    `size` is the uncompressed size when known up-front (plain files, zip
+    entries, gzip trailers); otherwise `estimate_size` extrapolates it from
+    how much of the compressed file has been consumed so far.
+    """
+
+    def __init__(self, raw: BinaryIO, input_format: str, compressed_size: int, path: Optional[Path] = None) -> None:
+        self.input_format = input_format
+        self.compressed_size = compressed_size
+        self.size: Optional[int] = None
+        self._raw = raw
+        self._zip: Optional[zipfile.ZipFile] = None
+        if input_format == "csv":
+            self.stream = raw
+            self.size = compressed_size if path is not None else None
+        elif input_format == "gzip":
+            self.stream = gzip.GzipFile(fileobj=raw, mode="rb")
+            self.size = _gzip_size(path, compressed_size) if path is not None else None
+        elif input_format == "zstd":
+            if zstandard is None:
+                raise InputFormatError("El servidor no tiene soporte para archivos .zst")
+            # Small reads keep the compressed position (used for size estimates) accurate
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_size=64 * 1024, read_across_frames=True)
+            self.stream = io.BufferedReader(reader, buffer_size=_READ_SIZE)
+        elif input_format == "zip":
+            self._zip = zipfile.ZipFile(raw)
+            entry = _single_entry(self._zip)
+            self.stream = self._zip.open(entry)
+            self.size = entry.file_size
+        else:
+            raise InputFormatError(f"Formato de entrada desconocido: {input_format}")
+
+    def estimate_size(self, processed_bytes: int) -> int:
+        """Uncompressed size: exact when known, else extrapolated from the compression ratio so far."""
+        if self.size is not None:
+            return self.size
+        if self.input_format == "csv":
+            # A plain file still being uploaded: its announced size
+            return max(self.compressed_size, processed_bytes)
+        position = self._raw.tell()
+        if not position or not self.compressed_size:
+            return 0
+        return max(processed_bytes, int(processed_bytes * self.compressed_size / position))
+
+    def skip_to(self, offset: int, current: int) -> None:
+        """Move from uncompressed position `current` forward to `offset`."""
+        if self.input_format == "csv" and hasattr(self.stream, "seek"):
+            self.stream.seek(offset)
+            return
+        # Compressed streams cannot seek: decompress and discard up to the offset
+        remaining = offset - current
+        while remaining > 0:
+            data = self.stream.read(min(remaining, _READ_SIZE))
+            if not data:
+                break
+            remaining -= len(data)
+
+    def close(self) -> None:
+        if self.stream is not self._raw:
+            self.stream.close()
+        if self._zip is not None:
+            self._zip.close()
+        self._raw.close()
+
+    def __enter__(self) -> "InputStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_input(path: Path) -> InputStream:
+    """Open a stored input file (format taken from its name) for reading as CSV bytes."""
+    input_format = detect_input_format(path.name)
+    raw = path.open("rb")
+    try:
+        return InputStream(raw, input_format, path.stat().st_size, path=path)
+    except Exception:
+        raw.close()
+        raise
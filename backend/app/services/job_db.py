@@ -0,0 +1,181 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " job_id TEXT PRIMARY KEY,"
+    " status TEXT NOT NULL,"
+    " company TEXT,"
+    " dataset_id TEXT,"
+    " upload_tag TEXT,"
+    " created_at REAL NOT NULL,"
+    " started_at REAL,"
+    " finished_at REAL,"
+    " updated_at REAL NOT NULL,"
+    " progress TEXT NOT NULL,"  # JobProgress as JSON
+    " config TEXT)",  # what is needed to resume the job, as JSON
+    "CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_dataset ON jobs (dataset_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)",
+)
+
+_SAVE_PROGRESS = """
+INSERT INTO jobs (job_id, status, created_at, started_at, finished_at, updated_at, progress)
+VALUES (:job_id, :status, :now, :started_at, :finished_at, :now, :progress)
+ON CONFLICT (job_id) DO UPDATE SET
+    status = excluded.status,
+    started_at = COALESCE(jobs.started_at, excluded.started_at),
+    finished_at = CASE WHEN excluded.finished_at IS NULL THEN NULL
+                       ELSE COALESCE(jobs.finished_at, excluded.finished_at) END,
+    updated_at = excluded.updated_at,
+    progress = excluded.progress
+"""
+
+_SAVE_CONFIG = """
+INSERT INTO jobs (job_id, status, company, dataset_id, upload_tag, created_at, updated_at, progress, config)
+VALUES (:job_id, 'pending', :company, :dataset_id, :upload_tag, :now, :now, '{}', :config)
+ON CONFLICT (job_id) DO UPDATE SET
+    company = excluded.company,
+    dataset_id = excluded.dataset_id,
+    upload_tag = excluded.upload_tag,
+    config = excluded.config
+"""
+
+_META_COLUMNS = "job_id, status, company, dataset_id, upload_tag, created_at, started_at, finished_at, updated_at, progress"
+
+
+class JobDatabase:
+    """Job metadata (status, counters, dataset, company, timings) in a SQLite file.
+
+    This is the source of truth for job state; the job directory only holds
+    files (input, errors report, checkpoint). The database runs in WAL mode so
+    status reads never wait for the progress writes of running jobs, and each
+    thread gets its own connection.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._conn()  # create the schema up-front
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL a commit is still atomic; only the last commits may be lost on power failure
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def save_progress(self, progress: dict, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        status = progress["status"]
+        with self._conn() as conn:
+            conn.execute(
+                _SAVE_PROGRESS,
+                {
+                    "job_id": progress["job_id"],
+                    "status": status,
+                    "now": now,
+                    "started_at": now if status == "running" else None,
+                    "finished_at": now if status in TERMINAL_STATUSES else None,
+                    "progress": json.dumps(progress, ensure_ascii=False),
+                },
+            )
+
+    def get_progress(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT progress FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row["progress"] == "{}":
+            return None
+        return json.loads(row["progress"])
+
+    def save_config(self, job_id: str, config: dict, now: Optional[float] = None) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                _SAVE_CONFIG,
+                {
+                    "job_id": job_id,
+                    "company": config.get("company"),
+                    "dataset_id": config.get("dataset_id"),
+                    "upload_tag": config.get("upload_tag"),
+                    "now": time.time() if now is None else now,
+                    "config": json.dumps(config, ensure_ascii=False),
+                },
+            )
+
+    def get_config(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT config FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row["config"] is None:
+            return None
+        return json.loads(row["config"])
+
+    def exists(self, job_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def list_jobs(
+        self,
+        statuses: Iterable[str] = (),
+        dataset_id: Optional[str] = None,
+        company: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Tuple[List[dict], int]:
+        """Jobs matching the filters, newest first, and the total count without paging."""
+        where, params = [], []
+        statuses = list(statuses)
+        if statuses:
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if dataset_id:
+            where.append("dataset_id = ?")
+            params.append(dataset_id)
+        if company:
+            where.append("company = ?")
+            params.append(company)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM jobs{clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {_META_COLUMNS} FROM jobs{clause} ORDER BY created_at DESC, job_id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        return [self._meta(row) for row in rows], total
+
+    def finished_jobs(self) -> List[dict]:
+        """Finished jobs, oldest first (the order retention deletes them in)."""
+        rows = self._conn().execute(
+            f"SELECT {_META_COLUMNS} FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at, job_id"
+        ).fetchall()
+        return [self._meta(row) for row in rows]
+
+    def delete(self, job_id: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def compact(self) -> None:
+        """Copy the WAL back into the database file and truncate it (frees its disk space)."""
+        self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def import_job(self, progress: dict, config: Optional[dict], created_at: float) -> None:
+        """Insert a job from the files of an older version, keeping its original times."""
+        self.save_progress(progress, now=created_at)
+        if config is not None:
+            self.save_config(progress["job_id"], config, now=created_at)
+
+    @staticmethod
+    def _meta(row: sqlite3.Row) -> dict:
+        meta = {key: row[key] for key in row.keys() if key != "progress"}
+        meta["progress"] = json.loads(row["progress"]) if row["progress"] != "{}" else None
+        return meta
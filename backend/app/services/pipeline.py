@@ -0,0 +1,230 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .batches import EventBatch
+from .dispatcher import BatchDispatcher
+from .progress import Checkpoint, JobProgress, ProgressStore
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+class ProgressSink:
+    """Stage 3: persists checkpoints and progress from a thread of its own.
+
+    The sender hands over checkpoints without blocking; only the latest one
+    matters, so a burst of acknowledged batches costs a single write. The
+    job's error report is flushed before each checkpoint so that the rows
+    it covers are on disk first. Progress is also written periodically, so
+    it stays fresh while the transform is held back by a full queue.
+
+    Event keys of batches accepted by Meta (`sent`) are handed to
+    `record_sent` from the same thread, before the checkpoint that covers them.
+    Batches Meta did not accept (`failed`) go to `record_failed` the same way,
+    so they are in the failed-batch spool before a checkpoint skips past them,
+    and so do the single events Meta rejected (`rejected`, to `record_rejected`).
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        progress: JobProgress,
+        store: ProgressStore,
+        interval: float,
+        record_sent: Optional[Callable[[List[str]], None]] = None,
+        record_failed: Optional[Callable[[int, EventBatch], None]] = None,
+        record_rejected: Optional[Callable[[List[Tuple[bytes, str]]], None]] = None,
+    ) -> None:
+        self._job_id = job_id
+        self._progress = progress
+        self._store = store
+        self._interval = interval
+        self._record_sent = record_sent
+        self._record_failed = record_failed
+        self._record_rejected = record_rejected
+        self._sent_keys: List[str] = []
+        self._failed: List[Tuple[int, EventBatch]] = []
+        self._rejected: List[Tuple[bytes, str]] = []
+        self._checkpoint: Optional[Checkpoint] = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"sink-{job_id[:8]}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def checkpoint(self, checkpoint: Checkpoint) -> None:
+        with self._cond:
+            self._checkpoint = checkpoint
+            self._cond.notify()
+
+    def sent(self, batch: EventBatch) -> None:
+        if self._record_sent is None or not batch.event_keys:
+            return
+        with self._cond:
+            self._sent_keys.extend(batch.event_keys)
+
+    def failed(self, number: int, batch: EventBatch) -> None:
+        if self._record_failed is None:
+            return
+        with self._cond:
+            self._failed.append((number, batch))
+
+    def rejected(self, events: List[Tuple[bytes, str]]) -> None:
+        if self._record_rejected is None:
+            return
+        with self._cond:
+            self._rejected.extend(events)
+
+    def close(self) -> None:
+        """Write what is pending and stop the thread (blocking)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._checkpoint is None and not self._closed:
+                    self._cond.wait(self._interval)
+                checkpoint, self._checkpoint = self._checkpoint, None
+                sent_keys, self._sent_keys = self._sent_keys, []
+                failed, self._failed = self._failed, []
+                rejected, self._rejected = self._rejected, []
+                closed = self._closed
+            try:
+                if sent_keys:
+                    self._record_sent(sent_keys)
+                for number, batch in failed:
+                    self._record_failed(number, batch)
+                if rejected:
+                    self._record_rejected(rejected)
+                if checkpoint is not None:
+                    self._store.flush_error_writer(self._job_id)
+                    self._store.save_checkpoint(self._job_id, checkpoint)
+                self._store.update(self._progress)
+            except Exception as exc:
+                logger.error(f"Could not persist progress of job {self._job_id}: {exc}")
+            if closed:
+                return
+
+
+class JobPipeline:
+    """Runs one job as three stages connected by bounded queues.
+
+    1. Transform: a worker thread iterates the (blocking) batch generator,
+       which parses, hashes and serializes rows, possibly with the worker
+       pool behind it.
+    2. Send: `run` takes batches off an asyncio queue and hands them to the
+       dispatcher, which keeps up to MAX_IN_FLIGHT_BATCHES requests open.
+    3. Sink: a `ProgressSink` thread persists checkpoints and progress.
+
+    The queue holds PIPELINE_QUEUE_BATCHES batches. When it is full the
+    transform thread blocks, and when the dispatcher has no free slot the
+    sender stops taking batches, so a slow API throttles the whole job.
+    The event loop only moves batches between stages and never does CSV
+    work or file writes itself.
+
+    Setting `cancelled` stops the job: the sender stops taking batches at
+    once, and the requests already open to Meta get `abort_grace` seconds
+    to finish before they are aborted. Aborted batches, and those after
+    them, are not covered by any checkpoint, so a resumed job sends them
+    again.
+
+    `stop` is set when the pipeline stops for any reason; the transform can
+    watch it where it blocks on something other than the queue (a streaming
+    upload waiting for the client).
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        batches: Iterator[EventBatch],
+        dispatcher: BatchDispatcher,
+        sink: ProgressSink,
+        queue_size: int,
+        cancelled: asyncio.Event,
+        stop: Optional[threading.Event] = None,
+        abort_grace: float = 0.0,
+    ) -> None:
+        self._job_id = job_id
+        self._batches = batches
+        self._dispatcher = dispatcher
+        self._sink = sink
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._cancelled = cancelled
+        self._abort_grace = abort_grace
+        self._stop = stop if stop is not None else threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread = threading.Thread(target=self._produce, name=f"transform-{job_id[:8]}", daemon=True)
+
+    async def run(self) -> bool:
+        """Process the whole job; returns False if it was cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._sink.start()
+        self._thread.start()
+        send = asyncio.ensure_future(self._send_all())
+        cancel = asyncio.ensure_future(self._cancelled.wait())
+        try:
+            await asyncio.wait((send, cancel), return_when=asyncio.FIRST_COMPLETED)
+            if send.done():
+                return send.result()
+            return False
+        finally:
+            for task in (send, cancel):
+                task.cancel()
+            await asyncio.gather(send, cancel, return_exceptions=True)
+            self._stop.set()
+            # Requests still open to Meta when the job was cancelled or failed get a
+            # moment to finish, so their batches are not sent again on resume
+            await self._dispatcher.finish(self._abort_grace)
+            # The generator is closed by the thread that iterates it, once it notices the stop
+            await asyncio.to_thread(self._thread.join)
+            await asyncio.to_thread(self._sink.close)
+
+    async def _send_all(self) -> bool:
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failed):
+                raise item.exc
+            # Waits while MAX_IN_FLIGHT_BATCHES requests are already open
+            await self._dispatcher.submit(item)
+        await self._dispatcher.drain()
+        return True
+
+    def _produce(self) -> None:
+        try:
+            for batch in self._batches:
+                if not self._put(batch):
+                    return
+            self._put(_DONE)
+        except BaseException as exc:
+            self._put(_Failed(exc))
+        finally:
+            self._batches.close()
+
+    def _put(self, item) -> bool:
+        """Blocking put from the transform thread; False once the pipeline is stopping."""
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            try:
+                future.result(timeout=0.2)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._stop.is_set():
+                    future.cancel()
+                    return False
+            except concurrent.futures.CancelledError:
+                return False
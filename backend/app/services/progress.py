@@ -1,74 +1,419 @@
 import csv
+import gzip
 import json
+import os
+import shutil
+import time
 from dataclasses import dataclass, asdict
 from pathlib import Path
 from threading import Lock
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 from ..config import settings
+from .input_formats import INPUT_FILENAMES
+from .job_db import JobDatabase
+
+# Start of the `_error_reason` of events Meta rejected, as opposed to rows the transform rejected
+META_REJECTION_PREFIX = "Rechazado por Meta: "
 
 
 @dataclass
 class JobProgress:
     job_id: str
-    total_rows: int = 0
+    total_rows: int = 0  # estimate while running, exact once total_rows_exact is True
+    total_rows_exact: bool = False
+    estimated_total_rows: int = 0
+    total_bytes: int = 0
+    uploaded_bytes: int = 0
+    upload_complete: bool = True  # False while a streaming upload is still being received
+    processed_bytes: int = 0
     processed_rows: int = 0
     succeeded: int = 0
     failed: int = 0
+    skipped_duplicates: int = 0  # valid rows not sent because an earlier upload already sent the event
+    aggregated_events: int = 0  # events (one per invoice) built from the valid rows in aggregation mode
+    failed_batches: int = 0  # batches Meta rejected, waiting in the failed-batch spool for a retry
+    failed_batch_events: int = 0  # events in those batches
+    rejected_events: int = 0  # events Meta found invalid, isolated from their batch and reported in errors.csv
     status: str = "pending"  # pending | running | completed | failed | cancelled
     message: str = ""
     should_cancel: bool = False  # Flag to signal cancellation
+    queue_position: int = 0  # 1-based place in the scheduler queue while pending, 0 otherwise
+    hash_cache_hits: int = 0
+    hash_cache_misses: int = 0
+    hash_cache_hit_rate: float = 0.0  # derived, refreshed by to_dict()
 
     def to_dict(self) -> dict:
+        lookups = self.hash_cache_hits + self.hash_cache_misses
+        self.hash_cache_hit_rate = round(self.hash_cache_hits / lookups, 4) if lookups else 0.0
         return asdict(self)
 
 
+@dataclass
+class Checkpoint:
+    """Position and counters right after the last row of an acknowledged batch.
+
+    Every batch up to `batches_done` has been answered by Meta (successfully or
+    not), so a resumed job restarts reading at `byte_offset` with these counters.
+    """
+
+    batches_done: int = 0
+    byte_offset: int = 0
+    processed_rows: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    failed_batches: int = 0
+    rejected_events: int = 0
+    skipped_duplicates: int = 0
+    # Aggregation mode: the file is read again and the invoices up to `last_invoice`
+    # (an aggregate.Position) skipped; `events_done` of them were emitted
+    events_done: int = 0
+    last_invoice: Optional[List[int]] = None
+
+    @classmethod
+    def from_progress(cls, progress: JobProgress) -> "Checkpoint":
+        return cls(
+            byte_offset=progress.processed_bytes,
+            processed_rows=progress.processed_rows,
+            succeeded=progress.succeeded,
+            failed=progress.failed,
+            skipped_duplicates=progress.skipped_duplicates,
+        )
+
+    def apply_to(self, progress: JobProgress) -> None:
+        progress.processed_bytes = self.byte_offset
+        progress.processed_rows = self.processed_rows
+        progress.succeeded = self.succeeded
+        progress.failed = self.failed
+        progress.rejected_events = self.rejected_events
+        progress.skipped_duplicates = self.skipped_duplicates
+
+
+class ErrorReportWriter:
+    """Per-job errors report kept open for the whole job.
+
+    Rows are buffered in memory and written when `flush_rows` rows are pending,
+    when `flush_interval` seconds passed since the last write, and on close.
+    The header is fixed up-front from the input fieldnames plus `_error_reason`;
+    when appending to an existing report, its header is kept instead.
+    """
+
+    def __init__(self, path: Path, fieldnames: Sequence[str], flush_rows: int = 1000, flush_interval: float = 1.0) -> None:
+        self.path = path
+        self._fieldnames = [*fieldnames, "_error_reason"]
+        self._flush_rows = flush_rows
+        self._flush_interval = flush_interval
+        self._buffer: List[dict] = []
+        self._last_flush = time.monotonic()
+        self._lock = Lock()
+        self._file = None
+        self._writer = None
+
+    def write(self, row: dict, reason: str) -> None:
+        with self._lock:
+            self._buffer.append({**row, "_error_reason": reason} if row else {"_error_reason": reason})
+            if len(self._buffer) >= self._flush_rows or time.monotonic() - self._last_flush >= self._flush_interval:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        if self._file is None:
+            # Opened lazily so clean jobs never get an empty report
+            new_file = not self.path.exists()
+            opener = gzip.open if self.path.suffix == ".gz" else open
+            if not new_file:
+                with opener(self.path, "rt", newline="", encoding="utf-8") as f:
+                    header = next(csv.reader(f), None)
+                if header:
+                    self._fieldnames = header
+            self._file = opener(self.path, "at", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=self._fieldnames, restval="", extrasaction="ignore")
+            if new_file:
+                self._writer.writeheader()
+        self._writer.writerows(self._buffer)
+        self._buffer.clear()
+        self._file.flush()
+
+
 class ProgressStore:
-    def __init__(self, base_dir: Path) -> None:
+    def __init__(
+        self,
+        base_dir: Path,
+        flush_interval: float = 0.25,
+        flush_rows: int = 5000,
+        errors_flush_rows: int = 1000,
+        errors_flush_interval: float = 1.0,
+        errors_gzip: bool = False,
+    ) -> None:
         self._base_dir = base_dir
         self._base_dir.mkdir(parents=True, exist_ok=True)
+        self.db = JobDatabase(base_dir / "jobs.db")
         self._lock = Lock()
+        self._flush_interval = flush_interval
+        self._flush_rows = flush_rows
+        # job_id -> (monotonic time, processed_rows, status) of the last write to disk
+        self._last_flush: Dict[str, Tuple[float, int, str]] = {}
+        self._errors_flush_rows = errors_flush_rows
+        self._errors_flush_interval = errors_flush_interval
+        self._errors_gzip = errors_gzip
+        self._error_writers: Dict[str, ErrorReportWriter] = {}
+        # Progress objects of the jobs running in this process, served without touching disk
+        self._live: Dict[str, JobProgress] = {}
+        self._listeners: List[Callable[[str], None]] = []
 
     def job_dir(self, job_id: str) -> Path:
         d = self._base_dir / job_id
         d.mkdir(parents=True, exist_ok=True)
         return d
 
-    def progress_path(self, job_id: str) -> Path:
-        return self.job_dir(job_id) / "progress.json"
-
     def errors_csv_path(self, job_id: str) -> Path:
         return self.job_dir(job_id) / "errors.csv"
 
+    def errors_gzip_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "errors.csv.gz"
+
+    def failed_spool_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "failed_batches.spool"
+
     def log_path(self, job_id: str) -> Path:
         return self.job_dir(job_id) / "run.log"
 
-    def input_path(self, job_id: str) -> Path:
-        return self.job_dir(job_id) / "input.csv"
+    def input_path(self, job_id: str, input_format: str = "csv") -> Path:
+        return self.job_dir(job_id) / INPUT_FILENAMES[input_format]
+
+    def find_input(self, job_id: str) -> Optional[Path]:
+        """The job's stored input file, whatever its format."""
+        for name in INPUT_FILENAMES.values():
+            path = self.job_dir(job_id) / name
+            if path.exists():
+                return path
+        return None
+
+    def checkpoint_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "checkpoint.json"
+
+    def job_path(self, job_id: str) -> Path:
+        """The job's directory, without creating it."""
+        return self._base_dir / job_id
+
+    def save_job_config(self, job_id: str, config: dict) -> None:
+        """Persist what is needed to resume the job (transform config, company)."""
+        self.db.save_config(job_id, config)
+
+    def get_job_config(self, job_id: str) -> Optional[dict]:
+        return self.db.get_config(job_id)
+
+    def import_legacy_jobs(self) -> int:
+        """Move the progress.json / job.json files of older versions into the database."""
+        imported = 0
+        for job_dir in self._base_dir.iterdir():
+            progress_file = job_dir / "progress.json"
+            if not progress_file.is_file():
+                continue
+            try:
+                progress = JobProgress(**json.loads(progress_file.read_text())).to_dict()
+                config_file = job_dir / "job.json"
+                config = json.loads(config_file.read_text()) if config_file.is_file() else None
+                if not self.db.exists(job_dir.name):
+                    self.db.import_job(progress, config, created_at=job_dir.stat().st_mtime)
+                    imported += 1
+                progress_file.unlink()
+                config_file.unlink(missing_ok=True)
+            except Exception:
+                continue  # unreadable: left in place and ignored
+        return imported
+
+    def save_checkpoint(self, job_id: str, checkpoint: Checkpoint) -> None:
+        self._write_json(self.checkpoint_path(job_id), asdict(checkpoint))
+
+    def get_checkpoint(self, job_id: str) -> Optional[Checkpoint]:
+        try:
+            return Checkpoint(**json.loads(self.checkpoint_path(job_id).read_text()))
+        except Exception:
+            return None
+
+    def truncate_errors(self, job_id: str, keep_rows: int, keep_rejected: int = 0) -> None:
+        """Drop error rows written after the checkpoint, so a resumed job does not duplicate them.
+
+        The first `keep_rows` rows rejected by the transform are kept, and the
+        first `keep_rejected` events rejected by Meta (written in batch order).
+        """
+        for path in (self.errors_csv_path(job_id), self.errors_gzip_path(job_id)):
+            if not path.exists():
+                continue
+            if keep_rows <= 0 and keep_rejected <= 0:
+                path.unlink()
+                continue
+            opener = gzip.open if path.suffix == ".gz" else open
+            tmp_path = path.with_name(path.name + ".tmp")
+            with opener(path, "rt", newline="", encoding="utf-8") as src, opener(tmp_path, "wt", newline="", encoding="utf-8") as dst:
+                writer = csv.writer(dst)
+                rows = csv.reader(src)
+                kept = {False: keep_rows, True: keep_rejected}
+                try:
+                    header = next(rows, None)
+                    if header:
+                        writer.writerow(header)
+                    for row in rows:
+                        by_meta = bool(row) and row[-1].startswith(META_REJECTION_PREFIX)
+                        if kept[by_meta] > 0:
+                            kept[by_meta] -= 1
+                            writer.writerow(row)
+                        elif not kept[not by_meta]:
+                            break
+                except EOFError:
+                    pass  # gzip stream cut short by a crash: keep what could be read
+            os.replace(tmp_path, path)
+
+    def queue_path(self) -> Path:
+        return self._base_dir / "queue.json"
+
+    def save_queue(self, entries: List[dict]) -> None:
+        """Persist the scheduler queue (job ids in start order)."""
+        self._write_json(self.queue_path(), entries)
+
+    def get_queue(self) -> List[dict]:
+        try:
+            return json.loads(self.queue_path().read_text())
+        except Exception:
+            return []
+
+    def track(self, progress: JobProgress) -> None:
+        """Register the in-memory progress of a job running in this process."""
+        self._live[progress.job_id] = progress
+
+    def untrack(self, job_id: str) -> None:
+        self._live.pop(job_id, None)
+
+    def is_live(self, job_id: str) -> bool:
+        return job_id in self._live
+
+    def current(self, job_id: str) -> Optional[JobProgress]:
+        """The live progress object while the job runs here (changes apply to the job), else a copy from the database."""
+        return self._live.get(job_id) or self.get(job_id)
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        """Current progress as a dict: from memory while the job is live here, else from the database."""
+        progress = self.current(job_id)
+        return progress.to_dict() if progress else None
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Call `listener(job_id)` after every progress write (from any thread)."""
+        self._listeners.append(listener)
 
     def set(self, progress: JobProgress) -> None:
+        """Persist progress immediately (status changes, cancellation, final state)."""
+        with self._lock:
+            self._write(progress)
+
+    def update(self, progress: JobProgress) -> None:
+        """Record a per-row progress change; it is only written to the database when a flush is due.
+
+        A flush happens when the status changed since the last write, or when either
+        `flush_interval` seconds or `flush_rows` rows have passed.
+        """
+        last = self._last_flush.get(progress.job_id)
+        if last is not None:
+            last_time, last_rows, last_status = last
+            if (
+                progress.status == last_status
+                and progress.processed_rows - last_rows < self._flush_rows
+                and time.monotonic() - last_time < self._flush_interval
+            ):
+                return
         with self._lock:
-            self.progress_path(progress.job_id).write_text(json.dumps(progress.to_dict(), ensure_ascii=False))
+            self._write(progress)
+
+    def _write(self, progress: JobProgress) -> None:
+        self.db.save_progress(progress.to_dict())
+        if progress.status in ("completed", "failed", "cancelled"):
+            self._last_flush.pop(progress.job_id, None)
+        else:
+            self._last_flush[progress.job_id] = (time.monotonic(), progress.processed_rows, progress.status)
+        for listener in self._listeners:
+            listener(progress.job_id)
+
+    @staticmethod
+    def _write_json(path: Path, data) -> None:
+        # Write to a temp file and rename so readers never see a half-written JSON
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False))
+        os.replace(tmp_path, path)
 
     def get(self, job_id: str) -> Optional[JobProgress]:
         try:
-            data = json.loads(self.progress_path(job_id).read_text())
-            return JobProgress(**data)
+            data = self.db.get_progress(job_id)
+            return JobProgress(**data) if data else None
         except Exception:
             return None
 
-    def append_error(self, job_id: str, row: dict, reason: str) -> None:
+    def list_jobs(self, **filters) -> Tuple[List[dict], int]:
+        """Paged job listing (see `JobDatabase.list_jobs`), with live progress for running jobs."""
+        jobs, total = self.db.list_jobs(**filters)
+        for job in jobs:
+            live = self._live.get(job["job_id"])
+            if live is not None:
+                job["progress"] = live.to_dict()
+        return jobs, total
+
+    def delete_job(self, job_id: str) -> None:
+        """Remove a finished job: its directory and its database row."""
+        shutil.rmtree(self.job_path(job_id), ignore_errors=True)
+        self.db.delete(job_id)
+
+    def open_error_writer(self, job_id: str, fieldnames: Sequence[str]) -> ErrorReportWriter:
+        """Open the job's error report with a fixed header; reuses the writer if already open."""
         with self._lock:
-            path = self.errors_csv_path(job_id)
-            file_exists = path.exists()
-            with path.open("a", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=[*row.keys(), "_error_reason"]) if row else csv.DictWriter(f, fieldnames=["_error_reason"])
-                if not file_exists:
-                    writer.writeheader()
-                payload = {**row, "_error_reason": reason} if row else {"_error_reason": reason}
-                writer.writerow(payload)
+            writer = self._error_writers.get(job_id)
+            if writer is None:
+                path = self.errors_gzip_path(job_id) if self._errors_gzip else self.errors_csv_path(job_id)
+                writer = ErrorReportWriter(
+                    path,
+                    fieldnames,
+                    flush_rows=self._errors_flush_rows,
+                    flush_interval=self._errors_flush_interval,
+                )
+                self._error_writers[job_id] = writer
+            return writer
+
+    def flush_error_writer(self, job_id: str) -> None:
+        writer = self._error_writers.get(job_id)
+        if writer is not None:
+            writer.flush()
+
+    def close_error_writer(self, job_id: str) -> None:
+        with self._lock:
+            writer = self._error_writers.pop(job_id, None)
+        if writer is not None:
+            writer.close()
+
+    def append_error(self, job_id: str, row: dict, reason: str) -> None:
+        writer = self._error_writers.get(job_id)
+        if writer is None:
+            writer = self.open_error_writer(job_id, list(row.keys()) if row else [])
+        writer.write(row, reason)
 
 
-progress_store = ProgressStore(settings.uploads_dir)
+progress_store = ProgressStore(
+    settings.uploads_dir,
+    flush_interval=settings.progress_flush_interval,
+    flush_rows=settings.progress_flush_rows,
+    errors_flush_rows=settings.errors_flush_rows,
+    errors_flush_interval=settings.errors_flush_interval,
+    errors_gzip=settings.errors_gzip,
+)
 
 
@@ -0,0 +1,225 @@
+"""Process-wide adaptive rate control for Graph API calls.
+
+One controller exists per (access token, dataset) pair and is shared by every
+job using it, so concurrent jobs split the quota instead of each one retrying
+on its own. The controller applies AIMD to both the number of concurrent
+requests and a token-bucket request rate:
+
+* multiplicative decrease on 429s, throttling error codes, or when the
+  `x-app-usage` / `x-business-use-case-usage` headers report high utilization;
+* additive increase after successful calls while utilization stays low.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Graph API error codes that mean "slow down" even when the HTTP status is 400/403
+THROTTLING_ERROR_CODES = {4, 17, 32, 613, 80004}
+
+
+def usage_percent(headers: httpx.Headers) -> Tuple[float, float]:
+    """Return (highest utilization %, seconds until access is regained) from Meta's usage headers."""
+    highest = 0.0
+    regain_seconds = 0.0
+    app_usage = headers.get("x-app-usage")
+    if app_usage:
+        try:
+            data = json.loads(app_usage)
+            highest = max(highest, *(float(data.get(k, 0)) for k in ("call_count", "total_cputime", "total_time")))
+        except (ValueError, TypeError, AttributeError):
+            pass
+    buc_usage = headers.get("x-business-use-case-usage")
+    if buc_usage:
+        try:
+            for entries in json.loads(buc_usage).values():
+                for entry in entries:
+                    highest = max(highest, *(float(entry.get(k, 0)) for k in ("call_count", "total_cputime", "total_time")))
+                    # Meta reports this one in minutes
+                    regain_seconds = max(regain_seconds, float(entry.get("estimated_time_to_regain_access", 0)) * 60)
+        except (ValueError, TypeError, AttributeError):
+            pass
+    return highest, regain_seconds
+
+
+def retry_after_seconds(headers: httpx.Headers) -> float:
+    try:
+        return max(0.0, float(headers.get("retry-after", 0)))
+    except ValueError:
+        return 0.0
+
+
+def is_throttling_response(resp: httpx.Response) -> bool:
+    if resp.status_code == 429:
+        return True
+    if resp.status_code in (400, 403):
+        try:
+            code = resp.json().get("error", {}).get("code")
+        except Exception:
+            return False
+        return code in THROTTLING_ERROR_CODES
+    return False
+
+
+class AdaptiveRateController:
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_rate: float,
+        min_rate: float = 0.2,
+        high_usage: float = 90.0,
+        low_usage: float = 75.0,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.high_usage = high_usage
+        self.low_usage = low_usage
+        self.concurrency = float(self.max_concurrency)
+        self.rate = max_rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._active = 0
+        self._changed: Optional[asyncio.Condition] = None
+        self._turn: Optional[asyncio.Lock] = None
+        self._changed_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.throttled = 0
+        self.last_usage = 0.0
+
+    def _condition(self) -> asyncio.Condition:
+        # asyncio primitives belong to one loop; rebuild it if the controller outlives its loop
+        loop = asyncio.get_running_loop()
+        if self._changed is None or self._changed_loop is not loop:
+            self._changed = asyncio.Condition()
+            self._turn = asyncio.Lock()
+            self._changed_loop = loop
+            self._active = 0
+        return self._changed
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot and one rate token for the duration of a request.
+
+        Requests get them in the order they asked: they line up on a FIFO lock
+        and only the one at the front waits for a slot and then a token, so an
+        early batch cannot keep losing the race to later ones.
+        """
+        changed = self._condition()
+        acquired = False
+        try:
+            async with self._turn:
+                async with changed:
+                    while self._active >= int(self.concurrency):
+                        await changed.wait()
+                    self._active += 1
+                    acquired = True
+                await self._take_token()
+            yield
+        finally:
+            if acquired:
+                async with changed:
+                    self._active -= 1
+                    # Only the request at the front of the line waits on it
+                    changed.notify()
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+    def observe(self, resp: httpx.Response) -> None:
+        """Adapt limits to a Graph API response."""
+        usage, regain_seconds = usage_percent(resp.headers)
+        self.last_usage = usage
+        if is_throttling_response(resp):
+            self.throttled += 1
+            self._decrease(max(retry_after_seconds(resp.headers), regain_seconds))
+        elif usage >= self.high_usage:
+            self._decrease(regain_seconds)
+        elif 200 <= resp.status_code < 300 and usage < self.low_usage:
+            self._increase()
+
+    def backoff_delay(self, attempt: int, retry_after: float = 0.0) -> float:
+        """Exponential backoff with jitter, never shorter than the server's Retry-After."""
+        ceiling = settings.retry_backoff_base * (2 ** attempt)
+        return max(retry_after, random.uniform(ceiling / 2, ceiling))
+
+    def _decrease(self, pause_seconds: float = 0.0) -> None:
+        now = time.monotonic()
+        if pause_seconds > 0:
+            self._paused_until = max(self._paused_until, now + pause_seconds)
+        # A burst of 429s from requests that were already in flight counts as one signal
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"Meta throttling: concurrency -> {int(self.concurrency)}, rate -> {self.rate:.2f} req/s")
+
+    def _increase(self) -> None:
+        if self.concurrency >= self.max_concurrency and self.rate >= self.max_rate:
+            return
+        self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+        # Waiting senders re-check the higher limit the next time a slot is released
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": int(self.concurrency),
+            "rate": round(self.rate, 2),
+            "active": self._active,
+            "throttled": self.throttled,
+            "last_usage": self.last_usage,
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 1)),
+        }
+
+
+class RateControllerRegistry:
+    def __init__(self) -> None:
+        self._controllers: Dict[Tuple[str, str], AdaptiveRateController] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(access_token: str, dataset_id: str) -> Tuple[str, str]:
+        # Never keep raw tokens around as dictionary keys
+        return hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16], dataset_id
+
+    def get(self, access_token: str, dataset_id: str) -> AdaptiveRateController:
+        key = self._key(access_token, dataset_id)
+        with self._lock:
+            controller = self._controllers.get(key)
+            if controller is None:
+                controller = AdaptiveRateController(
+                    max_concurrency=settings.rate_max_concurrency,
+                    max_rate=settings.rate_max_requests_per_second,
+                )
+                self._controllers[key] = controller
+            return controller
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {f"{token}:{dataset}": c.snapshot() for (token, dataset), c in self._controllers.items()}
+
+
+rate_controllers = RateControllerRegistry()
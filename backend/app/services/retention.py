@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, Optional
+
+from ..config import settings
+from .dedup import SentEventIndex, sent_event_index
+from .input_formats import INPUT_FILENAMES
+from .progress import ProgressStore, progress_store
+from .scheduler import job_scheduler
+
+logger = logging.getLogger(__name__)
+
+_DAY = 24 * 3600
+
+
+def _dir_size(path: Path) -> int:
+    """Bytes of the files under `path`, subdirectories (aggregation spill files) included."""
+    total = 0
+    for file in path.rglob("*"):
+        try:
+            if file.is_file() and not file.is_symlink():
+                total += file.stat().st_size
+        except FileNotFoundError:
+            pass  # deleted meanwhile
+    return total
+
+
+class RetentionSweeper:
+    """Frees disk taken by finished jobs.
+
+    - The uploaded file of a job finished more than RETENTION_INPUT_DAYS ago
+      is deleted (the job can no longer be resumed, its errors report stays).
+      Failed jobs that can still be resumed or retried (with a checkpoint or
+      failed batches) keep it.
+    - The whole job (directory and database row) is deleted
+      RETENTION_JOB_DAYS after it finished.
+    - Events in the duplicate index (sent_events.db) are forgotten
+      RETENTION_JOB_DAYS after Meta accepted them, along with the jobs that
+      sent them: a later upload of the same event is sent again.
+    - If the uploads directory is still over UPLOADS_DISK_BUDGET_MB, uploaded
+      files (with the same exception) and then whole jobs are deleted, oldest
+      finished first.
+
+    Jobs that are queued or running are never touched: `idle(job_id)` is held
+    around each deletion, so a job cannot be resumed while its files go. A
+    limit of 0 disables that rule.
+    """
+
+    def __init__(
+        self,
+        store: ProgressStore,
+        input_days: float,
+        job_days: float,
+        disk_budget_bytes: int,
+        idle: Callable[[str], ContextManager[bool]],
+        sent_events: Optional[SentEventIndex] = None,
+    ) -> None:
+        self._store = store
+        self.input_days = input_days
+        self.job_days = job_days
+        self.disk_budget_bytes = disk_budget_bytes
+        self._idle = idle
+        self._sent_events = sent_events
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, int]:
+        """One pass over the finished jobs (blocking); returns what was deleted."""
+        now = time.time() if now is None else now
+        stats = {"inputs_deleted": 0, "jobs_deleted": 0, "bytes_freed": 0, "sent_events_pruned": 0}
+        finished = self._store.db.finished_jobs()
+
+        for job in finished:
+            age = now - job["finished_at"]
+            if self.job_days and age > self.job_days * _DAY:
+                job["deleted"] = self._delete_job(job["job_id"], stats) is not None
+            elif self.input_days and age > self.input_days * _DAY and not self._resumable(job):
+                self._delete_input(job["job_id"], stats)
+
+        if self.job_days and self._sent_events is not None:
+            stats["sent_events_pruned"] = self._sent_events.prune(now - self.job_days * _DAY)
+
+        if self.disk_budget_bytes:
+            remaining = [job for job in finished if not job.get("deleted")]
+            self._store.db.compact()
+            used = _dir_size(self._store.db.path.parent)
+            # Uploaded files first: they are the bulk of the space and the job stays listed
+            for job in remaining:
+                if used <= self.disk_budget_bytes:
+                    break
+                if not self._resumable(job):
+                    used -= self._delete_input(job["job_id"], stats) or 0
+            for job in remaining:
+                if used <= self.disk_budget_bytes:
+                    break
+                used -= self._delete_job(job["job_id"], stats) or 0
+
+        if stats["inputs_deleted"] or stats["jobs_deleted"] or stats["sent_events_pruned"]:
+            logger.info(
+                f"Retention: deleted {stats['inputs_deleted']} uploaded files and {stats['jobs_deleted']} jobs, "
+                f"{stats['bytes_freed'] / 1024 / 1024:.1f} MB freed, {stats['sent_events_pruned']} sent events forgotten"
+            )
+        return stats
+
+    async def run(self, interval: float) -> None:
+        """Sweep every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as exc:
+                logger.error(f"Retention sweep failed: {exc}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    def _resumable(self, job: dict) -> bool:
+        """A failed job that a resume or a retry of its failed batches can still finish."""
+        job_id = job["job_id"]
+        if job["status"] != "failed" or not self._store.job_path(job_id).exists():
+            return False
+        spool = self._store.failed_spool_path(job_id)
+        return self._store.checkpoint_path(job_id).exists() or (spool.exists() and spool.stat().st_size > 0)
+
+    def _delete_input(self, job_id: str, stats: Dict[str, int]) -> Optional[int]:
+        """Bytes freed, or None if the job was queued or started meanwhile."""
+        freed = 0
+        with self._idle(job_id) as idle:
+            if not idle:
+                return None
+            for name in INPUT_FILENAMES.values():
+                path = self._store.job_path(job_id) / name
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                freed += size
+        if freed:
+            stats["inputs_deleted"] += 1
+            stats["bytes_freed"] += freed
+        return freed
+
+    def _delete_job(self, job_id: str, stats: Dict[str, int]) -> Optional[int]:
+        """Bytes freed, or None if the job was queued or started meanwhile."""
+        with self._idle(job_id) as idle:
+            if not idle:
+                return None
+            freed = _dir_size(self._store.job_path(job_id))
+            self._store.delete_job(job_id)
+        stats["jobs_deleted"] += 1
+        stats["bytes_freed"] += freed
+        return freed
+
+
+retention_sweeper = RetentionSweeper(
+    progress_store,
+    input_days=settings.retention_input_days,
+    job_days=settings.retention_job_days,
+    disk_budget_bytes=settings.uploads_disk_budget_mb * 1024 * 1024,
+    idle=job_scheduler.idle,
+    sent_events=sent_event_index,
+)
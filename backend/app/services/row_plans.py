@@ -0,0 +1,81 @@
+"""Company CSV schemas and the per-file row plans compiled from them.
+
+A schema names the column each event field is read from. When a file is
+opened its header is matched against the company's schema once, giving a
+`RowPlan` of column indexes: rows are then plain `csv.reader` lists and only
+the columns the event needs are read and stripped.
+"""
+from dataclasses import dataclass, field, fields
+from operator import itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_COMPANY = "fybeca"
+
+
+@dataclass(frozen=True)
+class CompanySchema:
+    """Column names in a company's sales export, by the event field they feed."""
+
+    company: str
+    email: str = "CORREO"
+    phone: str = "CELULAR"
+    invoice: str = "FACTURA"
+    category: str = "NOMBRE_CATEGORIA"
+    item: str = "COD_ITEM"
+    value: str = "VENTA_NETA"
+    date: str = "FECHA"
+    phone_region: str = "EC"  # region assumed for phone numbers without a country code
+
+    @property
+    def columns(self) -> List[str]:
+        return [getattr(self, f.name) for f in fields(self) if f.name not in ("company", "phone_region")]
+
+
+_schemas: Dict[str, CompanySchema] = {}
+
+
+def register_schema(schema: CompanySchema) -> None:
+    _schemas[schema.company] = schema
+
+
+def get_schema(company: Optional[str]) -> CompanySchema:
+    """The company's schema; companies without one of their own use the default company's."""
+    return _schemas.get(company or DEFAULT_COMPANY) or _schemas[DEFAULT_COMPANY]
+
+
+# Fybeca and SanaSana export the same columns
+register_schema(CompanySchema("fybeca"))
+register_schema(CompanySchema("sanasana"))
+
+
+@dataclass(frozen=True)
+class RowPlan:
+    """Column indexes of one file for its company's schema (picklable, for the worker pool)."""
+
+    fieldnames: Tuple[str, ...]
+    indexes: Tuple[int, ...]  # email, phone, invoice, category, item, value, date
+    phone_region: str
+    # Returns the seven values of a row in one C call; raises IndexError on rows shorter than `width`
+    pick: itemgetter = field(repr=False, compare=False)
+    width: int = field(repr=False, compare=False)
+
+    def date_value(self, row: Sequence[str]) -> str:
+        date_index = self.indexes[6]
+        return row[date_index].strip() if len(row) > date_index else ""
+
+    def as_dict(self, row: Sequence[str]) -> Dict[str, str]:
+        """The row keyed by column name, for the error report (only built for rejected rows)."""
+        return {name: value.strip() for name, value in zip(self.fieldnames, row)}
+
+
+def compile_plan(schema: CompanySchema, fieldnames: Optional[Sequence[str]]) -> Tuple[Optional[RowPlan], List[str]]:
+    """Match a header against the schema: `(plan, [])`, or `(None, missing columns)`."""
+    fieldnames = tuple(fieldnames or ())
+    positions = {}
+    for i, name in enumerate(fieldnames):
+        positions[name] = i  # a repeated column reads its last occurrence, as with csv.DictReader
+    missing = [column for column in schema.columns if column not in positions]
+    if missing:
+        return None, missing
+    indexes = tuple(positions[column] for column in schema.columns)
+    return RowPlan(fieldnames, indexes, schema.phone_region, itemgetter(*indexes), max(indexes) + 1), []
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+from ..config import settings
+from .progress import ProgressStore, progress_store
+from .transform import TransformConfig
+from .upload_stream import UploadTee
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueuedJob:
+    job_id: str
+    company: str
+    cfg: TransformConfig
+    access_token: str
+    resume: bool = False
+    upload: Optional[UploadTee] = None  # streaming upload still being received, if any
+    retry_failed: bool = False  # only send again the batches in the job's failed-batch spool
+    enqueued_at: float = field(default_factory=time.time)
+    cancelled: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+JobRunner = Callable[[str, TransformConfig, str, bool, Optional[UploadTee], bool], Awaitable[None]]
+
+
+class JobScheduler:
+    """Admits jobs to run, at most MAX_CONCURRENT_JOBS at a time.
+
+    Waiting jobs are kept in a queue persisted to queue.json, so they survive
+    a restart. When a slot frees up the next job is taken from the company
+    with the fewest running jobs (oldest job first on ties), so one company
+    uploading many files cannot starve the other.
+
+    The scheduler is also the registry of the jobs of this process: queued
+    and running jobs are looked up here, and each one carries a `cancelled`
+    event that its pipeline waits on, so `cancel` stops a job right away
+    without anything polling progress.json.
+
+    All running jobs also share `batch_slots`, a cap of
+    MAX_TOTAL_IN_FLIGHT_BATCHES requests open to Meta for the whole process.
+    Jobs waiting on it are served in turn, each taking one slot at a time.
+
+    Other threads that touch a finished job's files hold it with `idle`, so
+    the job cannot be queued or started meanwhile.
+    """
+
+    def __init__(self, store: ProgressStore, max_concurrent_jobs: int, max_in_flight_batches: int) -> None:
+        self._store = store
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.max_in_flight_batches = max(1, max_in_flight_batches)
+        self._queue: List[QueuedJob] = []
+        self._running: Dict[str, QueuedJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[JobRunner] = None
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Held while a job is admitted (queued, or moved from the queue to running)
+        self._admission = threading.Lock()
+
+    def set_runner(self, runner: JobRunner) -> None:
+        self._runner = runner
+
+    def batch_slots(self) -> asyncio.Semaphore:
+        """The process-wide in-flight batch limit (one semaphore per event loop)."""
+        loop = asyncio.get_running_loop()
+        if self._batch_slots is None or self._slots_loop is not loop:
+            self._batch_slots = asyncio.Semaphore(self.max_in_flight_batches)
+            self._slots_loop = loop
+        return self._batch_slots
+
+    def enqueue(self, job: QueuedJob) -> None:
+        with self._admission:
+            if self.is_queued(job.job_id) or self.is_running(job.job_id):
+                logger.warning(f"Job {job.job_id} is already queued or running")
+                return
+            self._queue.append(job)
+        self._changed()
+
+    @contextmanager
+    def idle(self, job_id: str) -> Iterator[bool]:
+        """Hold off admitting jobs for the block; yields whether `job_id` is neither queued nor running.
+
+        Blocking: meant for worker threads, and only for short blocks.
+        """
+        with self._admission:
+            yield not (self.is_queued(job_id) or self.is_running(job_id))
+
+    def queued_job(self, job_id: str) -> Optional[QueuedJob]:
+        """The queue entry of `job_id`; None if it is not queued."""
+        return next((job for job in self._queue if job.job_id == job_id), None)
+
+    def remove(self, job_id: str) -> bool:
+        """Take a job out of the queue; False if it is not queued (running or unknown)."""
+        for i, job in enumerate(self._queue):
+            if job.job_id == job_id:
+                del self._queue[i]
+                self._changed()
+                return True
+        return False
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued ("queued") or running ("running") job; None if it is neither."""
+        if self.remove(job_id):
+            return "queued"
+        job = self._running.get(job_id)
+        if job is None:
+            return None
+        job.cancelled.set()
+        return "running"
+
+    def cancel_token(self, job_id: str) -> asyncio.Event:
+        """Event set when the running job `job_id` is cancelled."""
+        return self._running[job_id].cancelled
+
+    def active_jobs(self) -> List[str]:
+        """Ids of the running jobs followed by the queued ones in start order."""
+        return list(self._running) + [job.job_id for job in self._ordered()]
+
+    def position(self, job_id: str) -> int:
+        """1-based place in the start order, 0 if the job is not queued."""
+        for position, job in enumerate(self._ordered(), start=1):
+            if job.job_id == job_id:
+                return position
+        return 0
+
+    def is_queued(self, job_id: str) -> bool:
+        return any(job.job_id == job_id for job in self._queue)
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self._running
+
+    def persisted_order(self) -> List[str]:
+        """Job ids of the queue saved by a previous process, in order."""
+        return [entry["job_id"] for entry in self._store.get_queue() if "job_id" in entry]
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrent_jobs": self.max_concurrent_jobs,
+            "max_in_flight_batches": self.max_in_flight_batches,
+            "running": [{"job_id": job.job_id, "company": job.company} for job in self._running.values()],
+            "queued": [{"job_id": job.job_id, "company": job.company} for job in self._ordered()],
+        }
+
+    def _ordered(self) -> List[QueuedJob]:
+        """The queue in the order jobs will start, applying per-company fairness."""
+        running: Dict[str, int] = {}
+        for job in self._running.values():
+            running[job.company] = running.get(job.company, 0) + 1
+        remaining = list(self._queue)
+        ordered = []
+        while remaining:
+            # Front of the queue of the company with the fewest running jobs
+            best = min(range(len(remaining)), key=lambda i: (running.get(remaining[i].company, 0), i))
+            job = remaining.pop(best)
+            running[job.company] = running.get(job.company, 0) + 1
+            ordered.append(job)
+        return ordered
+
+    def _changed(self) -> None:
+        self._start_ready()
+        ordered = self._ordered()
+        self._store.save_queue(
+            [{"job_id": job.job_id, "company": job.company, "enqueued_at": job.enqueued_at} for job in ordered]
+        )
+        for position, job in enumerate(ordered, start=1):
+            progress = self._store.get(job.job_id)
+            if progress and (progress.queue_position != position or progress.status != "pending"):
+                progress.status = "pending"
+                progress.queue_position = position
+                progress.message = f"En cola (posición {position})"
+                self._store.set(progress)
+
+    def _start_ready(self) -> None:
+        while self._queue and len(self._running) < self.max_concurrent_jobs:
+            job = self._ordered()[0]
+            with self._admission:
+                self._queue.remove(job)
+                self._running[job.job_id] = job
+            task = asyncio.create_task(self._run(job))
+            self._tasks[job.job_id] = task
+            logger.info(f"Job {job.job_id} ({job.company}) started, {len(self._queue)} queued")
+
+    async def _run(self, job: QueuedJob) -> None:
+        try:
+            await self._runner(job.job_id, job.cfg, job.access_token, job.resume, job.upload, job.retry_failed)
+        except Exception as exc:
+            logger.error(f"Job {job.job_id} stopped unexpectedly: {exc}", exc_info=True)
+        finally:
+            self._running.pop(job.job_id, None)
+            self._tasks.pop(job.job_id, None)
+            self._changed()
+
+
+job_scheduler = JobScheduler(
+    progress_store,
+    max_concurrent_jobs=settings.max_concurrent_jobs,
+    max_in_flight_batches=settings.max_total_in_flight_batches,
+)
@@ -1,124 +1,393 @@
 import csv
-from dataclasses import dataclass
+import itertools
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Generator, List, Optional
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
 
 from ..config import settings
-from ..utils.normalization import normalize_and_hash_email, normalize_and_hash_phone
-from ..utils.time import parse_date_to_unix_seconds
+from .aggregate import Position, aggregate_invoices
+from .batches import EventBatch, build_batch, encode_event
+from .dedup import DuplicateFilter, duplicate_filter, event_key
+from .input_formats import InputStream, detect_input_format, open_input
+from .progress import Checkpoint
+from .row_plans import DEFAULT_COMPANY, CompanySchema, RowPlan, compile_plan, get_schema
+from .upload_stream import UploadTee
+from ..utils.normalization import cached_hash_email, cached_hash_phone, hash_cache
+from ..utils.time import detect_date_format, get_date_parser, get_zoneinfo
 
 
-CSV_HEADERS_FYBECA = [
-    "CORREO",
-    "CELULAR",
-    "FACTURA",
-    "NOMBRE_CATEGORIA",
-    "COD_ITEM",
-    "VENTA_NETA",
-    "FECHA",
-]
+# Rows used to estimate the average row length when the upload did not count lines
+ROW_ESTIMATE_SAMPLE = 1000
+# Rows used to detect the file's date format
+DATE_SAMPLE_ROWS = 1000
 
 
 @dataclass
 class TransformConfig:
     dataset_id: str
+    company: str = DEFAULT_COMPANY  # picks the CSV schema (see row_plans)
     event_name: str = "Purchase"
     upload_tag: Optional[str] = None
     timezone: str = settings.timezone_default
+    date_format: Optional[str] = None  # detected from the first rows of the file when None
+    skip_duplicates: bool = True  # skip events an earlier upload already sent to the dataset
+    aggregate_invoices: bool = False  # one Purchase per invoice instead of one per line item
 
 
-def iter_transform_events(input_csv_path: Path, config: TransformConfig, job_progress, progress_store) -> Generator[Dict, None, None]:
-    """Yield events one-by-one from the CSV, updating progress as we go."""
-    with input_csv_path.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        # Validate expected headers (best-effort)
-        missing = [h for h in CSV_HEADERS_FYBECA if h not in reader.fieldnames]
-        if missing:
-            job_progress.status = "failed"
-            job_progress.message = f"Faltan columnas: {', '.join(missing)}"
-            progress_store.set(job_progress)
+def transform_row(row: List[str], plan: RowPlan, config: TransformConfig, stats=None) -> Tuple[Optional[Dict], Optional[str]]:
+    """Transform one `csv.reader` row into a CAPI event, reading only the plan's columns.
+
+    Returns `(event, None)` on success or `(None, reason)` when the row is invalid.
+    Hash cache hits/misses are counted on `stats` when given.
+    """
+    try:
+        email, phone, factura, categoria, cod_item, venta, fecha = plan.pick(row)
+    except IndexError:
+        # Short row: the missing columns are empty, as with csv.DictReader
+        email, phone, factura, categoria, cod_item, venta, fecha = plan.pick(row + [""] * plan.width)
+    email_h = cached_hash_email(email.strip(), stats)
+    phone_h = cached_hash_phone(phone.strip(), default_region=plan.phone_region, stats=stats)
+    if not email_h and not phone_h:
+        return None, "Sin email ni teléfono válido"
+
+    event_time = get_date_parser(config.timezone, config.date_format)(fecha.strip())
+    if not event_time:
+        return None, "Fecha inválida"
+
+    try:
+        value = float(venta or 0)
+    except ValueError:
+        value = 0.0
+
+    factura = factura.strip()
+    cod_item = cod_item.strip()
+    categoria = categoria.strip()
+
+    user_data = {}
+    if email_h:
+        user_data["em"] = email_h
+    if phone_h:
+        user_data["ph"] = phone_h
+
+    custom_data = {
+        "value": value,
+        "currency": "USD",
+        "order_id": factura or None,
+        "content_ids": [cod_item] if cod_item else [],
+        "content_type": "product",
+        "content_category": categoria or None,
+    }
+
+    event = {
+        "event_name": config.event_name,
+        "event_time": event_time,
+        "user_data": user_data,
+        "custom_data": custom_data,
+        "action_source": "physical_store",
+        "event_id": factura or None,
+    }
+    return event, None
+
+
+def rejected_event_row(event: Dict, schema: CompanySchema, config: TransformConfig) -> Dict[str, str]:
+    """The columns an event sent to Meta still tells about its row, for the error report.
+
+    Email and phone only travel hashed, so they are left empty.
+    """
+    custom = event.get("custom_data") or {}
+    event_time = datetime.fromtimestamp(event["event_time"], get_zoneinfo(config.timezone))
+    return {
+        schema.invoice: custom.get("order_id") or "",
+        schema.category: custom.get("content_category") or "",
+        schema.item: " ".join(custom.get("content_ids") or ()),
+        schema.value: custom.get("value", ""),
+        schema.date: event_time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+class ByteCountingLines:
+    """Iterate decoded lines of a binary stream, tracking how many bytes were consumed.
+
+    `csv.reader` pulls whole lines from this iterator, so after each row `offset`
+    is exactly the byte position where the next row starts.
+    """
+
+    def __init__(self, raw, encoding: str = "utf-8") -> None:
+        self._raw = raw
+        self._encoding = encoding
+        self.offset = 0
+
+    def __iter__(self):
+        encoding = self._encoding
+        for line in self._raw:
+            self.offset += len(line)
+            yield line.decode(encoding)
+
+
+def compile_row_plan(fieldnames: Optional[List[str]], config: TransformConfig, job_progress, progress_store) -> Optional[RowPlan]:
+    """The file's row plan for the company's schema; marks the job failed if columns are missing."""
+    plan, missing = compile_plan(get_schema(config.company), fieldnames)
+    if plan is None:
+        job_progress.status = "failed"
+        job_progress.message = f"Faltan columnas: {', '.join(missing)}"
+        progress_store.set(job_progress)
+    return plan
+
+
+def with_detected_date_format(config: TransformConfig, plan: RowPlan, sample_rows: Iterable[List[str]]) -> TransformConfig:
+    """Return the config with `date_format` detected from a sample of rows ("" if none matched)."""
+    if config.date_format is not None:
+        return config
+    fmt = detect_date_format(plan.date_value(row) for row in sample_rows)
+    return replace(config, date_format=fmt or "")
+
+
+def iter_transform_events(
+    input_csv_path: Path,
+    config: TransformConfig,
+    job_progress,
+    progress_store,
+    start_offset: int = 0,
+    upload: Optional[UploadTee] = None,
+    duplicates: Optional[DuplicateFilter] = None,
+    stop: Optional[threading.Event] = None,
+) -> Generator[Dict, None, None]:
+    """Yield events one-by-one from the CSV, updating progress as we go.
+
+    The file is read once: progress is reported as bytes consumed against the
+    file size, and `total_rows` holds an estimate until the end of the file.
+    Compressed inputs (.csv.gz, .csv.zst, .zip) are decompressed as a stream and
+    bytes are counted on the decompressed CSV. With `start_offset` (a checkpoint)
+    reading resumes at that byte position. With `upload` the file is read while
+    it is still being received; setting `stop` ends a wait for more data. Events
+    `duplicates` knows as already sent are counted in `skipped_duplicates` and
+    not yielded.
+    """
+    if upload is not None and not upload.complete:
+        raw = upload.open_reader(on_wait=lambda: _sync_upload_progress(job_progress, upload, progress_store), stop=stop)
+        source = InputStream(raw, detect_input_format(input_csv_path.name), upload.total_bytes)
+    else:
+        upload = None
+        source = open_input(input_csv_path)
+    job_progress.total_bytes = source.estimate_size(0)
+    with source:
+        lines = ByteCountingLines(source.stream)
+        reader = csv.reader(lines)
+        fieldnames = next(reader, None)
+        plan = compile_row_plan(fieldnames, config, job_progress, progress_store)
+        if plan is None:
             return
+        header_bytes = lines.offset
+        resumed = start_offset > header_bytes
+
+        rows = ((row, lines.offset, reader.line_num) for row in reader)
+        head = list(itertools.islice(rows, DATE_SAMPLE_ROWS)) if config.date_format is None else []
+        config = with_detected_date_format(config, plan, (row for row, _, _ in head))
+        if start_offset > lines.offset:
+            # Skip straight past the rows of acknowledged batches without parsing them
+            head = []
+            source.skip_to(start_offset, lines.offset)
+            lines.offset = start_offset
+        elif resumed:
+            # The checkpoint falls inside the sampled rows: drop the ones already sent
+            head = [item for item in head if item[1] > start_offset]
+        rows = itertools.chain(head, rows)
 
-        # Optionally count rows first to show progress percentage
+        errors = progress_store.open_error_writer(job_progress.job_id, fieldnames)
         try:
-            total = 0
-            for _ in reader:
-                total += 1
-            job_progress.total_rows = total
-            f.seek(0)
-            reader = csv.DictReader(f)
-        except Exception:
-            pass
-
-        for row in reader:
-            raw = {k: (v or "").strip() for k, v in row.items()}
-            if not any(raw.values()):
-                continue
-
-            email_h = normalize_and_hash_email(raw.get("CORREO"))
-            phone_h = normalize_and_hash_phone(raw.get("CELULAR"), default_region="EC")
-            if not email_h and not phone_h:
-                job_progress.failed += 1
-                progress_store.append_error(job_progress.job_id, raw, "Sin email ni teléfono válido")
-                job_progress.processed_rows += 1
-                progress_store.set(job_progress)
-                continue
+            for row, offset, line_num in rows:
+                job_progress.processed_bytes = offset
+                if offset > job_progress.total_bytes:
+                    job_progress.total_bytes = offset  # the size was underestimated
+                if line_num % ROW_ESTIMATE_SAMPLE == 0:
+                    if upload is not None:
+                        job_progress.uploaded_bytes = upload.received_bytes
+                        source.compressed_size = upload.total_bytes
+                    if source.size is None:
+                        # Compressed or still uploading: refine the size from the compression ratio so far
+                        job_progress.total_bytes = source.estimate_size(offset)
+                    if job_progress.total_bytes and not resumed and (source.size is None or not job_progress.estimated_total_rows):
+                        # Average row length of the rows so far, extrapolated to the file size
+                        avg_row = (offset - header_bytes) / (line_num - 1)
+                        job_progress.estimated_total_rows = int((job_progress.total_bytes - header_bytes) / avg_row)
+                        job_progress.total_rows = job_progress.estimated_total_rows
+
+                event, reason = transform_row(row, plan, config, job_progress)
+                if event is None:
+                    raw = plan.as_dict(row)
+                    if not any(raw.values()):
+                        continue  # blank line
+                    job_progress.processed_rows += 1
+                    job_progress.failed += 1
+                    errors.write(raw, reason)
+                    progress_store.update(job_progress)
+                    continue
 
-            event_time = parse_date_to_unix_seconds(raw.get("FECHA"), timezone_name=config.timezone)
-            if not event_time:
-                job_progress.failed += 1
-                progress_store.append_error(job_progress.job_id, raw, "Fecha inválida")
                 job_progress.processed_rows += 1
-                progress_store.set(job_progress)
-                continue
-
-            try:
-                value = float(raw.get("VENTA_NETA") or 0)
-            except ValueError:
-                value = 0.0
-
-            factura = (raw.get("FACTURA") or "").strip()
-            cod_item = (raw.get("COD_ITEM") or "").strip()
-            categoria = (raw.get("NOMBRE_CATEGORIA") or "").strip()
-
-            user_data = {}
-            if email_h:
-                user_data["em"] = email_h
-            if phone_h:
-                user_data["ph"] = phone_h
-
-            custom_data = {
-                "value": value,
-                "currency": "USD",
-                "order_id": factura or None,
-                "content_ids": [cod_item] if cod_item else [],
-                "content_type": "product",
-                "content_category": categoria or None,
-            }
-
-            event = {
-                "event_name": config.event_name,
-                "event_time": event_time,
-                "user_data": user_data,
-                "custom_data": custom_data,
-                "action_source": "physical_store",
-                "event_id": factura or None,
-            }
-
-            job_progress.succeeded += 1
-            job_progress.processed_rows += 1
-            progress_store.set(job_progress)
-            yield event
-
-
-def iter_event_batches(input_csv_path: Path, config: TransformConfig, job_progress, progress_store, batch_size: int) -> Generator[List[Dict], None, None]:
-    batch: List[Dict] = []
-    for event in iter_transform_events(input_csv_path, config, job_progress, progress_store):
-        batch.append(event)
+                if duplicates is not None and duplicates.is_duplicate(event_key(event["event_name"], event["event_id"])):
+                    job_progress.skipped_duplicates += 1
+                    progress_store.update(job_progress)
+                    continue
+
+                job_progress.succeeded += 1
+                progress_store.update(job_progress)
+                yield event
+        finally:
+            # Left open: events Meta rejects are added to the same report until the job
+            # ends, and whoever runs the job closes it
+            progress_store.flush_error_writer(job_progress.job_id)
+            hash_cache.flush()
+
+        # The file has been fully read: the row count is now exact
+        if upload is not None:
+            job_progress.uploaded_bytes = upload.received_bytes
+            job_progress.upload_complete = True
+        job_progress.total_rows = job_progress.processed_rows
+        job_progress.total_rows_exact = True
+        job_progress.total_bytes = job_progress.processed_bytes = lines.offset
+        # Make sure the final counters are on disk while the last batch is being sent
+        progress_store.set(job_progress)
+
+
+def _sync_upload_progress(job_progress, upload: UploadTee, progress_store) -> None:
+    # Called while the transform waits for the client, so upload progress keeps moving
+    job_progress.uploaded_bytes = upload.received_bytes
+    progress_store.update(job_progress)
+
+
+def iter_event_batches(
+    input_csv_path: Path,
+    config: TransformConfig,
+    job_progress,
+    progress_store,
+    batch_size: int,
+    start_offset: int = 0,
+    upload: Optional[UploadTee] = None,
+    aggregate_checkpoint: Optional[Checkpoint] = None,
+    stop: Optional[threading.Event] = None,
+) -> Generator[EventBatch, None, None]:
+    """Yield ready-to-send batches; events are serialized here, in the transform stage.
+
+    Each batch carries the checkpoint (byte offset + counters) right after its last row,
+    and the keys of its events for the duplicate index.
+    Compressed files and files still being uploaded are always read by the serial
+    engine: the worker pool splits a plain file into byte ranges read in place.
+    `stop` is the pipeline's stop event (see `iter_transform_events`).
+
+    With `config.aggregate_invoices` see `iter_aggregated_batches`, resumed from
+    `aggregate_checkpoint`.
+    """
+    duplicates = duplicate_filter(config, job_progress.job_id)
+    if config.aggregate_invoices:
+        yield from iter_aggregated_batches(
+            input_csv_path, config, job_progress, progress_store, batch_size, upload, duplicates, aggregate_checkpoint, stop
+        )
+        return
+    parallel = input_csv_path.suffix == ".csv" and (upload is None or upload.complete)
+    if settings.transform_workers > 1 and parallel:
+        from .transform_pool import iter_event_batches_parallel
+
+        yield from iter_event_batches_parallel(
+            input_csv_path,
+            config,
+            job_progress,
+            progress_store,
+            batch_size,
+            workers=settings.transform_workers,
+            chunk_bytes=settings.transform_chunk_bytes,
+            start_offset=start_offset,
+            duplicates=duplicates,
+        )
+        return
+
+    batch: List[bytes] = []
+    keys: List[str] = []
+    events = iter_transform_events(
+        input_csv_path,
+        config,
+        job_progress,
+        progress_store,
+        start_offset=start_offset,
+        upload=upload,
+        duplicates=duplicates,
+        stop=stop,
+    )
+    for event in events:
+        batch.append(encode_event(event))
+        key = event_key(event["event_name"], event["event_id"])
+        if key:
+            keys.append(key)
         if len(batch) >= batch_size:
-            yield batch
-            batch = []
+            yield build_batch(batch, config.upload_tag, settings.request_gzip, Checkpoint.from_progress(job_progress), keys)
+            batch, keys = [], []
     if batch:
-        yield batch
+        yield build_batch(batch, config.upload_tag, settings.request_gzip, Checkpoint.from_progress(job_progress), keys)
+
+
+def iter_aggregated_batches(
+    input_csv_path: Path,
+    config: TransformConfig,
+    job_progress,
+    progress_store,
+    batch_size: int,
+    upload: Optional[UploadTee],
+    duplicates: Optional[DuplicateFilter],
+    checkpoint: Optional[Checkpoint],
+    stop: Optional[threading.Event] = None,
+) -> Generator[EventBatch, None, None]:
+    """Batches of one event per invoice (see `InvoiceAggregator`).
+
+    Batches only start once the whole file has been read. Their checkpoints do not
+    point into the file but hold the position of their last invoice: a resumed job
+    reads the file again from the start, with the counters reset, and skips the
+    invoices up to that position. Positions do not depend on which invoices are
+    left out as duplicates, so none is lost or sent twice when that changes.
+    """
+    rows = iter_transform_events(
+        input_csv_path, config, job_progress, progress_store, upload=upload, duplicates=duplicates, stop=stop
+    )
+    cancelled = False
+
+    def until_cancelled():
+        # No batch comes out while the file is read, so the pipeline cannot stop
+        # this thread between batches; stop reading when the pipeline stops instead
+        nonlocal cancelled
+        for event in rows:
+            # Rows numbered over the whole file (errors and duplicates included)
+            yield job_progress.processed_rows, event
+            if stop is not None and stop.is_set():
+                cancelled = True
+                return
+
+    events = aggregate_invoices(
+        until_cancelled(),
+        progress_store.job_dir(job_progress.job_id) / "aggregate",
+        settings.aggregate_max_invoices,
+        after=checkpoint.last_invoice if checkpoint else None,
+    )
+    batch: List[bytes] = []
+    keys: List[str] = []
+    emitted = checkpoint.events_done if checkpoint and checkpoint.last_invoice else 0
+    try:
+        for position, event in events:
+            if cancelled:
+                return
+            emitted += 1
+            job_progress.aggregated_events = emitted
+            batch.append(encode_event(event))
+            key = event_key(event["event_name"], event["event_id"])
+            if key:
+                keys.append(key)
+            if len(batch) >= batch_size:
+                yield build_batch(batch, config.upload_tag, settings.request_gzip, _invoice_checkpoint(emitted, position), keys)
+                batch, keys = [], []
+        if batch:
+            yield build_batch(batch, config.upload_tag, settings.request_gzip, _invoice_checkpoint(emitted, position), keys)
+    finally:
+        events.close()
 
 
+def _invoice_checkpoint(events_done: int, last_invoice: Position) -> Checkpoint:
+    return Checkpoint(events_done=events_done, last_invoice=list(last_invoice))
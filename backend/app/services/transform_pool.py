@@ -0,0 +1,225 @@
+"""Multi-process transform engine.
+
+The input CSV is split into byte ranges aligned to line boundaries and each range
+is transformed by a worker of a shared ProcessPoolExecutor. Results are consumed
+in submission order, so events (and therefore batches) come out in the same order
+as with the single-process engine.
+
+Rows are assumed not to contain quoted line breaks, which holds for the
+Fybeca/SanaSana exports; use TRANSFORM_WORKERS=1 for files that may have them.
+"""
+import csv
+import io
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Deque, Dict, Generator, Iterator, List, Optional, Tuple
+
+from ..config import settings
+from ..utils.normalization import hash_cache
+from .batches import EventBatch, build_batch, encode_event
+from .dedup import DuplicateFilter, event_key
+from .progress import Checkpoint
+from .row_plans import RowPlan
+from .transform import (
+    DATE_SAMPLE_ROWS,
+    ROW_ESTIMATE_SAMPLE,
+    ByteCountingLines,
+    TransformConfig,
+    compile_row_plan,
+    transform_row,
+    with_detected_date_format,
+)
+
+
+@dataclass
+class ChunkResult:
+    events: List[bytes] = field(default_factory=list)  # serialized in the worker, cheap to pickle back
+    keys: List[Optional[str]] = field(default_factory=list)  # per event, for the duplicate index
+    # Per event: (byte offset after its row, processed_rows, failed) counted from the chunk start
+    marks: List[Tuple[int, int, int]] = field(default_factory=list)
+    errors: List[Tuple[Dict[str, str], str]] = field(default_factory=list)
+    rows_read: int = 0
+    processed_rows: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    end_offset: int = 0
+    hash_cache_hits: int = 0
+    hash_cache_misses: int = 0
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = Lock()
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by all jobs, so concurrent jobs do not oversubscribe the CPU."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawn: forking a process that already runs the event loop and its threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def split_ranges(path: Path, start: int, chunk_bytes: int) -> Iterator[Tuple[int, int]]:
+    """Yield `(start, end)` byte ranges of roughly `chunk_bytes`, each ending at a line boundary."""
+    size = path.stat().st_size
+    with path.open("rb") as f:
+        pos = start
+        while pos < size:
+            target = pos + chunk_bytes
+            if target >= size:
+                yield pos, size
+                return
+            f.seek(target)
+            f.readline()  # move to the start of the next line
+            end = f.tell()
+            yield pos, end
+            pos = end
+
+
+def transform_chunk(path: str, start: int, end: int, plan: RowPlan, config: TransformConfig) -> ChunkResult:
+    """Worker entry point: transform the rows in `[start, end)` of the file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    result = ChunkResult(end_offset=end)
+    lines = ByteCountingLines(io.BytesIO(data))
+    for row in csv.reader(lines):
+        result.rows_read += 1
+        event, reason = transform_row(row, plan, config, result)
+        if event is None:
+            raw = plan.as_dict(row)
+            if not any(raw.values()):
+                continue  # blank line
+            result.processed_rows += 1
+            result.failed += 1
+            result.errors.append((raw, reason))
+            continue
+        result.processed_rows += 1
+        result.succeeded += 1
+        result.events.append(encode_event(event))
+        result.keys.append(event_key(event["event_name"], event["event_id"]))
+        result.marks.append((start + lines.offset, result.processed_rows, result.failed))
+    hash_cache.flush()
+    return result
+
+
+def iter_event_batches_parallel(
+    input_csv_path: Path,
+    config: TransformConfig,
+    job_progress,
+    progress_store,
+    batch_size: int,
+    workers: int,
+    chunk_bytes: int,
+    start_offset: int = 0,
+    duplicates: Optional[DuplicateFilter] = None,
+) -> Generator[EventBatch, None, None]:
+    """Same contract as `iter_event_batches`, transforming chunks in worker processes.
+
+    Duplicates are filtered here, as the results come back: the index lives in this process.
+    """
+    job_progress.total_bytes = input_csv_path.stat().st_size
+    with input_csv_path.open("rb") as f:
+        lines = ByteCountingLines(f)
+        reader = csv.reader(lines)
+        fieldnames = next(reader, None)
+        header_bytes = lines.offset
+        plan = compile_row_plan(fieldnames, config, job_progress, progress_store)
+        if plan is None:
+            return
+        # Detect the date format once here so every worker uses the same one
+        config = with_detected_date_format(config, plan, itertools.islice(reader, DATE_SAMPLE_ROWS))
+
+    pool = get_pool(workers)
+    read_start = max(header_bytes, start_offset)
+    ranges = split_ranges(input_csv_path, read_start, chunk_bytes)
+    pending: Deque[Future] = deque()
+    errors = progress_store.open_error_writer(job_progress.job_id, fieldnames)
+    batch: List[bytes] = []
+    keys: List[str] = []
+    rows_read = 0
+
+    def submit_next() -> None:
+        rng = next(ranges, None)
+        if rng is not None:
+            pending.append(pool.submit(transform_chunk, str(input_csv_path), rng[0], rng[1], plan, config))
+
+    try:
+        # Keep a couple of chunks per worker queued so workers never wait on the consumer
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            result: ChunkResult = pending.popleft().result()
+            submit_next()
+
+            base_processed, base_succeeded, base_failed = job_progress.processed_rows, job_progress.succeeded, job_progress.failed
+            skipped = [duplicates is not None and duplicates.is_duplicate(key) for key in result.keys]
+            base_skipped, chunk_skipped = job_progress.skipped_duplicates, sum(skipped)
+            rows_read += result.rows_read
+            job_progress.processed_rows += result.processed_rows
+            job_progress.succeeded += result.succeeded - chunk_skipped
+            job_progress.skipped_duplicates += chunk_skipped
+            job_progress.failed += result.failed
+            job_progress.hash_cache_hits += result.hash_cache_hits
+            job_progress.hash_cache_misses += result.hash_cache_misses
+            job_progress.processed_bytes = result.end_offset
+            if not job_progress.estimated_total_rows and rows_read >= ROW_ESTIMATE_SAMPLE:
+                avg_row = (result.end_offset - read_start) / rows_read
+                job_progress.estimated_total_rows = int((job_progress.total_bytes - header_bytes) / avg_row)
+                job_progress.total_rows = job_progress.estimated_total_rows
+            for raw, reason in result.errors:
+                errors.write(raw, reason)
+            progress_store.update(job_progress)
+
+            skipped_so_far = 0
+            for i, (event, key, (offset, processed, failed)) in enumerate(zip(result.events, result.keys, result.marks)):
+                if skipped[i]:
+                    skipped_so_far += 1
+                    continue
+                batch.append(event)
+                if key:
+                    keys.append(key)
+                if len(batch) >= batch_size:
+                    checkpoint = Checkpoint(
+                        byte_offset=offset,
+                        processed_rows=base_processed + processed,
+                        succeeded=base_succeeded + i + 1 - skipped_so_far,
+                        failed=base_failed + failed,
+                        skipped_duplicates=base_skipped + skipped_so_far,
+                    )
+                    yield build_batch(batch, config.upload_tag, settings.request_gzip, checkpoint, keys)
+                    batch, keys = [], []
+    finally:
+        for fut in pending:
+            fut.cancel()
+        # Left open: events Meta rejects are added to the same report until the job
+        # ends, and whoever runs the job closes it
+        progress_store.flush_error_writer(job_progress.job_id)
+
+    job_progress.total_rows = job_progress.processed_rows
+    job_progress.total_rows_exact = True
+    job_progress.processed_bytes = job_progress.total_bytes
+    progress_store.set(job_progress)
+    if batch:
+        yield build_batch(batch, config.upload_tag, settings.request_gzip, Checkpoint.from_progress(job_progress), keys)
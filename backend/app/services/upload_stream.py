@@ -0,0 +1,146 @@
+import threading
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+class UploadAborted(Exception):
+    """The client went away before the whole file was received."""
+
+
+class ReadStopped(Exception):
+    """The job stopped (cancelled or failed) while waiting for more of the upload."""
+
+
+class UploadTee:
+    """An upload being written to disk while the transform is already reading it.
+
+    The request handler `write`s the incoming chunks to the job's input file;
+    readers opened with `open_reader` follow the file as it grows and block at
+    its current end until more data arrives or the upload is closed. Because
+    the data goes through the file, nothing is buffered in memory and the
+    uploaded file is left on disk exactly as for a regular upload.
+    """
+
+    def __init__(self, path: Path, expected_bytes: int = 0) -> None:
+        self.path = path
+        self.expected_bytes = expected_bytes
+        self.received_bytes = 0
+        self.complete = False
+        self._error: Optional[str] = None
+        self._file = path.open("wb")
+        self._cond = threading.Condition()
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        # Flushed on every chunk so readers with their own file handle can see it
+        self._file.flush()
+        with self._cond:
+            self.received_bytes += len(chunk)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Mark the upload as complete: readers stop at the end of the file."""
+        self._file.close()
+        with self._cond:
+            self.complete = True
+            self._cond.notify_all()
+
+    def fail(self, reason: str) -> None:
+        """Abort the upload: readers raise `UploadAborted`."""
+        self._file.close()
+        with self._cond:
+            self._error = reason
+            self._cond.notify_all()
+
+    @property
+    def total_bytes(self) -> int:
+        """Final size once complete, otherwise the announced size (or what arrived so far)."""
+        if self.complete:
+            return self.received_bytes
+        return max(self.expected_bytes, self.received_bytes)
+
+    def wait_for_data(
+        self,
+        position: int,
+        on_wait: Optional[Callable[[], None]] = None,
+        stop: Optional[threading.Event] = None,
+        poll: float = 0.5,
+    ) -> bool:
+        """Block until the file is longer than `position`; False once complete with nothing more to read.
+
+        Raises `ReadStopped` if `stop` is set meanwhile (checked every `poll` seconds).
+        """
+        with self._cond:
+            while self.received_bytes <= position:
+                if self._error is not None:
+                    raise UploadAborted(self._error)
+                if self.complete:
+                    return False
+                if stop is not None and stop.is_set():
+                    raise ReadStopped()
+                self._cond.wait(poll)
+                if on_wait is not None:
+                    on_wait()
+            return True
+
+    def open_reader(
+        self, on_wait: Optional[Callable[[], None]] = None, stop: Optional[threading.Event] = None
+    ) -> "UploadReader":
+        return UploadReader(self, on_wait, stop)
+
+
+class UploadReader:
+    """Binary line iterator over a growing upload (see `UploadTee`).
+
+    Only whole lines are yielded until the upload is complete, so a row is never
+    parsed from a half-received line. `on_wait` is called periodically while the
+    reader is blocked waiting for the client, and setting `stop` makes it raise
+    `ReadStopped` instead of waiting any longer.
+    """
+
+    def __init__(
+        self, tee: UploadTee, on_wait: Optional[Callable[[], None]] = None, stop: Optional[threading.Event] = None
+    ) -> None:
+        self._tee = tee
+        self._on_wait = on_wait
+        self._stop = stop
+        self._file = tee.path.open("rb")
+
+    def __iter__(self) -> Iterator[bytes]:
+        pending = b""
+        while True:
+            line = self._file.readline()
+            if line.endswith(b"\n"):
+                yield pending + line if pending else line
+                pending = b""
+                continue
+            pending += line
+            if not self._tee.wait_for_data(self._file.tell(), self._on_wait, self._stop):
+                # Upload complete: the last line may have no trailing newline
+                if pending:
+                    yield pending
+                return
+
+    def read(self, size: int = -1) -> bytes:
+        """Read like a regular file, blocking at the current end of the upload (used by decompressors)."""
+        while True:
+            data = self._file.read(size)
+            if data or size == 0:
+                return data
+            if not self._tee.wait_for_data(self._file.tell(), self._on_wait, self._stop):
+                return b""
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "UploadReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,9 +1,14 @@
 import hashlib
 import re
+import sqlite3
+import threading
+from collections import OrderedDict
 from typing import Optional
 
 import phonenumbers
 
+from ..config import settings
+
 
 def sha256_hex(value: str) -> str:
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
@@ -30,16 +35,41 @@ def _digits_only(value: str) -> str:
     return re.sub(r"\D+", "", value)
 
 
-def normalize_phone_to_cc_digits(phone: Optional[str], default_region: str = "EC") -> Optional[str]:
-    """Return phone as digits including country code (no plus), suitable for hashing per Meta spec.
+def _ec_mobile_pattern() -> Optional["re.Pattern[str]"]:
+    # Taken from phonenumbers' own metadata so the fast path validates exactly like the library
+    try:
+        pattern = phonenumbers.PhoneMetadata.metadata_for_region("EC").mobile.national_number_pattern
+        return re.compile(f"(?:{pattern})")
+    except Exception:
+        return None
 
-    Examples:
-      +593987654321 -> 593987654321
-      0987654321 (EC) -> 593987654321
+
+# 09XXXXXXXX, 9XXXXXXXX, 5939XXXXXXXX or +5939XXXXXXXX with nothing else around
+_EC_MOBILE_FORMATS = re.compile(r"(\+593|593|0)?(9\d{8})")
+_EC_MOBILE_NATIONAL = _ec_mobile_pattern()
+
+
+def _fast_ec_mobile(phone_str: str, default_region: str) -> Optional[str]:
+    """Normalize the dominant Ecuadorian mobile formats without phonenumbers.
+
+    Returns None when the input is not one of those exact formats, in which case
+    the caller must fall back to the library.
     """
-    if not phone:
+    if _EC_MOBILE_NATIONAL is None:
         return None
-    phone_str = phone.strip()
+    match = _EC_MOBILE_FORMATS.fullmatch(phone_str)
+    if match is None:
+        return None
+    prefix, national = match.groups()
+    # Without "+593" the number is only Ecuadorian if EC is the default region
+    if prefix != "+593" and default_region != "EC":
+        return None
+    if _EC_MOBILE_NATIONAL.fullmatch(national) is None:
+        return None
+    return f"593{national}"
+
+
+def _normalize_phone_with_phonenumbers(phone_str: str, default_region: str) -> Optional[str]:
     try:
         if phone_str.startswith("+"):
             parsed = phonenumbers.parse(phone_str, None)
@@ -61,6 +91,24 @@ def normalize_phone_to_cc_digits(phone: Optional[str], default_region: str = "EC
         return None
 
 
+def normalize_phone_to_cc_digits(phone: Optional[str], default_region: str = "EC") -> Optional[str]:
+    """Return phone as digits including country code (no plus), suitable for hashing per Meta spec.
+
+    Plain Ecuadorian mobiles take a regex fast path; anything else goes through phonenumbers.
+
+    Examples:
+      +593987654321 -> 593987654321
+      0987654321 (EC) -> 593987654321
+    """
+    if not phone:
+        return None
+    phone_str = phone.strip()
+    fast = _fast_ec_mobile(phone_str, default_region)
+    if fast is not None:
+        return fast
+    return _normalize_phone_with_phonenumbers(phone_str, default_region)
+
+
 def normalize_and_hash_phone(phone: Optional[str], default_region: str = "EC") -> Optional[str]:
     digits = normalize_phone_to_cc_digits(phone, default_region=default_region)
     if not digits:
@@ -68,3 +116,123 @@ def normalize_and_hash_phone(phone: Optional[str], default_region: str = "EC") -
     return sha256_hex(digits)
 
 
+# Bump when the normalization rules change so persisted hashes are not reused
+NORMALIZATION_VERSION = "1"
+
+_MISSING = object()
+
+
+class HashCache:
+    """Bounded LRU cache of raw email/phone value -> normalized SHA-256 (or None if invalid).
+
+    Optionally backed by a SQLite file shared between jobs, keyed by normalization
+    version, kind and default region. The file stores SHA-256 of the raw value,
+    never the raw PII itself.
+
+    Counters are accumulated on the `stats` object passed by the caller (anything
+    with `hash_cache_hits` / `hash_cache_misses` attributes), so each job reports
+    its own hit rate even though the cache is shared.
+    """
+
+    def __init__(self, maxsize: int, db_path: str = "") -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._db_path = db_path
+        self._local = threading.local()
+        self._pending: list = []
+        self._pending_lock = threading.Lock()
+
+    def lookup(self, kind: str, raw: Optional[str], region: str, compute, stats=None) -> Optional[str]:
+        if not raw:
+            return None
+        key = (kind, region, raw)
+        data = self._data
+        value = data.get(key, _MISSING)
+        if value is not _MISSING:
+            try:
+                data.move_to_end(key)  # most recently used
+            except KeyError:
+                pass  # evicted meanwhile by another thread
+            if stats is not None:
+                stats.hash_cache_hits += 1
+            return value
+
+        value = self._db_get(key) if self._db_path else _MISSING
+        if value is _MISSING:
+            value = compute()
+            if self._db_path:
+                self._db_put(key, value)
+            if stats is not None:
+                stats.hash_cache_misses += 1
+        elif stats is not None:
+            stats.hash_cache_hits += 1
+
+        data[key] = value
+        if len(data) > self.maxsize:
+            try:
+                # O(1); deleting the first key of a plain dict rescans the deleted slots in front of it
+                data.popitem(last=False)  # least recently used
+            except KeyError:
+                pass
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    # --- optional on-disk tier -------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                " version TEXT, kind TEXT, region TEXT, raw_sha TEXT, hash TEXT,"
+                " PRIMARY KEY (version, kind, region, raw_sha)) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _db_key(key) -> tuple:
+        kind, region, raw = key
+        return NORMALIZATION_VERSION, kind, region, sha256_hex(raw)
+
+    def _db_get(self, key):
+        row = self._conn().execute(
+            "SELECT hash FROM hashes WHERE version=? AND kind=? AND region=? AND raw_sha=?", self._db_key(key)
+        ).fetchone()
+        return _MISSING if row is None else row[0]
+
+    def _db_put(self, key, value: Optional[str]) -> None:
+        with self._pending_lock:
+            self._pending.append((*self._db_key(key), value))
+            if len(self._pending) < 1000:
+                return
+            pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def flush(self) -> None:
+        if not self._db_path:
+            return
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self._write(pending)
+
+    def _write(self, rows: list) -> None:
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+
+hash_cache = HashCache(settings.hash_cache_size, settings.hash_cache_db)
+
+
+def cached_hash_email(email: Optional[str], stats=None) -> Optional[str]:
+    return hash_cache.lookup("em", email, "", lambda: normalize_and_hash_email(email), stats)
+
+
+def cached_hash_phone(phone: Optional[str], default_region: str = "EC", stats=None) -> Optional[str]:
+    return hash_cache.lookup("ph", phone, default_region, lambda: normalize_and_hash_phone(phone, default_region), stats)
@@ -1,19 +1,26 @@
+import re
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
 
 from dateutil import parser as date_parser
 from zoneinfo import ZoneInfo
 
 
+@lru_cache(maxsize=64)
+def get_zoneinfo(timezone_name: str) -> ZoneInfo:
+    return ZoneInfo(timezone_name)
+
+
 def parse_date_to_unix_seconds(date_str: str, timezone_name: str = "America/Guayaquil") -> Optional[int]:
     """Parse various date formats (YYYY-MM-DD, D/M/YY, etc.) and return UNIX seconds at 12:00 (noon) local time.
-    
-    Using noon instead of midnight prevents timezone conversion issues where events 
+
+    Using noon instead of midnight prevents timezone conversion issues where events
     might shift to the previous day when viewed in different timezones.
     """
     if not date_str:
         return None
-    tz = ZoneInfo(timezone_name)
+    tz = get_zoneinfo(timezone_name)
     try:
         # First try strict YYYY-MM-DD for speed
         if len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-":
@@ -27,3 +34,108 @@ def parse_date_to_unix_seconds(date_str: str, timezone_name: str = "America/Guay
         return None
 
 
+# Formats a file can be detected as. Month-first comes before day-first so that a
+# sample where every date is ambiguous keeps dateutil's default (dayfirst=False).
+DATE_FORMAT_CANDIDATES = [
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%m/%d/%y",
+    "%d/%m/%y",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m-%d-%y",
+    "%d-%m-%y",
+    "%m-%d-%Y",
+    "%d-%m-%Y",
+]
+
+_FIELD_PATTERNS = {"%Y": r"(\d{4})", "%y": r"(\d{2})", "%m": r"(\d{1,2})", "%d": r"(\d{1,2})"}
+
+
+def _expand_two_digit_year(year: int) -> int:
+    # Same rule as dateutil: pick the century that puts the year within 50 years of today
+    current = datetime.now().year
+    year += current // 100 * 100
+    if year >= current + 50:
+        year -= 100
+    elif year < current - 50:
+        year += 100
+    return year
+
+
+class CompiledDateFormat:
+    """A regex-based parser for one of DATE_FORMAT_CANDIDATES (e.g. "%d/%m/%y")."""
+
+    def __init__(self, fmt: str) -> None:
+        self.fmt = fmt
+        self.fields = re.findall(r"%[Yymd]", fmt)
+        pattern = re.escape(fmt)
+        for field in self.fields:
+            pattern = pattern.replace(re.escape(field), _FIELD_PATTERNS[field], 1)
+        self._regex = re.compile(pattern)
+
+    def parse(self, date_str: str):
+        """Return (year, month, day) or None when the string does not match / is not a real date."""
+        match = self._regex.fullmatch(date_str)
+        if match is None:
+            return None
+        values = dict(zip(self.fields, map(int, match.groups())))
+        year = values["%Y"] if "%Y" in values else _expand_two_digit_year(values["%y"])
+        month, day = values["%m"], values["%d"]
+        try:
+            datetime(year, month, day)
+        except ValueError:
+            return None
+        return year, month, day
+
+
+def detect_date_format(samples: Iterable[str]) -> Optional[str]:
+    """Pick the candidate format that parses the most sample dates, or None if none does."""
+    values = [s for s in samples if s]
+    best, best_count = None, 0
+    for fmt in DATE_FORMAT_CANDIDATES:
+        compiled = CompiledDateFormat(fmt)
+        count = sum(1 for v in values if compiled.parse(v) is not None)
+        if count > best_count:
+            best, best_count = fmt, count
+    return best
+
+
+class DateParser:
+    """Per-file date parser: a compiled format plus a date string -> epoch cache.
+
+    A file only holds a few dozen distinct dates, and each day maps to a single
+    noon timestamp, so almost every row is a dictionary lookup. Strings that do
+    not match the detected format fall back to `parse_date_to_unix_seconds`.
+    """
+
+    MAX_CACHED = 10_000
+
+    def __init__(self, timezone_name: str, date_format: Optional[str] = None) -> None:
+        self.timezone_name = timezone_name
+        self._tz = get_zoneinfo(timezone_name)
+        self._compiled = CompiledDateFormat(date_format) if date_format else None
+        self._cache: Dict[str, Optional[int]] = {}
+
+    def __call__(self, date_str: Optional[str]) -> Optional[int]:
+        if not date_str:
+            return None
+        try:
+            return self._cache[date_str]
+        except KeyError:
+            pass
+        parsed = self._compiled.parse(date_str) if self._compiled else None
+        if parsed is not None:
+            year, month, day = parsed
+            result = int(datetime(year, month, day, hour=12, minute=0, second=0, tzinfo=self._tz).timestamp())
+        else:
+            result = parse_date_to_unix_seconds(date_str, timezone_name=self.timezone_name)
+        if len(self._cache) >= self.MAX_CACHED:
+            self._cache.clear()
+        self._cache[date_str] = result
+        return result
+
+
+@lru_cache(maxsize=64)
+def get_date_parser(timezone_name: str, date_format: Optional[str] = None) -> DateParser:
+    return DateParser(timezone_name, date_format)
@@ -0,0 +1,38 @@
+"""Shared helpers for the benchmark scripts.
+
+Import this module before anything from `app` so that settings point to a
+throwaway uploads directory instead of the real one.
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix="capi-bench-"))
+os.environ["UPLOADS_DIR"] = str(WORK_DIR / "uploads")
+
+SAMPLE_CSV = Path(__file__).resolve().parents[2] / "test_1000_rows.csv"
+
+
+def scaled_csv(rows: int, name: str = "input.csv") -> Path:
+    """Write `rows` data rows by repeating test_1000_rows.csv and return the path."""
+    lines = SAMPLE_CSV.read_text(encoding="utf-8").splitlines()
+    header, body = lines[0], [line for line in lines[1:] if line.strip()]
+    path = WORK_DIR / name
+    with path.open("w", encoding="utf-8", newline="") as out:
+        out.write(header + "\n")
+        written = 0
+        while written < rows:
+            chunk = body[: rows - written]
+            out.write("\n".join(chunk) + "\n")
+            written += len(chunk)
+    return path
+
+
+class Timer:
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,77 @@
+"""Line-item events versus one Purchase per invoice.
+
+Builds invoices of 1-7 products (4 on average) from the sample rows and sends
+the file once per mode through the mock Graph API. `--shuffle` scatters the
+rows of each invoice over the file, and a small `--max-invoices` forces the
+aggregation to spill partial invoices to disk.
+
+Usage (from backend/):
+    python -m benchmarks.bench_aggregate --rows 200000 --latency 0.2
+    python -m benchmarks.bench_aggregate --rows 200000 --shuffle --max-invoices 5000
+"""
+import argparse
+import asyncio
+import random
+
+from ._common import SAMPLE_CSV, Timer, WORK_DIR
+
+from app.config import settings
+from app.services.capi_client import CapiClient
+from app.services.dispatcher import BatchDispatcher
+from app.services.progress import JobProgress, ProgressStore
+from app.services.transform import TransformConfig, iter_event_batches
+
+from .mock_graph import MockGraph, mock_transport
+
+
+def invoice_csv(rows: int, shuffle: bool, seed: int = 7):
+    """`rows` line items grouped in invoices: buyer and date of the invoice's first row, products of the others."""
+    lines = SAMPLE_CSV.read_text(encoding="utf-8").splitlines()
+    header, body = lines[0], [line.split(",") for line in lines[1:] if line.strip()]
+    rnd = random.Random(seed)
+    out, invoice = [], 0
+    while len(out) < rows:
+        invoice += 1
+        buyer = body[invoice % len(body)]
+        for _ in range(min(rnd.randint(1, 7), rows - len(out))):
+            item = rnd.choice(body)
+            out.append(",".join([buyer[0], buyer[1], f"9{invoice:09d}", item[3], item[4], item[5], buyer[6]]))
+    if shuffle:
+        rnd.shuffle(out)
+    path = WORK_DIR / "invoices.csv"
+    path.write_text(header + "\n" + "\n".join(out) + "\n", encoding="utf-8")
+    return path
+
+
+async def send(store: ProgressStore, path, job_id: str, aggregate: bool, latency: float):
+    graph = MockGraph(latency=latency)
+    client = CapiClient(access_token="bench", transport=mock_transport(graph))
+    dispatcher = BatchDispatcher(client, "bench", None, max_in_flight=4)
+    progress = JobProgress(job_id=job_id, status="running")
+    cfg = TransformConfig(dataset_id="bench", skip_duplicates=False, aggregate_invoices=aggregate)
+    with Timer() as t:
+        for batch in iter_event_batches(path, cfg, progress, store, 999):
+            await dispatcher.submit(batch)
+        await dispatcher.drain()
+    await client.close()
+    return t.elapsed, graph.stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated round-trip in seconds")
+    parser.add_argument("--shuffle", action="store_true", help="rows of an invoice spread over the file")
+    parser.add_argument("--max-invoices", type=int, default=settings.aggregate_max_invoices)
+    args = parser.parse_args()
+
+    settings.aggregate_max_invoices = args.max_invoices
+    path = invoice_csv(args.rows, args.shuffle)
+    store = ProgressStore(WORK_DIR / "uploads-bench")
+    for label, job_id, aggregate in (("line items  ", "items", False), ("per invoice ", "invoices", True)):
+        elapsed, stats = asyncio.run(send(store, path, job_id, aggregate, args.latency))
+        print(f"{label} {elapsed:7.1f}s  events {stats.events:>9,}  requests {stats.requests:>6,}")
+
+
+if __name__ == "__main__":
+    main()
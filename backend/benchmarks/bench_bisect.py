@@ -0,0 +1,88 @@
+"""Batches rejected over a few invalid events, with and without bisecting them.
+
+The mock Graph API rejects every request holding one of `--bad` invoices
+(picked at random, each a few line-item events). The same file is sent with
+BISECT_MAX_REQUESTS=0, where each such batch fails as a whole, and with
+bisection, where only the invalid events end up in errors.csv.
+
+Usage (from backend/):
+    python -m benchmarks.bench_bisect --rows 200000 --bad 10 --latency 0.2
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import random
+import shutil
+from dataclasses import asdict
+
+from ._common import Timer
+
+from app.api.uploads import _process_job  # noqa: F401  (registers the scheduler's runner)
+from app.config import settings
+from app.services.capi_client import shared_http
+from app.services.progress import JobProgress, progress_store
+from app.services.scheduler import QueuedJob, job_scheduler
+from app.services.transform import TransformConfig
+
+from .bench_dedup import unique_rows, write_csv
+from .mock_graph import MockGraph, mock_transport
+
+
+async def send(job_id: str, path, cfg: TransformConfig, graph: MockGraph):
+    shutil.copyfile(path, progress_store.input_path(job_id))
+    progress_store.set(JobProgress(job_id=job_id, status="pending"))
+    progress_store.save_job_config(job_id, asdict(cfg))
+    requests, events = graph.stats.requests, graph.stats.events
+    with Timer() as t:
+        job_scheduler.enqueue(QueuedJob(job_id, cfg.company, cfg, "bench"))
+        while job_scheduler.is_queued(job_id) or job_scheduler.is_running(job_id):
+            await asyncio.sleep(0.05)
+    return t.elapsed, progress_store.get(job_id), graph.stats.requests - requests, graph.stats.events - events
+
+
+def error_reasons(job_id: str) -> dict:
+    path = progress_store.errors_csv_path(job_id)
+    if not path.exists():
+        return {}
+    reasons: dict = {}
+    with path.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            reason = row["_error_reason"].split(":")[0]
+            reasons[reason] = reasons.get(reason, 0) + 1
+    return reasons
+
+
+async def main_async(args) -> None:
+    logging.disable(logging.CRITICAL)  # several log lines per rejected request otherwise
+    rows = unique_rows(args.rows)
+    path = write_csv("bisect.csv", rows)
+    bad = {row.split(",")[2] for row in random.Random(7).sample(rows, args.bad)}
+    graph = MockGraph(latency=args.latency, reject_event_ids=bad)
+    shared_http.start(mock_transport(graph))
+    cfg = TransformConfig(dataset_id="bench", skip_duplicates=False)
+    try:
+        for label, job_id, max_requests in (("whole batch fails", "whole", 0), ("bisect", "bisect", args.max_requests)):
+            settings.bisect_max_requests = max_requests
+            elapsed, progress, requests, events = await send(job_id, path, cfg, graph)
+            print(
+                f"{label:<18} {elapsed:6.1f}s  requests {requests:>5,}  accepted {events:>9,}  "
+                f"failed batches {progress.failed_batches:>3}  rejected events {progress.rejected_events:>4}"
+            )
+            print(f"{'':<18} errors.csv: {error_reasons(job_id) or 'none'}")
+    finally:
+        await shared_http.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--bad", type=int, default=10, help="invoices whose events Meta rejects")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated round-trip in seconds")
+    parser.add_argument("--max-requests", type=int, default=settings.bisect_max_requests)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
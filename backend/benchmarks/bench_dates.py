@@ -0,0 +1,60 @@
+"""Date parsing over N rows: per-row dateutil + ZoneInfo vs the detected, cached DateParser.
+
+Usage (from backend/):
+    python -m benchmarks.bench_dates --rows 1000000
+"""
+import argparse
+import random
+from datetime import datetime
+from typing import Optional
+
+from ._common import Timer
+
+from dateutil import parser as date_parser
+from zoneinfo import ZoneInfo
+
+from app.utils.time import detect_date_format, get_date_parser
+
+TZ = "America/Guayaquil"
+
+
+def legacy_parse(date_str: str, timezone_name: str = TZ) -> Optional[int]:
+    """Previous parse_date_to_unix_seconds: new ZoneInfo and generic dateutil on every call."""
+    tz = ZoneInfo(timezone_name)
+    try:
+        if len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-":
+            dt = datetime.strptime(date_str, "%Y-%m-%d").replace(hour=12, tzinfo=tz)
+        else:
+            parsed = date_parser.parse(date_str, dayfirst=False, yearfirst=False)
+            dt = datetime(parsed.year, parsed.month, parsed.day, hour=12, tzinfo=tz)
+        return int(dt.timestamp())
+    except Exception:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    # Fybeca-style D/M/YY over the second half of September
+    dates = [f"{rnd.randint(16, 30)}/9/25" for _ in range(args.rows)]
+
+    with Timer() as t_legacy:
+        for d in dates:
+            legacy_parse(d)
+
+    with Timer() as t_new:
+        fmt = detect_date_format(dates[:1000])
+        parse = get_date_parser(TZ, fmt)
+        for d in dates:
+            parse(d)
+
+    print(f"{args.rows:,} dates, detected format: {fmt}")
+    print(f"dateutil per row : {args.rows / t_legacy.elapsed:>12,.0f} rows/s")
+    print(f"DateParser       : {args.rows / t_new.elapsed:>12,.0f} rows/s  ({t_legacy.elapsed / t_new.elapsed:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Re-uploading an overlapping file with and without the cross-upload duplicate index.
+
+A first file is sent in full, then a second one sharing `--overlap` of its rows
+(as when the 01-15 and 16-30 exports overlap) is sent twice: skipping
+events the first upload already sent, and sending everything again.
+
+Usage (from backend/):
+    python -m benchmarks.bench_dedup --rows 200000 --overlap 0.9 --latency 0.2
+"""
+import argparse
+import asyncio
+
+from ._common import SAMPLE_CSV, Timer, WORK_DIR
+
+from app.services.capi_client import CapiClient
+from app.services.dedup import sent_event_index
+from app.services.dispatcher import BatchDispatcher
+from app.services.progress import JobProgress, ProgressStore
+from app.services.transform import TransformConfig, iter_event_batches
+
+from .mock_graph import MockGraph, mock_transport
+
+DATASET = "bench-dedup"
+
+
+def unique_rows(count: int) -> list:
+    """`count` rows from the sample file, each repetition with its own invoice numbers."""
+    lines = [line for line in SAMPLE_CSV.read_text(encoding="utf-8").splitlines()[1:] if line.strip()]
+    rows = []
+    for i in range(count):
+        fields = lines[i % len(lines)].split(",")
+        fields[2] = f"{fields[2]}{i // len(lines):05d}"  # FACTURA
+        rows.append(",".join(fields))
+    return rows
+
+
+def write_csv(name: str, rows: list):
+    header = SAMPLE_CSV.read_text(encoding="utf-8").splitlines()[0]
+    path = WORK_DIR / name
+    path.write_text(header + "\n" + "\n".join(rows) + "\n", encoding="utf-8")
+    return path
+
+
+async def send(store: ProgressStore, path, job_id: str, skip_duplicates: bool, latency: float):
+    graph = MockGraph(latency=latency)
+    client = CapiClient(access_token="bench", transport=mock_transport(graph))
+    dispatcher = BatchDispatcher(
+        client, DATASET, None, max_in_flight=4, on_sent=lambda batch: sent_event_index.add(DATASET, job_id, batch.event_keys)
+    )
+    progress = JobProgress(job_id=job_id, status="running")
+    cfg = TransformConfig(dataset_id=DATASET, skip_duplicates=skip_duplicates)
+    with Timer() as t:
+        for batch in iter_event_batches(path, cfg, progress, store, 999):
+            await dispatcher.submit(batch)
+        await dispatcher.drain()
+    await client.close()
+    return t.elapsed, progress, graph.stats.events
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--overlap", type=float, default=0.9)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated round-trip in seconds")
+    args = parser.parse_args()
+
+    rows = unique_rows(args.rows + int(args.rows * (1 - args.overlap)))
+    first = write_csv("first.csv", rows[: args.rows])
+    second = write_csv("second.csv", rows[args.rows - int(args.rows * args.overlap):])
+    store = ProgressStore(WORK_DIR / "uploads-bench")
+
+    elapsed, progress, sent = asyncio.run(send(store, first, "first", True, args.latency))
+    print(f"first upload        {elapsed:7.1f}s  sent {sent:>9,}")
+    for label, job_id, skip in (("re-upload, dedup   ", "second", True), ("re-upload, no dedup", "third", False)):
+        elapsed, progress, sent = asyncio.run(send(store, second, job_id, skip, args.latency))
+        print(f"{label} {elapsed:7.1f}s  sent {sent:>9,}  skipped {progress.skipped_duplicates:>9,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Send throughput against the mock Graph API for different in-flight windows.
+
+Usage (from backend/):
+    python -m benchmarks.bench_dispatch --batches 40 --latency 0.5 --concurrency 1 2 4 8 16
+"""
+import argparse
+import asyncio
+
+from ._common import Timer
+
+from app.services.batches import build_batch_from_dicts
+from app.services.capi_client import CapiClient
+from app.services.dispatcher import BatchDispatcher
+
+from .mock_graph import MockGraph, mock_transport
+
+
+def make_batch(size: int) -> list:
+    return [
+        {
+            "event_name": "Purchase",
+            "event_time": 1756746000,
+            "user_data": {"em": "a" * 64, "ph": "b" * 64},
+            "custom_data": {"value": 9.99, "currency": "USD", "order_id": str(i), "content_ids": ["100"], "content_type": "product"},
+            "action_source": "physical_store",
+            "event_id": str(i),
+        }
+        for i in range(size)
+    ]
+
+
+async def run(batches: int, batch_size: int, latency: float, concurrency: int, capacity: int = 0) -> tuple[float, MockGraph]:
+    graph = MockGraph(latency=latency, capacity=capacity)
+    client = CapiClient(access_token="bench", transport=mock_transport(graph))
+    # One dataset per run so each run starts with a fresh rate controller
+    dispatcher = BatchDispatcher(client, f"bench-dataset-{concurrency}", None, max_in_flight=concurrency)
+    batch = build_batch_from_dicts(make_batch(batch_size))
+    with Timer() as t:
+        for _ in range(batches):
+            await dispatcher.submit(batch)
+        await dispatcher.drain()
+    await client.close()
+    return dispatcher.sent_events / t.elapsed, graph
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=999)
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated round-trip in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--capacity", type=int, default=0, help="mock server answers 429 above this many concurrent calls")
+    args = parser.parse_args()
+
+    print(f"batches: {args.batches} x {args.batch_size} events, latency {args.latency}s, capacity {args.capacity or 'unlimited'}")
+    for concurrency in args.concurrency:
+        rate, graph = asyncio.run(run(args.batches, args.batch_size, args.latency, concurrency, args.capacity))
+        print(
+            f"in-flight={concurrency:<3} {rate:>10,.0f} events/s  "
+            f"(max concurrent at server: {graph.stats.max_in_flight}, 429s: {graph.stats.status_codes.get(429, 0)})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Microbenchmark: EC mobile fast path vs phonenumbers for the formats found in our exports.
+
+Usage (from backend/):
+    python -m benchmarks.bench_phone --n 200000
+"""
+import argparse
+import random
+
+from ._common import Timer
+
+from app.utils.normalization import _normalize_phone_with_phonenumbers, normalize_phone_to_cc_digits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    nationals = [rnd.choice(["98", "99", "96"]) + f"{rnd.randrange(10**7):07d}" for _ in range(args.n)]
+    phones = [rnd.choice(["0{}", "+593{}"]).format(n) for n in nationals]
+
+    with Timer() as t_lib:
+        expected = [_normalize_phone_with_phonenumbers(p, "EC") for p in phones]
+    with Timer() as t_fast:
+        got = [normalize_phone_to_cc_digits(p, "EC") for p in phones]
+
+    assert got == expected
+    print(f"{args.n:,} phones (09XXXXXXXX / +5939XXXXXXXX)")
+    print(f"phonenumbers: {t_lib.elapsed / args.n * 1e6:6.2f} µs/phone")
+    print(f"fast path   : {t_fast.elapsed / args.n * 1e6:6.2f} µs/phone  ({t_lib.elapsed / t_fast.elapsed:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
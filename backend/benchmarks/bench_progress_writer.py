@@ -0,0 +1,47 @@
+"""Rows/sec of the transform with per-row progress writes vs the throttled writer.
+
+Usage (from backend/):
+    python -m benchmarks.bench_progress_writer --rows 1000000
+"""
+import argparse
+import json
+
+from ._common import Timer, WORK_DIR, scaled_csv
+
+from app.services.progress import JobProgress, ProgressStore
+from app.services.transform import TransformConfig, iter_transform_events
+
+
+class PerRowProgressStore(ProgressStore):
+    """Previous behaviour: rewrite progress.json on every row."""
+
+    def update(self, progress: JobProgress) -> None:
+        with self._lock:
+            (self.job_dir(progress.job_id) / "progress.json").write_text(json.dumps(progress.to_dict(), ensure_ascii=False))
+
+
+def run(store: ProgressStore, input_path, job_id: str) -> float:
+    progress = JobProgress(job_id=job_id, status="running")
+    cfg = TransformConfig(dataset_id="bench")
+    with Timer() as t:
+        for _ in iter_transform_events(input_path, cfg, progress, store):
+            pass
+    return progress.processed_rows / t.elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    input_path = scaled_csv(args.rows)
+    before = run(PerRowProgressStore(WORK_DIR / "before"), input_path, "before")
+    after = run(ProgressStore(WORK_DIR / "after"), input_path, "after")
+
+    print(f"rows: {args.rows}")
+    print(f"per-row writes : {before:,.0f} rows/s")
+    print(f"throttled      : {after:,.0f} rows/s  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Recovering the batches Meta rejected: retry from the spool versus re-uploading.
+
+A job is run through the scheduler against the mock Graph API with
+`--reject-rate` of its requests answered with a 400. Its rejected batches
+are then sent again with the retry-failed runner, and the whole file is
+uploaded again as a new job for comparison.
+
+Usage (from backend/):
+    python -m benchmarks.bench_retry_failed --rows 200000 --reject-rate 0.05 --latency 0.2
+"""
+import argparse
+import asyncio
+import logging
+import shutil
+from dataclasses import asdict
+
+from ._common import Timer, scaled_csv
+
+from app.api.uploads import _process_job  # noqa: F401  (registers the scheduler's runner)
+from app.services.capi_client import shared_http
+from app.services.progress import JobProgress, progress_store
+from app.services.scheduler import QueuedJob, job_scheduler
+from app.services.transform import TransformConfig
+
+from .mock_graph import MockGraph, mock_transport
+
+
+async def run(job: QueuedJob) -> JobProgress:
+    job_scheduler.enqueue(job)
+    while job_scheduler.is_queued(job.job_id) or job_scheduler.is_running(job.job_id):
+        await asyncio.sleep(0.05)
+    return progress_store.get(job.job_id)
+
+
+def new_job(job_id: str, path, cfg: TransformConfig) -> None:
+    shutil.copyfile(path, progress_store.input_path(job_id))
+    progress_store.set(JobProgress(job_id=job_id, status="pending"))
+    progress_store.save_job_config(job_id, asdict(cfg))
+
+
+async def main_async(args) -> None:
+    logging.disable(logging.CRITICAL)  # one log line per rejected batch otherwise
+    graph = MockGraph(latency=args.latency, reject_rate=args.reject_rate)
+    shared_http.start(mock_transport(graph))
+    path = scaled_csv(args.rows)
+    cfg = TransformConfig(dataset_id="bench", skip_duplicates=False)
+    try:
+        new_job("first", path, cfg)
+        with Timer() as t:
+            progress = await run(QueuedJob("first", cfg.company, cfg, "bench"))
+        spool_size = progress_store.failed_spool_path("first").stat().st_size
+        print(f"upload          {t.elapsed:7.1f}s  {progress.message}")
+        print(f"  spool: {progress.failed_batches} batches, {progress.failed_batch_events:,} events, {spool_size:,} bytes")
+
+        graph.reject_rate = 0.0
+        with Timer() as t:
+            progress = await run(QueuedJob("first", cfg.company, cfg, "bench", retry_failed=True))
+        print(f"retry-failed    {t.elapsed:7.1f}s  {progress.message}")
+
+        new_job("again", path, cfg)
+        with Timer() as t:
+            progress = await run(QueuedJob("again", cfg.company, cfg, "bench"))
+        print(f"full re-upload  {t.elapsed:7.1f}s  {progress.message}")
+    finally:
+        await shared_http.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--reject-rate", type=float, default=0.05, help="share of requests answered with a 400")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated round-trip in seconds")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Serialization time and bytes per batch: httpx `json=` (stdlib) vs pre-serialized bodies.
+
+Usage (from backend/):
+    python -m benchmarks.bench_serialization --batches 50
+"""
+import argparse
+import json
+
+from ._common import Timer, WORK_DIR, scaled_csv
+
+from app.services.batches import build_batch, encode_event
+from app.services.progress import JobProgress, ProgressStore
+from app.services.transform import TransformConfig, iter_transform_events
+from app.utils import jsonenc
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=999)
+    args = parser.parse_args()
+
+    input_path = scaled_csv(args.batch_size)
+    progress = JobProgress(job_id="serialization", status="running")
+    events = list(iter_transform_events(input_path, TransformConfig(dataset_id="bench"), progress, ProgressStore(WORK_DIR / "up")))
+    upload_tag = "fybeca-sept-2025"
+
+    with Timer() as t_stdlib:
+        for _ in range(args.batches):
+            # What httpx does with json=payload
+            stdlib_body = json.dumps({"data": events, "upload_tag": upload_tag}).encode("utf-8")
+
+    with Timer() as t_fast:
+        for _ in range(args.batches):
+            fast = build_batch([encode_event(e) for e in events], upload_tag=upload_tag)
+
+    with Timer() as t_gzip:
+        for _ in range(args.batches):
+            gz = build_batch([encode_event(e) for e in events], upload_tag=upload_tag, compress=True)
+
+    assert json.loads(fast.body) == json.loads(stdlib_body)
+    per_batch = lambda t: t.elapsed / args.batches * 1000  # noqa: E731
+    print(f"{len(events)} events/batch, serializer: {'orjson' if jsonenc.orjson else 'stdlib json'}")
+    print(f"httpx json= (stdlib) : {per_batch(t_stdlib):7.2f} ms/batch  {len(stdlib_body):>9,} bytes")
+    print(f"pre-serialized       : {per_batch(t_fast):7.2f} ms/batch  {len(fast.body):>9,} bytes")
+    print(f"pre-serialized + gzip: {per_batch(t_gzip):7.2f} ms/batch  {len(gz.body):>9,} bytes")
+
+
+if __name__ == "__main__":
+    main()
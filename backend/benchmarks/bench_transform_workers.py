@@ -0,0 +1,51 @@
+"""Rows/sec of the transform engine as the number of worker processes grows.
+
+Usage (from backend/):
+    python -m benchmarks.bench_transform_workers --rows 1000000 --workers 1 2 4 8
+"""
+import argparse
+import os
+
+from ._common import Timer, WORK_DIR, scaled_csv
+
+from app.services.progress import JobProgress, ProgressStore
+from app.services.transform import TransformConfig, iter_event_batches
+from app.services.transform_pool import get_pool, iter_event_batches_parallel, shutdown_pool
+
+
+def run(store: ProgressStore, input_path, workers: int, chunk_bytes: int) -> float:
+    progress = JobProgress(job_id=f"workers-{workers}", status="running")
+    cfg = TransformConfig(dataset_id="bench")
+    with Timer() as t:
+        if workers == 1:
+            batches = iter_event_batches(input_path, cfg, progress, store, 999)
+        else:
+            batches = iter_event_batches_parallel(input_path, cfg, progress, store, 999, workers=workers, chunk_bytes=chunk_bytes)
+        for _ in batches:
+            pass
+    return progress.processed_rows / t.elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--chunk-bytes", type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    input_path = scaled_csv(args.rows)
+    store = ProgressStore(WORK_DIR / "uploads-bench")
+    print(f"rows: {args.rows}, cpu_count: {os.cpu_count()}")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        if workers > 1:
+            # Warm up the pool so process start-up is not part of the measurement
+            get_pool(workers).submit(int).result()
+        rate = run(store, input_path, workers, args.chunk_bytes)
+        baseline = baseline or rate
+        print(f"workers={workers:<3} {rate:>12,.0f} rows/s  ({rate / baseline:.2f}x)")
+    shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Local stand-in for the Graph API `/{version}/{dataset_id}/events` endpoint.
+
+Two ways to use it:
+
+* In-process, via `mock_transport(...)` passed to `CapiClient(transport=...)`.
+* As a server for the real app:
+      python -m benchmarks.mock_graph --port 8001 --latency 1.0
+  and start the backend with GRAPH_API_BASE_URL=http://localhost:8001
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class MockGraphStats:
+    requests: int = 0
+    events: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    bytes_received: int = 0
+    status_codes: dict = field(default_factory=dict)
+
+
+class MockGraph:
+    """`capacity` > 0 simulates Meta throttling: requests beyond that many concurrent
+    calls get a 429 with Retry-After, and every response carries `x-app-usage`.
+
+    `reject_rate` is the share of requests answered with a (non-retryable) 400
+    for the whole request (Meta's code 2, temporary), picked at random with a
+    fixed seed. A request with any event whose
+    event_id is in `reject_event_ids` is answered with a 400 too, as Meta
+    rejects a whole batch over one invalid event."""
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        capacity: int = 0,
+        reject_rate: float = 0.0,
+        seed: int = 7,
+        reject_event_ids: Iterable[str] = (),
+    ) -> None:
+        self.latency = latency
+        self.capacity = capacity
+        self.reject_rate = reject_rate
+        self.reject_event_ids = set(reject_event_ids)
+        self._random = random.Random(seed)
+        self.stats = MockGraphStats()
+
+    def _usage_headers(self) -> dict:
+        if not self.capacity:
+            return {}
+        pct = min(100, int(self.stats.in_flight * 100 / self.capacity))
+        return {"x-app-usage": json.dumps({"call_count": pct, "total_cputime": 0, "total_time": pct})}
+
+    async def handle(self, body: bytes, headers) -> tuple[int, dict, dict]:
+        """Return `(status_code, json_body, response_headers)` for one request."""
+        self.stats.requests += 1
+        self.stats.bytes_received += len(body)
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            if self.capacity and self.stats.in_flight > self.capacity:
+                self.stats.status_codes[429] = self.stats.status_codes.get(429, 0) + 1
+                error = {"error": {"message": "Application request limit reached", "code": 4}}
+                return 429, error, {"retry-after": "1", **self._usage_headers()}
+            await asyncio.sleep(self.latency)
+            if headers.get("content-encoding") == "gzip":
+                body = gzip.decompress(body)
+            payload = json.loads(body or b"{}")
+            events = payload.get("data", [])
+            if self.reject_rate and self._random.random() < self.reject_rate:
+                self.stats.status_codes[400] = self.stats.status_codes.get(400, 0) + 1
+                error = {"message": "Service temporarily unavailable", "type": "OAuthException", "code": 2}
+                return 400, {"error": error}, {}
+            bad = next((e.get("event_id") for e in events if e.get("event_id") in self.reject_event_ids), None)
+            if bad is not None:
+                self.stats.status_codes[400] = self.stats.status_codes.get(400, 0) + 1
+                error = {
+                    "message": "Invalid parameter",
+                    "type": "OAuthException",
+                    "code": 100,
+                    "error_subcode": 2804003,
+                    "error_user_title": "Invalid event",
+                    "error_user_msg": f"The event with event_id {bad} has an invalid parameter",
+                    "fbtrace_id": "mock",
+                }
+                return 400, {"error": error}, {}
+            self.stats.events += len(events)
+            status, content = 200, {"events_received": len(events), "messages": [], "fbtrace_id": "mock"}
+            self.stats.status_codes[status] = self.stats.status_codes.get(status, 0) + 1
+            return status, content, self._usage_headers()
+        finally:
+            self.stats.in_flight -= 1
+
+
+def mock_transport(graph: MockGraph) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        status, content, headers = await graph.handle(await request.aread(), request.headers)
+        return httpx.Response(status, json=content, headers=headers)
+
+    return httpx.MockTransport(handler)
+
+
+def create_mock_graph_app(graph: MockGraph) -> FastAPI:
+    app = FastAPI(title="Mock Graph API")
+
+    @app.post("/{version}/{dataset_id}/events")
+    async def events(version: str, dataset_id: str, request: Request):
+        status, content, headers = await graph.handle(await request.body(), request.headers)
+        return JSONResponse(content, status_code=status, headers=headers)
+
+    @app.get("/stats")
+    async def stats():
+        return graph.stats.__dict__
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--capacity", type=int, default=0, help="concurrent calls before answering 429 (0 = never)")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="share of requests answered with a 400")
+    parser.add_argument("--reject-event-ids", nargs="*", default=[], help="event_ids that make a request fail with a 400")
+    args = parser.parse_args()
+    graph = MockGraph(
+        latency=args.latency, capacity=args.capacity, reject_rate=args.reject_rate, reject_event_ids=args.reject_event_ids
+    )
+    uvicorn.run(create_mock_graph_app(graph), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,30 @@ const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000
 type JobProgress = {
   job_id: string
   total_rows: number
+  total_rows_exact: boolean
+  estimated_total_rows: number
+  total_bytes: number
+  uploaded_bytes: number
+  upload_complete: boolean
+  processed_bytes: number
   processed_rows: number
   succeeded: number
   failed: number
+  skipped_duplicates: number
+  aggregated_events: number
+  failed_batches: number
+  failed_batch_events: number
+  rejected_events: number
   status: 'pending' | 'running' | 'completed' | 'failed'
   message: string
+  queue_position: number
 }
 
 export function UploadPage(): JSX.Element {
   const [company, setCompany] = useState<'fybeca' | 'sanasana'>('fybeca')
   const [timezone, setTimezone] = useState('America/Guayaquil')
   const [uploadTag, setUploadTag] = useState('')
+  const [aggregateInvoices, setAggregateInvoices] = useState(false)
   const [jobId, setJobId] = useState<string | null>(null)
   const [progress, setProgress] = useState<JobProgress | null>(null)
   const [isUploading, setIsUploading] = useState(false)
@@ -31,7 +44,14 @@ export function UploadPage(): JSX.Element {
   const DATASET_ID = company === 'fybeca' ? '1182254526484927' : '713504914322620'
   
   const canSubmit = useMemo(() => fileName.length > 0 && uploadTag.trim().length > 0, [fileName, uploadTag])
-  const progressPercent = progress ? Math.round((progress.processed_rows / progress.total_rows) * 100) || 0 : 0
+  // Mientras el total de filas es estimado, el avance real es bytes leídos / tamaño del archivo
+  const progressPercent = progress
+    ? Math.round(
+        (!progress.total_rows_exact && progress.total_bytes > 0
+          ? progress.processed_bytes / progress.total_bytes
+          : progress.processed_rows / progress.total_rows) * 100
+      ) || 0
+    : 0
 
   function handleFileChange(e: React.ChangeEvent<HTMLInputElement>) {
     const file = e.target.files?.[0]
@@ -55,12 +75,13 @@ export function UploadPage(): JSX.Element {
     setWarming(true)
     
     try {
-      const form = new FormData()
-      form.append('file', file)
-      form.append('dataset_id', DATASET_ID)
-      form.append('company', company)
-      if (uploadTag) form.append('upload_tag', uploadTag)
-      if (timezone) form.append('timezone', timezone)
+      // El archivo se envía como cuerpo crudo y se procesa mientras se sube;
+      // el job_id se genera aquí para poder consultar el progreso durante la carga
+      const newJobId = crypto.randomUUID()
+      const params = new URLSearchParams({ dataset_id: DATASET_ID, company, job_id: newJobId, filename: file.name })
+      if (uploadTag) params.append('upload_tag', uploadTag)
+      if (timezone) params.append('timezone', timezone)
+      if (aggregateInvoices) params.append('aggregate_invoices', 'true')
 
       // Usar XMLHttpRequest para progreso REAL del upload
       const xhr = new XMLHttpRequest()
@@ -105,16 +126,41 @@ export function UploadPage(): JSX.Element {
         })
       })
 
-      // Configurar y enviar request
-      xhr.open('POST', `${API_BASE_URL}/api/uploads`)
+      if (file.name.toLowerCase().endsWith('.zip')) {
+        // Un .zip solo se puede leer completo: se sube primero y luego se procesa
+        const form = new FormData()
+        form.append('file', file)
+        form.append('dataset_id', DATASET_ID)
+        form.append('company', company)
+        if (uploadTag) form.append('upload_tag', uploadTag)
+        if (timezone) form.append('timezone', timezone)
+        if (aggregateInvoices) form.append('aggregate_invoices', 'true')
+        xhr.open('POST', `${API_BASE_URL}/api/uploads`)
+        xhr.timeout = 300000 // 5 minutos para archivos grandes
+        xhr.send(form)
+
+        const { job_id } = await uploadPromise
+        setJobId(job_id)
+        setUploadProgress(100)
+        await watchProgress(job_id)
+        return
+      }
+
+      // Configurar y enviar request (.csv, .csv.gz o .csv.zst)
+      xhr.open('POST', `${API_BASE_URL}/api/uploads/stream?${params.toString()}`)
+      xhr.setRequestHeader('Content-Type', 'application/octet-stream')
       xhr.timeout = 300000 // 5 minutos para archivos grandes
-      xhr.send(form)
+      xhr.send(file)
+
+      setJobId(newJobId)
+      let uploadFailed = false
+      uploadPromise.catch(() => { uploadFailed = true })
+      const polling = watchProgress(newJobId, () => uploadFailed)
 
       // Esperar resultado
-      const { job_id } = await uploadPromise
-      setJobId(job_id)
+      await uploadPromise
       setUploadProgress(100)
-      await pollProgress(job_id)
+      await polling
     } catch (err: any) {
       setError(err?.message || 'Error desconocido')
     } finally {
@@ -124,10 +170,45 @@ export function UploadPage(): JSX.Element {
     }
   }
 
-  async function pollProgress(jobId: string) {
+  // Progreso por Server-Sent Events: el servidor envía solo los campos que cambian
+  async function watchProgress(jobId: string, uploadFailed: () => boolean = () => false) {
+    if (typeof EventSource === 'undefined') return pollProgress(jobId, uploadFailed)
+    while (true) {
+      const outcome = await new Promise<'done' | 'retry' | 'poll'>((resolve) => {
+        const source = new EventSource(`${API_BASE_URL}/api/jobs/${jobId}/events`)
+        let opened = false
+        source.onopen = () => { opened = true }
+        source.onmessage = (e) => {
+          const delta = JSON.parse(e.data) as Partial<JobProgress>
+          setProgress((prev) => ({ ...(prev ?? {}), ...delta }) as JobProgress)
+        }
+        source.addEventListener('end', () => {
+          source.close()
+          resolve('done')
+        })
+        source.onerror = () => {
+          source.close()
+          // Sin conexión antes de abrir: el job aún no existe (404). Si se cortó después, se consulta por polling
+          resolve(opened ? 'poll' : 'retry')
+        }
+      })
+      if (outcome === 'done') return
+      if (outcome === 'poll') return pollProgress(jobId, uploadFailed)
+      if (uploadFailed()) return
+      await new Promise((r) => setTimeout(r, 500))
+    }
+  }
+
+  async function pollProgress(jobId: string, uploadFailed: () => boolean = () => false) {
     let done = false
     while (!done) {
       const res = await fetch(`${API_BASE_URL}/api/jobs/${jobId}`)
+      if (res.status === 404) {
+        // El job se crea cuando el servidor recibe el inicio de la carga
+        if (uploadFailed()) return
+        await new Promise((r) => setTimeout(r, 500))
+        continue
+      }
       if (!res.ok) throw new Error('No se pudo consultar progreso')
       const data = (await res.json()) as JobProgress
       setProgress(data)
@@ -161,6 +242,23 @@ export function UploadPage(): JSX.Element {
     }
   }
 
+  // Reenvía solo los lotes que Meta rechazó, sin volver a leer el archivo
+  async function retryFailedBatches() {
+    if (!jobId) return
+    try {
+      const res = await fetch(`${API_BASE_URL}/api/jobs/${jobId}/retry-failed`, { method: 'POST' })
+      if (!res.ok) {
+        const text = await res.text()
+        setError(`Error al reintentar: ${text}`)
+        return
+      }
+      setError(null)
+      await watchProgress(jobId)
+    } catch (err: any) {
+      setError(`Error al reintentar: ${err.message}`)
+    }
+  }
+
   async function cancelAllJobs() {
     if (!confirm('¿Estás seguro de CANCELAR TODOS los procesos activos?')) return
     
@@ -272,12 +370,26 @@ export function UploadPage(): JSX.Element {
             </span>
           </div>
 
+          <div className="form-group">
+            <label style={{ display: 'flex', alignItems: 'center', gap: '0.5rem', cursor: 'pointer' }}>
+              <input
+                type="checkbox"
+                checked={aggregateInvoices}
+                onChange={(e) => setAggregateInvoices(e.target.checked)}
+              />
+              Agrupar productos por factura (un evento por compra)
+            </label>
+            <span style={{ fontSize: '0.85rem', color: '#6b7280', marginTop: '0.25rem' }}>
+              Suma el valor y lista los productos de cada FACTURA en un solo Purchase
+            </span>
+          </div>
+
           <div className="form-group">
             <label>Archivo CSV *</label>
             <input 
               ref={fileInputRef} 
               type="file" 
-              accept=".csv,.CSV" 
+              accept=".csv,.CSV,.gz,.zst,.zip" 
               onChange={handleFileChange}
               style={{ display: 'none' }}
             />
@@ -310,7 +422,7 @@ export function UploadPage(): JSX.Element {
             {uploadProgress >= 10 && uploadProgress < 30 && '📡 Iniciando transferencia de datos...'}
             {uploadProgress >= 30 && uploadProgress < 70 && `⚡ Transfiriendo archivo... (${Math.round(uploadProgress)}% completado)`}
             {uploadProgress >= 70 && uploadProgress < 95 && '📤 Finalizando transferencia...'}
-            {uploadProgress >= 95 && '✅ Archivo recibido, iniciando procesamiento...'}
+            {uploadProgress >= 95 && '✅ Archivo casi recibido, el procesamiento ya está en curso...'}
           </p>
           <p style={{ textAlign: 'center', color: '#9ca3af', fontSize: '0.85rem', marginTop: '0.5rem' }}>
             💡 No cierres esta ventana. Archivos de 300 MB pueden tardar 2-3 minutos.
@@ -355,12 +467,12 @@ export function UploadPage(): JSX.Element {
                 {progress.status === 'running' && '⚙️ Procesando'}
                 {progress.status === 'completed' && '✅ Completado'}
                 {progress.status === 'failed' && '❌ Falló'}
-                {progress.status === 'pending' && '⏳ Pendiente'}
+                {progress.status === 'pending' && (progress.queue_position > 0 ? `⏳ En cola (#${progress.queue_position})` : '⏳ Pendiente')}
               </span>
             </div>
             <div className="stat">
               <span className="stat-label">Filas procesadas</span>
-              <span className="stat-value">{progress.processed_rows.toLocaleString()} / {progress.total_rows.toLocaleString()}</span>
+              <span className="stat-value">{progress.processed_rows.toLocaleString()} / {progress.total_rows_exact ? '' : '~'}{progress.total_rows.toLocaleString()}</span>
             </div>
             <div className="stat">
               <span className="stat-label">Exitosas</span>
@@ -370,6 +482,30 @@ export function UploadPage(): JSX.Element {
               <span className="stat-label">Errores</span>
               <span className="stat-value stat-error">{progress.failed.toLocaleString()}</span>
             </div>
+            {progress.aggregated_events > 0 && (
+              <div className="stat">
+                <span className="stat-label">Compras (por factura)</span>
+                <span className="stat-value">{progress.aggregated_events.toLocaleString()}</span>
+              </div>
+            )}
+            {progress.skipped_duplicates > 0 && (
+              <div className="stat">
+                <span className="stat-label">Ya enviadas (omitidas)</span>
+                <span className="stat-value">{progress.skipped_duplicates.toLocaleString()}</span>
+              </div>
+            )}
+            {progress.rejected_events > 0 && (
+              <div className="stat">
+                <span className="stat-label">Rechazadas por Meta</span>
+                <span className="stat-value stat-error">{progress.rejected_events.toLocaleString()}</span>
+              </div>
+            )}
+            {progress.failed_batches > 0 && (
+              <div className="stat">
+                <span className="stat-label">En lotes fallidos</span>
+                <span className="stat-value stat-error">{progress.failed_batch_events.toLocaleString()}</span>
+              </div>
+            )}
           </div>
 
           {progress.message && (
@@ -379,12 +515,17 @@ export function UploadPage(): JSX.Element {
           )}
 
           <div style={{ display: 'flex', gap: '1rem', marginTop: '1rem', flexWrap: 'wrap' }}>
-            {progress.failed > 0 && (
+            {(progress.failed > 0 || progress.rejected_events > 0) && (
               <button onClick={downloadErrors} className="btn-secondary">
                 📥 Descargar errores
               </button>
             )}
-            {progress.status === 'running' && (
+            {progress.status === 'failed' && progress.failed_batches > 0 && (
+              <button onClick={retryFailedBatches} className="btn-secondary">
+                🔁 Reintentar {progress.failed_batches.toLocaleString()} lotes fallidos
+              </button>
+            )}
+            {(progress.status === 'running' || progress.status === 'pending') && (
               <button onClick={cancelJob} className="btn-danger">
                 ⏹️ Cancelar proceso
               </button>
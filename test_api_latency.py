@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Latencia de GET /api/jobs/{id} mientras un job grande se procesa (sin red, corre local)
+
+Levanta la API y un Graph API simulado (backend/benchmarks/mock_graph.py) con
+uvicorn en hilos, sube un CSV grande y consulta el progreso sin pausa durante
+todo el job. Falla si el p99 de esas consultas supera LATENCY_P99_MS.
+
+    python test_api_latency.py [--rows 200000] [--p99-ms 150]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+# Usa un directorio temporal para los uploads (debe importarse antes que la app)
+from benchmarks._common import scaled_csv  # noqa: E402
+
+API_PORT = 8765
+GRAPH_PORT = 8766
+os.environ["META_ACCESS_TOKEN"] = "test-token"
+os.environ["GRAPH_API_BASE_URL"] = f"http://127.0.0.1:{GRAPH_PORT}"
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from app.main import app  # noqa: E402
+from benchmarks.mock_graph import MockGraph, create_mock_graph_app  # noqa: E402
+
+# Solo advertencias: los logs por lote ensucian la salida y también cuestan tiempo
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def start_server(asgi_app, port):
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="segundos por llamada al Graph API simulado")
+    parser.add_argument("--p99-ms", type=float, default=float(os.getenv("LATENCY_P99_MS", "150")))
+    args = parser.parse_args()
+
+    graph = MockGraph(latency=args.graph_latency)
+    start_server(create_mock_graph_app(graph), GRAPH_PORT)
+    start_server(app, API_PORT)
+
+    csv_path = scaled_csv(args.rows)
+    print(f"📁 CSV de prueba: {args.rows:,} filas ({csv_path.stat().st_size / 1024 / 1024:.1f} MB)")
+
+    latencies = []
+    with httpx.Client(base_url=f"http://127.0.0.1:{API_PORT}", timeout=30) as client:
+        with csv_path.open("rb") as f:
+            resp = client.post("/api/uploads", files={"file": ("test.csv", f, "text/csv")}, data={"dataset_id": "test-dataset"})
+        resp.raise_for_status()
+        job_id = resp.json()["job_id"]
+        print(f"📤 Job {job_id}")
+
+        started = time.perf_counter()
+        while True:
+            t0 = time.perf_counter()
+            resp = client.get(f"/api/jobs/{job_id}")
+            latencies.append((time.perf_counter() - t0) * 1000)
+            resp.raise_for_status()
+            job = resp.json()
+            if job["status"] not in ("pending", "running"):
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+    print(f"⚙️  Estado final: {job['status']} - {job['message']} ({job['succeeded']:,} enviadas en {elapsed:.1f}s)")
+    print(f"📊 Eventos recibidos por el Graph simulado: {graph.stats.events:,}")
+    p50, p99 = statistics.median(latencies), percentile(latencies, 99)
+    print(f"⏱️  GET /api/jobs/{{id}}: {len(latencies):,} consultas, p50 {p50:.1f} ms, p99 {p99:.1f} ms, máx {max(latencies):.1f} ms")
+
+    ok = job["status"] == "completed" and graph.stats.events == job["succeeded"] and p99 <= args.p99_ms
+    print("✅ OK" if ok else f"❌ FALLÓ (p99 permitido: {args.p99_ms:.0f} ms)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
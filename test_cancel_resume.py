@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Cancelar un job a mitad de envío y reanudarlo no debe reenviar lo que Meta ya aceptó (sin red, corre local)
+
+Envía un CSV contra el Graph API simulado con una capacidad menor que los lotes
+en vuelo, así algunos lotes reciben 429 y terminan fuera de orden. El job se
+cancela a mitad de envío y se reanuda. Entre las dos corridas Meta debe recibir
+tantos eventos como filas, con un margen de como mucho los lotes en vuelo
+(MAX_IN_FLIGHT_BATCHES × BATCH_SIZE). Se prueba con el transform secuencial y
+con el paralelo.
+
+    python test_cancel_resume.py [--rows 30000]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+# Usa un directorio temporal para los uploads (debe importarse antes que la app)
+from benchmarks._common import scaled_csv  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services.capi_client import shared_http  # noqa: E402
+from app.services.progress import progress_store  # noqa: E402
+from app.services.scheduler import QueuedJob, job_scheduler  # noqa: E402
+from app.services.transform import TransformConfig  # noqa: E402
+from benchmarks.bench_retry_failed import new_job, run  # noqa: E402
+from benchmarks.mock_graph import MockGraph, mock_transport  # noqa: E402
+
+BATCH_SIZE = 500
+
+
+async def cancel_and_resume(job_id, path, rows, graph):
+    cfg = TransformConfig(dataset_id="test", skip_duplicates=False)
+    new_job(job_id, path, cfg)
+    start = graph.stats.events
+    first = asyncio.ensure_future(run(QueuedJob(job_id, cfg.company, cfg, "test")))
+    while graph.stats.events - start < rows * 0.3:
+        await asyncio.sleep(0.01)
+    job_scheduler.cancel(job_id)
+    progress = await first
+    sent_first = graph.stats.events - start
+    checkpoint = progress_store.get_checkpoint(job_id)
+    print(f"   Cancelado: {progress.status}, {sent_first:,} eventos enviados, checkpoint en el lote {checkpoint.batches_done}")
+
+    progress = await run(QueuedJob(job_id, cfg.company, cfg, "test", resume=True))
+    sent_second = graph.stats.events - start - sent_first
+    total = sent_first + sent_second
+    print(f"   Reanudado: {progress.status}, {sent_second:,} eventos enviados; total {total:,} para {rows:,} filas")
+    margin = settings.max_in_flight_batches * BATCH_SIZE
+    ok = True
+    if progress.status != "completed":
+        print(f"   ❌ El job reanudado no terminó: {progress.message}")
+        ok = False
+    if total < rows:
+        print(f"   ❌ Faltan {rows - total:,} eventos")
+        ok = False
+    if total > rows + margin:
+        print(f"   ❌ Se reenviaron {total - rows:,} eventos, más que los lotes en vuelo ({margin:,})")
+        ok = False
+    return ok
+
+
+async def main_async(rows):
+    logging.disable(logging.CRITICAL)
+    settings.batch_size = BATCH_SIZE
+    settings.retry_backoff_base = 0.2
+    path = scaled_csv(rows)
+    graph = MockGraph(latency=0.05, capacity=settings.max_in_flight_batches - 1)
+    shared_http.start(mock_transport(graph))
+    ok = True
+    try:
+        for label, workers in (("secuencial", 1), ("paralelo", 2)):
+            print(f"\n🔄 Transform {label}")
+            settings.transform_workers = workers
+            ok = await cancel_and_resume(f"resume-{label}", path, rows, graph) and ok
+    finally:
+        await shared_http.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=30_000)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🧪 CANCELAR Y REANUDAR SIN REENVIAR LO YA ACEPTADO")
+    print("=" * 60)
+    ok = asyncio.run(main_async(args.rows))
+    print("\n✅ OK" if ok else "\n❌ FALLÓ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
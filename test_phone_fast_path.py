@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Paridad del fast path de celulares EC contra phonenumbers (sin red, corre local)"""
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+# Usar un directorio temporal para no crear backend/uploads al importar la app
+os.environ.setdefault("UPLOADS_DIR", tempfile.mkdtemp(prefix="capi-test-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+from app.utils.normalization import (  # noqa: E402
+    _fast_ec_mobile,
+    _normalize_phone_with_phonenumbers,
+    normalize_phone_to_cc_digits,
+)
+
+CORPUS_SIZE = 200_000
+
+
+def generate_corpus(n, seed=2025):
+    rnd = random.Random(seed)
+    digits = "0123456789"
+    corpus = []
+    for _ in range(n):
+        # La mitad con prefijos móviles reales (98, 99, 96...) y el resto 9XXXXXXXX al azar
+        prefix = rnd.choice(["98", "99", "96", "97", "95", "93"]) if rnd.random() < 0.5 else "9" + rnd.choice(digits)
+        national = prefix + "".join(rnd.choice(digits) for _ in range(7))
+        kind = rnd.randrange(12)
+        if kind == 0:
+            corpus.append("0" + national)
+        elif kind == 1:
+            corpus.append(national)
+        elif kind == 2:
+            corpus.append("+593" + national)
+        elif kind == 3:
+            corpus.append("593" + national)
+        elif kind == 4:
+            corpus.append("+5930" + national)  # prefijo nacional después del código de país
+        elif kind == 5:
+            corpus.append(f"0{national[:2]} {national[2:5]} {national[5:]}")
+        elif kind == 6:
+            corpus.append("0" + national[:-1])  # un dígito de menos
+        elif kind == 7:
+            corpus.append("0" + national + rnd.choice(digits))  # un dígito de más
+        elif kind == 8:
+            # fijos y otros prefijos
+            corpus.append("0" + rnd.choice("234567") + "".join(rnd.choice(digits) for _ in range(7)))
+        elif kind == 9:
+            corpus.append("+" + "".join(rnd.choice(digits) for _ in range(rnd.randint(8, 14))))
+        elif kind == 10:
+            corpus.append("".join(rnd.choice(digits) for _ in range(rnd.randint(1, 15))))
+        else:
+            corpus.append(rnd.choice(["", " ", "N/A", "5.93982E+11", "0987-654-321", "(09)87654321", "+1 202 555 0143"]))
+    return corpus
+
+
+def main():
+    print("=" * 60)
+    print("🧪 PARIDAD FAST PATH CELULARES EC vs phonenumbers")
+    print("=" * 60)
+
+    corpus = generate_corpus(CORPUS_SIZE)
+    mismatches = []
+    fast_hits = 0
+    for region in ("EC", "CO"):
+        for phone in corpus:
+            if _fast_ec_mobile(phone.strip(), region) is not None:
+                fast_hits += 1
+            expected = _normalize_phone_with_phonenumbers(phone.strip(), region) if phone else None
+            got = normalize_phone_to_cc_digits(phone, default_region=region)
+            if got != expected:
+                mismatches.append((region, phone, expected, got))
+
+    total = len(corpus) * 2
+    print(f"\n   Números probados: {total:,}")
+    print(f"   Resueltos por fast path: {fast_hits:,} ({fast_hits * 100 / total:.1f}%)")
+    if mismatches:
+        print(f"\n❌ {len(mismatches)} diferencias. Primeras 10:")
+        for region, phone, expected, got in mismatches[:10]:
+            print(f"   [{region}] {phone!r}: phonenumbers={expected!r} fast={got!r}")
+        sys.exit(1)
+    print("\n✅ Fast path idéntico a phonenumbers en todo el corpus")
+
+
+if __name__ == "__main__":
+    main()
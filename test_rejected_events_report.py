@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Reporte de errores de un job sin filas inválidas pero con eventos rechazados por Meta (sin red, corre local)
+
+Envía un CSV sin errores de transformación contra el Graph API simulado, que
+rechaza los eventos de una factura. El errors.csv debe conservar la cabecera
+del archivo subido (CORREO, CELULAR...) más _error_reason, tanto con el
+transform secuencial como con el paralelo.
+
+    python test_rejected_events_report.py
+"""
+import asyncio
+import csv
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+# Usa un directorio temporal para los uploads (debe importarse antes que la app)
+from benchmarks._common import SAMPLE_CSV  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services.capi_client import shared_http  # noqa: E402
+from app.services.progress import META_REJECTION_PREFIX, progress_store  # noqa: E402
+from app.services.transform import TransformConfig  # noqa: E402
+from benchmarks.bench_bisect import send  # noqa: E402
+from benchmarks.bench_dedup import unique_rows, write_csv  # noqa: E402
+from benchmarks.mock_graph import MockGraph, mock_transport  # noqa: E402
+
+ROWS = 2_000
+
+
+def check(job_id, progress, expected_header):
+    path = progress_store.errors_csv_path(job_id)
+    if not path.exists():
+        print("   ❌ No se generó errors.csv")
+        return False
+    with path.open(newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        header, rows = reader.fieldnames, list(reader)
+    print(f"   Filas inválidas: {progress.failed}  Eventos rechazados: {progress.rejected_events}  Filas en errors.csv: {len(rows)}")
+    print(f"   Cabecera: {','.join(header or [])}")
+    ok = True
+    if progress.failed != 0:
+        print("   ❌ El CSV de prueba no debería tener errores de transformación")
+        ok = False
+    if progress.rejected_events < 1:
+        print("   ❌ Meta no rechazó ningún evento")
+        ok = False
+    if header != expected_header:
+        print(f"   ❌ Cabecera distinta de la esperada: {','.join(expected_header)}")
+        ok = False
+    if len(rows) != progress.rejected_events or not all(r["_error_reason"].startswith(META_REJECTION_PREFIX) for r in rows):
+        print("   ❌ errors.csv no coincide con los eventos rechazados")
+        ok = False
+    return ok
+
+
+async def run():
+    logging.disable(logging.CRITICAL)
+    rows = unique_rows(ROWS)
+    path = write_csv("rejected_report.csv", rows)
+    expected_header = SAMPLE_CSV.read_text(encoding="utf-8").splitlines()[0].split(",") + ["_error_reason"]
+    graph = MockGraph(latency=0.0, reject_event_ids={rows[10].split(",")[2]})
+    shared_http.start(mock_transport(graph))
+    cfg = TransformConfig(dataset_id="test", skip_duplicates=False)
+    ok = True
+    try:
+        for label, workers in (("secuencial", 1), ("paralelo", 2)):
+            print(f"\n🔄 Transform {label}")
+            settings.transform_workers = workers
+            _, progress, _, _ = await send(f"rejected-{label}", path, cfg, graph)
+            ok = check(f"rejected-{label}", progress, expected_header) and ok
+    finally:
+        await shared_http.close()
+    return ok
+
+
+def main():
+    print("=" * 60)
+    print("🧪 REPORTE DE ERRORES CON EVENTOS RECHAZADOS POR META")
+    print("=" * 60)
+    ok = asyncio.run(run())
+    print("\n✅ OK" if ok else "\n❌ FALLÓ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())